@@ -0,0 +1,169 @@
+"""
+A local OpenAI-compatible /v1/embeddings server for benchmarks.
+
+Embeddings are deterministic unit vectors seeded by the input text. The
+server honours encoding_format (float/base64) and Accept-Encoding: gzip, and
+can inject latency and failures to exercise the client.
+
+Usage:
+    python -m benchmarks.embedding_stub --port 8765 --dim 1024
+"""
+
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+def stub_embedding(text: str, dim: int) -> np.ndarray:
+    seed = int(hashlib.md5(text.encode("utf8")).hexdigest()[:8], 16)
+    vector = np.random.default_rng(seed).standard_normal(dim).astype("<f4")
+    return vector / np.linalg.norm(vector)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        options = self.server.options  # type: ignore[attr-defined]
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        texts = body["input"]
+        texts = [texts] if isinstance(texts, str) else texts
+        encoding_format = body.get("encoding_format", "float")
+
+        if options["latency_ms"] > 0:
+            time.sleep(options["latency_ms"] / 1000)
+        if random.random() < options["fail_rate"]:
+            return self.reply(503, {"error": "overloaded"})
+        if options["max_batch"] and len(texts) > options["max_batch"]:
+            return self.reply(413, {"error": "batch too large"})
+        if encoding_format == "base64" and options["no_base64"]:
+            return self.reply(400, {"error": "unsupported encoding_format"})
+
+        data = []
+        for i, text in enumerate(texts):
+            vector = stub_embedding(text, options["dim"])
+            if encoding_format == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        self.reply(200, {"object": "list", "data": data, "model": body.get("model")})
+
+    def reply(self, status: int, payload: dict):
+        content = json.dumps(payload).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            content = gzip.compress(content, compresslevel=1)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_stub_server(
+    port: int = 0,
+    dim: int = 1024,
+    latency_ms: float = 0,
+    fail_rate: float = 0,
+    max_batch: int = 0,
+    no_base64: bool = False,
+) -> ThreadingHTTPServer:
+    """Create the server (port 0 picks a free port, see server.server_port)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.options = {  # type: ignore[attr-defined]
+        "dim": dim,
+        "latency_ms": latency_ms,
+        "fail_rate": fail_rate,
+        "max_batch": max_batch,
+        "no_base64": no_base64,
+    }
+    return server
+
+
+def start_stub_server(**options) -> tuple[ThreadingHTTPServer, str]:
+    """Serve in a background thread of this process; returns (server, url)."""
+    server = create_stub_server(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def spawn_stub_server(dim: int = 1024, timeout: float = 10):
+    """
+    Run the stub in a separate process (so that it does not compete with the
+    measured client for the GIL) and wait until it answers.
+
+    :return: (process, url); terminate the process when done
+    """
+    import requests
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.embedding_stub",
+            "--port",
+            str(port),
+            "--dim",
+            str(dim),
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            requests.post(url + "/v1/embeddings", json={"input": ["ping"]}, timeout=1)
+            return process, url
+        except requests.exceptions.ConnectionError:
+            if time.monotonic() > deadline or process.poll() is not None:
+                process.terminate()
+                raise
+            time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--fail-rate", type=float, default=0)
+    parser.add_argument("--max-batch", type=int, default=0, help="413 above this")
+    parser.add_argument("--no-base64", action="store_true")
+    args = parser.parse_args()
+
+    server = create_stub_server(
+        args.port,
+        args.dim,
+        args.latency_ms,
+        args.fail_rate,
+        args.max_batch,
+        args.no_base64,
+    )
+    print(f"Embedding stub listening on http://127.0.0.1:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Latency/recall trade-off of Matryoshka two-stage search.
+
+Query vectors are sampled from code_chunks, so no embedding model is needed.
+The database must have been indexed with matryoshka.enabled so that
+embedding_coarse is filled.
+
+Usage:
+    python -m benchmarks.matryoshka --queries 100 --candidates 50,100,200,400
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+from tabulate import tabulate
+
+from codebase.config import CONFIG
+from codebase.evaluation import exact_top_k, sample_query_vectors
+from codebase.model_provider import truncate_embedding
+from codebase.pgvector import PGVectorConnector
+from codebase.search import DEFAULT_EF_SEARCH, SEARCH_SQL, TWO_STAGE_SEARCH_SQL
+
+
+def run_variant(
+    connector: PGVectorConnector,
+    queries: list[np.ndarray],
+    truth: list[list[str]],
+    sql: str,
+    make_params,
+) -> dict:
+    latencies, recalls = [], []
+    for embedding, expected in zip(queries, truth):
+        params = make_params(embedding)
+        start = time.perf_counter()
+        _, records = connector.execute_select(sql, params, prepare=True)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found = {record[0] for record in records}
+        recalls.append(len(found & set(expected)) / max(len(expected), 1))
+    return {
+        f"recall@{len(truth[0]) if truth else 0}": float(np.mean(recalls)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--dbname", type=str, default="")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--coarse-dim", type=int, default=None)
+    parser.add_argument(
+        "--candidates",
+        type=str,
+        default="50,100,200,400",
+        help="Comma-separated coarse candidate counts to sweep",
+    )
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    args = parser.parse_args()
+
+    if args.dbname:
+        CONFIG["pgvector"]["dbname"] = args.dbname
+    coarse_dim = args.coarse_dim or CONFIG["matryoshka"]["coarse_dim"]
+    top_k = args.top_k
+
+    connector = PGVectorConnector()
+    queries = sample_query_vectors(connector, args.queries)
+    truth = [exact_top_k(connector, q, top_k) for q in queries]
+
+    results = []
+    connector.set_ef_search(max(DEFAULT_EF_SEARCH, top_k))
+    results.append(
+        {
+            "mode": "full",
+            "candidates": None,
+            **run_variant(
+                connector,
+                queries,
+                truth,
+                SEARCH_SQL,
+                lambda q: {"embedding": q, "top_k": top_k},
+            ),
+        }
+    )
+    for candidates in [int(c) for c in args.candidates.split(",")]:
+        connector.set_ef_search(max(DEFAULT_EF_SEARCH, candidates))
+        results.append(
+            {
+                "mode": f"two-stage ({coarse_dim}d)",
+                "candidates": candidates,
+                **run_variant(
+                    connector,
+                    queries,
+                    truth,
+                    TWO_STAGE_SEARCH_SQL,
+                    lambda q: {
+                        "embedding": q,
+                        "embedding_coarse": truncate_embedding(q, coarse_dim),
+                        "candidates": candidates,
+                        "top_k": top_k,
+                    },
+                ),
+            }
+        )
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(tabulate(results, headers="keys", floatfmt=".3f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Compare embedding providers on CPU: load time, batch throughput, single
+query latency and peak memory.
+
+Every provider runs in a fresh process so that peak RSS is not shared.
+
+Usage:
+    python -m benchmarks.providers --model /path/to/model \
+        --providers sentence_transformer,onnx,onnx-int8 --threads 4
+"""
+
+import argparse
+import glob
+import json
+import multiprocessing
+import resource
+import time
+
+import numpy as np
+from tabulate import tabulate
+
+
+def create_provider(name: str, options: dict):
+    from codebase.model_provider import OnnxProvider, SentenceTransformerProvider
+
+    if name == "sentence_transformer":
+        return SentenceTransformerProvider(options["model"])
+    if name in ("onnx", "onnx-int8"):
+        return OnnxProvider(
+            options["model"],
+            onnx_dir=options["onnx_dir"],
+            quantize=name == "onnx-int8",
+            threads=options["threads"],
+            pooling=options["pooling"],
+            batch_size=options["batch_size"],
+        )
+    raise ValueError(f"Unknown provider: {name}")
+
+
+def load_corpus(pattern: str, max_chars: int) -> list[str]:
+    texts = []
+    for path in sorted(glob.glob(pattern, recursive=True)):
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            text = f.read()[:max_chars]
+        if text.strip():
+            texts.append(text)
+    return texts
+
+
+def measure(name: str, options: dict) -> dict:
+    if options["threads"] > 0:
+        import os
+
+        # sentence-transformers/PyTorch reads this at import time
+        os.environ["OMP_NUM_THREADS"] = str(options["threads"])
+
+    texts = load_corpus(options["corpus"], options["max_chars"])
+    queries = [text[:200] for text in texts[: options["queries"]]]
+
+    start = time.perf_counter()
+    provider = create_provider(name, options)
+    load_seconds = time.perf_counter() - start
+
+    # Warm-up
+    provider.encode_batch(texts[:2])
+
+    start = time.perf_counter()
+    provider.encode_batch(texts)
+    batch_seconds = time.perf_counter() - start
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        provider.encode(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "provider": name,
+        "load_s": load_seconds,
+        "texts/s": len(texts) / batch_seconds,
+        "query_p50_ms": float(np.percentile(latencies, 50)),
+        "query_p95_ms": float(np.percentile(latencies, 95)),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--model", type=str, required=True)
+    parser.add_argument(
+        "--providers", type=str, default="sentence_transformer,onnx,onnx-int8"
+    )
+    parser.add_argument("--onnx-dir", type=str, default=None)
+    parser.add_argument("--pooling", type=str, default="last_token")
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--corpus", type=str, default="src/**/*.py")
+    parser.add_argument("--max-chars", type=int, default=4000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    args = parser.parse_args()
+
+    options = vars(args)
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for name in args.providers.split(","):
+        with context.Pool(1) as pool:
+            results.append(pool.apply(measure, (name, options)))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(tabulate(results, headers="keys", floatfmt=".2f"))
+
+
+if __name__ == "__main__":
+    main()
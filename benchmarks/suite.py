@@ -0,0 +1,318 @@
+"""
+End-to-end benchmark: index a synthetic repository and query it through the
+real code paths, with embeddings from the local stub server.
+
+Measures files/s and chunks/s of `codebase index` on the --add path, the
+first --git run and an incremental --git run, then p50/p95/p99 latency and
+QPS of `codebase search` (run_search) and the MCP semantic_search tool.
+Results are written as JSON to track regressions across versions.
+
+The database must exist and have the tables of create_tables.sql with the
+same dimension as --dim. Its code_chunks are replaced.
+
+Usage:
+    createdb -h 127.0.0.1 -p 5439 -U postgres codebase_bench
+    psql -h 127.0.0.1 -p 5439 -U postgres -d codebase_bench \
+        -f create_tables.sql -v dim=1024
+    python -m benchmarks.suite --dbname codebase_bench --files 2000 \
+        --output bench.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from argparse import Namespace
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.embedding_stub import spawn_stub_server
+
+PYTHON_HEADER = """# Synthetic module {module}
+# Generated by benchmarks.suite
+import os
+import sys
+
+"""
+
+PYTHON_FUNCTION = '''def {name}(value, factor={j}):
+    """Return the {j}th transformation of value in module {module}."""
+    result = value
+    for step in range({steps}):
+        result = (result * factor + step) % 1000003
+    return result
+
+'''
+
+CPP_HEADER = """// Synthetic module {module}
+// Generated by benchmarks.suite
+#include <vector>
+#include <string>
+
+"""
+
+CPP_FUNCTION = """int {name}(const std::vector<int>& values, int factor = {j}) {{
+    // Fold the values of module {module}
+    int result = 0;
+    for (int value : values) {{
+        result = (result * factor + value + {steps}) % 1000003;
+    }}
+    return result;
+}}
+
+"""
+
+
+def generate_repo(root: Path, files: int, cpp_ratio: float, seed: int) -> list[str]:
+    """
+    Write a git repository of synthetic Python and C++ files. Function counts
+    per file follow a Pareto distribution, so a few files are much longer
+    than the rest like in real code bases.
+
+    :return: the function names, used as search queries
+    """
+    rng = random.Random(seed)
+    names = []
+    for module in range(files):
+        cpp = rng.random() < cpp_ratio
+        directory = root / f"pkg{module % 20}"
+        directory.mkdir(parents=True, exist_ok=True)
+        functions = min(200, int(rng.paretovariate(1.5) * 3))
+        parts = [(CPP_HEADER if cpp else PYTHON_HEADER).format(module=module)]
+        for j in range(functions):
+            name = f"{'compute' if cpp else 'transform'}_{module}_{j}"
+            names.append(name)
+            parts.append(
+                (CPP_FUNCTION if cpp else PYTHON_FUNCTION).format(
+                    name=name, module=module, j=j, steps=rng.randint(1, 50)
+                )
+            )
+        suffix = ".cpp" if cpp else ".py"
+        (directory / f"module_{module}{suffix}").write_text("".join(parts))
+    git(root, "init", "-q")
+    git(root, "add", "-A")
+    git(root, "commit", "-q", "-m", "synthetic repository")
+    return names
+
+
+def modify_repo(root: Path, fraction: float, seed: int) -> int:
+    """Append a function to a fraction of the files and commit."""
+    rng = random.Random(seed)
+    paths = sorted(p for p in root.rglob("module_*") if p.is_file())
+    changed = rng.sample(paths, max(1, int(len(paths) * fraction)))
+    for p in changed:
+        with open(p, "a") as f:
+            if p.suffix == ".py":
+                f.write("\n\ndef changed():\n    return 1\n")
+            else:
+                f.write("\nint changed() { return 1; }\n")
+    git(root, "commit", "-q", "-am", "modify")
+    return len(changed)
+
+
+def git(root: Path, *args: str) -> str:
+    return subprocess.run(
+        ["git", "-c", "user.name=bench", "-c", "user.email=bench@localhost", *args],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+
+
+def reset_database():
+    from codebase.pgvector import PGVectorConnector
+
+    connector = PGVectorConnector()
+    connector.cur.execute("TRUNCATE code_chunks")
+    connector.cur.execute("UPDATE index_metadata SET last_commit_hash = NULL")
+    connector.cur.execute("DELETE FROM failed_files")
+    connector.conn.commit()
+
+
+def count_chunks() -> int:
+    from codebase.pgvector import PGVectorConnector
+
+    _, rows = PGVectorConnector().execute_select("SELECT count(*) FROM code_chunks", {})
+    return rows[0][0]
+
+
+def run_index(dbname: str, **args) -> float:
+    """Run `codebase index` in this process, return the elapsed seconds."""
+    from codebase.indexing import main as index_main
+
+    namespace = Namespace(
+        dbname=dbname, add="", delete="", git=None, retry_failed=False
+    )
+    for key, value in args.items():
+        setattr(namespace, key, value)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        index_main(namespace)
+    return time.perf_counter() - start
+
+
+def bench_indexing(root: Path, dbname: str, options: dict) -> dict:
+    files = [str(p.relative_to(root)) for p in sorted(root.rglob("module_*"))]
+    results = {}
+
+    reset_database()
+    seconds = run_index(dbname, add=" ".join(files))
+    chunks = count_chunks()
+    results["add"] = rates(len(files), chunks, seconds)
+
+    reset_database()
+    seconds = run_index(dbname, git="HEAD")
+    results["git_full"] = rates(len(files), count_chunks(), seconds)
+
+    base_commit = git(root, "rev-parse", "HEAD")
+    changed = modify_repo(root, options["changed_fraction"], options["seed"])
+    seconds = run_index(dbname, git=base_commit)
+    # code_chunks holds one row per file, every changed file is one chunk
+    results["git_incremental"] = rates(changed, changed, seconds)
+    return results
+
+
+def rates(files: int, chunks: int, seconds: float) -> dict:
+    return {
+        "files": files,
+        "chunks": chunks,
+        "seconds": seconds,
+        "files/s": files / seconds,
+        "chunks/s": chunks / seconds,
+    }
+
+
+def latency_stats(latencies: list[float], seconds: float) -> dict:
+    milliseconds = np.array(latencies) * 1000
+    return {
+        "queries": len(latencies),
+        "p50_ms": float(np.percentile(milliseconds, 50)),
+        "p95_ms": float(np.percentile(milliseconds, 95)),
+        "p99_ms": float(np.percentile(milliseconds, 99)),
+        "qps": len(latencies) / seconds,
+    }
+
+
+def bench_search(queries: list[str]) -> dict:
+    from codebase.model_provider import get_embedding_model
+    from codebase.pgvector import PGVectorConnector
+    from codebase.search import run_search
+
+    connector = PGVectorConnector()
+    options = {
+        "sql": None,
+        "rerank": False,
+        "top_k": 10,
+        "snippets": True,
+        "snippet_lines": None,
+    }
+    # Warm-up: connection, prepared statements, HTTP keep-alive
+    with contextlib.redirect_stderr(io.StringIO()):
+        run_search(connector, get_embedding_model, {**options, "query_text": "warm"})
+
+    latencies = []
+    start = time.perf_counter()
+    with contextlib.redirect_stderr(io.StringIO()):
+        for query in queries:
+            query_start = time.perf_counter()
+            run_search(connector, get_embedding_model, {**options, "query_text": query})
+            latencies.append(time.perf_counter() - query_start)
+    return latency_stats(latencies, time.perf_counter() - start)
+
+
+def bench_mcp(queries: list[str]) -> dict:
+    from codebase.mcp_server import semantic_search
+
+    async def run() -> dict:
+        await semantic_search("warm")
+        latencies = []
+        start = time.perf_counter()
+        for query in queries:
+            query_start = time.perf_counter()
+            await semantic_search(query)
+            latencies.append(time.perf_counter() - query_start)
+        return latency_stats(latencies, time.perf_counter() - start)
+
+    return asyncio.run(run())
+
+
+def version() -> str:
+    from importlib.metadata import PackageNotFoundError
+    from importlib.metadata import version as package_version
+
+    try:
+        return package_version("codebase")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--dbname", type=str, required=True)
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--cpp-ratio", type=float, default=0.3)
+    parser.add_argument("--changed-fraction", type=float, default=0.1)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default="-", help="JSON file")
+    args = parser.parse_args()
+    options = vars(args)
+
+    from codebase.config import CONFIG
+
+    stub, url = spawn_stub_server(args.dim)
+    # Point every code path at the stub and the benchmark database
+    CONFIG["model_provider"] = "openai"
+    CONFIG["model"] = "stub"
+    CONFIG["openai"]["url"] = url
+    CONFIG["matryoshka"]["full_dim"] = None
+    CONFIG["pgvector"]["dbname"] = args.dbname
+
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory(prefix="codebase-bench-") as tmp:
+            root = Path(tmp)
+            names = generate_repo(root, args.files, args.cpp_ratio, args.seed)
+            queries = random.Random(args.seed).sample(
+                names, min(args.queries, len(names))
+            )
+            os.chdir(root)
+            try:
+                results = {
+                    "index": bench_indexing(root, args.dbname, options),
+                    "search": bench_search(queries),
+                    "mcp_semantic_search": bench_mcp(queries),
+                }
+            finally:
+                os.chdir(cwd)
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    report = {
+        "version": version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "params": options,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        Path(args.output).write_text(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
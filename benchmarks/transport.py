@@ -0,0 +1,94 @@
+"""
+Compare embedding response transports of OpenAICompatibleProvider against the
+local stub server: JSON floats vs base64, with and without gzip.
+
+The stub runs in its own process, so the client CPU time reported here is
+only request building, transfer and decoding.
+
+Usage:
+    python -m benchmarks.transport --batches 50 --batch-size 32 --dim 1024
+"""
+
+import argparse
+import json
+import time
+
+import requests
+from tabulate import tabulate
+
+from benchmarks.embedding_stub import spawn_stub_server
+from codebase.model_provider import OpenAICompatibleProvider
+
+TRANSPORTS = [
+    ("float", False),
+    ("float", True),
+    ("base64", False),
+    ("base64", True),
+]
+
+
+def response_bytes(url: str, texts: list[str], encoding_format: str, gzip: bool):
+    """Size of one response as sent over the wire."""
+    response = requests.post(
+        url + "/v1/embeddings",
+        json={"input": texts, "model": "stub", "encoding_format": encoding_format},
+        headers={"Accept-Encoding": "gzip" if gzip else "identity"},
+        stream=True,
+    )
+    return len(response.raw.read(decode_content=False))
+
+
+def measure(url: str, encoding_format: str, gzip: bool, options: dict) -> dict:
+    provider = OpenAICompatibleProvider(
+        "stub", url, encoding_format=encoding_format, gzip=gzip
+    )
+    batches = [
+        [f"def f_{b}_{i}(): return {i}" for i in range(options["batch_size"])]
+        for b in range(options["batches"])
+    ]
+    provider.encode_batch(batches[0])
+
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    for batch in batches:
+        provider.encode_batch(batch)
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+
+    texts = options["batches"] * options["batch_size"]
+    return {
+        "encoding_format": encoding_format,
+        "gzip": gzip,
+        "texts/s": texts / wall,
+        "client_cpu_ms/batch": cpu * 1000 / options["batches"],
+        "response_kb/batch": response_bytes(url, batches[0], encoding_format, gzip)
+        / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--batches", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    args = parser.parse_args()
+
+    stub, url = spawn_stub_server(args.dim)
+    try:
+        results = [
+            measure(url, encoding_format, gzip, vars(args))
+            for encoding_format, gzip in TRANSPORTS
+        ]
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(tabulate(results, headers="keys", floatfmt=".2f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,12 +5,88 @@ CREATE TABLE IF NOT EXISTS code_chunks (
     id SERIAL PRIMARY KEY,
     file_path VARCHAR(255) NOT NULL UNIQUE,
     code_text TEXT NOT NULL,
-    embedding vector(:dim)
+    embedding vector(:dim),
+    -- code_text 在原文件中的起始行号（文件头的注释和 import 已被去除）
+    start_line INTEGER NOT NULL DEFAULT 1
 );
+-- 升级已有的表
+ALTER TABLE code_chunks ADD COLUMN IF NOT EXISTS start_line INTEGER NOT NULL DEFAULT 1;
 
 CREATE INDEX file_path_idx ON code_chunks (file_path);
 CREATE INDEX ON code_chunks USING hnsw (embedding vector_cosine_ops);
 
+-- Matryoshka 两阶段检索（可选）: psql ... -v dim=1024 -v coarse_dim=256
+-- 已有数据需要重新索引；pgvector >= 0.7 也可以直接回填:
+-- UPDATE code_chunks SET embedding_coarse = l2_normalize(subvector(embedding, 1, 256));
+\if :{?coarse_dim}
+ALTER TABLE code_chunks ADD COLUMN IF NOT EXISTS embedding_coarse vector(:coarse_dim);
+CREATE INDEX IF NOT EXISTS code_chunks_embedding_coarse_idx
+    ON code_chunks USING hnsw (embedding_coarse vector_cosine_ops);
+\endif
+
+-- 目录级索引（可选，directory_index.enabled）: psql ... -v dim=1024 -v directory_depth=3
+-- directory 为文件所在目录截取前 directory_depth 层（带结尾的 /，根目录下的文件为 ''），每个文件恰好属于一个目录；
+-- directory_centroids 保存每个目录中向量的个数与和，由 codebase index 在写入时按新旧向量之差增量更新。
+-- 余弦距离与向量长度无关，和与平均值（中心向量）到查询的距离相同。
+-- 先按中心向量选出最接近的几个目录，再只在这些目录中精确检索
+\if :{?directory_depth}
+ALTER TABLE code_chunks ADD COLUMN IF NOT EXISTS directory TEXT GENERATED ALWAYS AS
+    (substring(file_path, '^((?:[^/]*/){0,' || :'directory_depth' || '})')) STORED;
+CREATE INDEX IF NOT EXISTS code_chunks_directory_idx ON code_chunks (directory);
+CREATE TABLE IF NOT EXISTS directory_centroids (
+    directory TEXT PRIMARY KEY,
+    -- 有 embedding 的文件数
+    files INTEGER NOT NULL,
+    embedding_sum vector(:dim) NOT NULL
+);
+-- 回填已有数据；增量更新积累的浮点误差可以先清空此表再运行本脚本重新计算
+INSERT INTO directory_centroids (directory, files, embedding_sum)
+SELECT directory, count(*), sum(embedding)
+FROM code_chunks
+WHERE embedding IS NOT NULL
+GROUP BY directory
+ON CONFLICT (directory) DO NOTHING;
+\endif
+
+-- 近重复检测（dedup.enabled）: simhash 为代码的 64 位 SimHash 指纹；
+-- duplicate_of 不为空时该文件是代表文件 duplicate_of 的近重复，embedding 为 NULL，不在 HNSW 索引中
+ALTER TABLE code_chunks ADD COLUMN IF NOT EXISTS simhash BIGINT;
+ALTER TABLE code_chunks ADD COLUMN IF NOT EXISTS duplicate_of VARCHAR(255);
+CREATE INDEX IF NOT EXISTS code_chunks_duplicate_of_idx
+    ON code_chunks (duplicate_of) WHERE duplicate_of IS NOT NULL;
+-- 指纹的 4 个 16 位分段: 相差不超过 3 位的两个指纹至少有一个分段相同
+CREATE INDEX IF NOT EXISTS code_chunks_simhash_band0_idx
+    ON code_chunks (((simhash >> 48) & 65535)) WHERE duplicate_of IS NULL;
+CREATE INDEX IF NOT EXISTS code_chunks_simhash_band1_idx
+    ON code_chunks (((simhash >> 32) & 65535)) WHERE duplicate_of IS NULL;
+CREATE INDEX IF NOT EXISTS code_chunks_simhash_band2_idx
+    ON code_chunks (((simhash >> 16) & 65535)) WHERE duplicate_of IS NULL;
+CREATE INDEX IF NOT EXISTS code_chunks_simhash_band3_idx
+    ON code_chunks ((simhash & 65535)) WHERE duplicate_of IS NULL;
+
+-- 生成 embedding 失败的文件，使用 codebase index --retry-failed 重新索引
+CREATE TABLE IF NOT EXISTS failed_files (
+    file_path VARCHAR(255) PRIMARY KEY,
+    error TEXT,
+    failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 分布式索引的工作队列: codebase index --enqueue 写入，codebase index --worker 认领
+-- blob 为 git blob id，不为空时 worker 从自己的 git 仓库读取内容，否则读取工作区中的文件
+CREATE TABLE IF NOT EXISTS index_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    file_path VARCHAR(255) NOT NULL UNIQUE,
+    blob VARCHAR(40),
+    -- 认领的 worker 和租约到期时间，过期后任务可被其它 worker 重新认领
+    leased_by TEXT,
+    -- 带时区，与 now() 比较时不受各 worker 会话的 TimeZone 影响
+    leased_until TIMESTAMPTZ,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    enqueued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+-- 升级已有的表（已是 TIMESTAMPTZ 时不做任何事）
+ALTER TABLE index_jobs ALTER COLUMN leased_until TYPE TIMESTAMPTZ;
+
 -- 存储索引元数据（单条记录）
 CREATE TABLE IF NOT EXISTS index_metadata (
     id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
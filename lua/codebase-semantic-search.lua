@@ -1,11 +1,128 @@
-local Job = require("plenary.job")
-
 -- 创建一个命名空间，用于管理这个插件的所有 extmark
 local codebase_ns = vim.api.nvim_create_namespace("codebase_panel_ns")
 -- print("Namespace created with ID:", codebase_ns)
 local codebase_panel_buf = nil
 local codebase_config = nil
 
+-- 输入停止多少毫秒后开始搜索
+local LIVE_SEARCH_DEBOUNCE_MS = 150
+local live_search_timer = nil
+local uv = vim.uv or vim.loop
+
+-- 常驻的 `codebase rpc` 后端进程，通过 stdin/stdout 上的 JSON-RPC 通信，
+-- 模型和数据库连接只在启动时加载一次
+local backend = {
+	job = nil,
+	next_id = 0,
+	-- 请求 id -> { on_rows = function(columns, rows), on_done = function(err, result) }
+	callbacks = {},
+	-- stdout 中还没有收到换行符的部分
+	partial = "",
+	-- stderr 的最后几行，进程异常退出时显示
+	stderr = {},
+}
+
+local function backend_handle_message(message)
+	if message.method == "search/rows" then
+		local callback = backend.callbacks[message.params.id]
+		if callback and callback.on_rows then
+			callback.on_rows(message.params.columns, message.params.rows)
+		end
+		return
+	end
+	if message.id == nil or message.id == vim.NIL then
+		return
+	end
+	local callback = backend.callbacks[message.id]
+	backend.callbacks[message.id] = nil
+	if callback and callback.on_done then
+		callback.on_done(message.error, message.result)
+	end
+end
+
+local function backend_on_stdout(_, data, _)
+	-- data[1] 接在上一次未完成的行之后，最后一个元素是新的未完成的行
+	data[1] = backend.partial .. data[1]
+	backend.partial = data[#data]
+	for i = 1, #data - 1 do
+		if data[i] ~= "" then
+			local ok, message = pcall(vim.json.decode, data[i])
+			if ok then
+				backend_handle_message(message)
+			end
+		end
+	end
+end
+
+local function backend_on_stderr(_, data, _)
+	for _, line in ipairs(data) do
+		if line ~= "" then
+			table.insert(backend.stderr, line)
+			if #backend.stderr > 20 then
+				table.remove(backend.stderr, 1)
+			end
+		end
+	end
+end
+
+local function backend_on_exit(_, code, _)
+	backend.job = nil
+	-- 未完成的请求全部以错误结束
+	local callbacks = backend.callbacks
+	backend.callbacks = {}
+	local message = "codebase rpc exited with code " .. code
+	if #backend.stderr > 0 then
+		message = message .. ": " .. backend.stderr[#backend.stderr]
+	end
+	for _, callback in pairs(callbacks) do
+		if callback.on_done then
+			callback.on_done({ message = message }, nil)
+		end
+	end
+end
+
+local function backend_start()
+	if backend.job then
+		return backend.job
+	end
+	backend.partial = ""
+	backend.stderr = {}
+	-- 在 Neovim 的当前目录启动，与命令行中运行 codebase 一致
+	local job = vim.fn.jobstart({ "codebase", "rpc" }, {
+		on_stdout = backend_on_stdout,
+		on_stderr = backend_on_stderr,
+		on_exit = backend_on_exit,
+	})
+	if job <= 0 then
+		error("Failed to start `codebase rpc`")
+	end
+	backend.job = job
+	return job
+end
+
+local function backend_send(message)
+	message.jsonrpc = "2.0"
+	vim.fn.chansend(backend_start(), vim.json.encode(message) .. "\n")
+end
+
+---@return number 请求 id
+local function backend_request(method, params, on_rows, on_done)
+	backend_start()
+	backend.next_id = backend.next_id + 1
+	local id = backend.next_id
+	backend.callbacks[id] = { on_rows = on_rows, on_done = on_done }
+	backend_send({ id = id, method = method, params = params })
+	return id
+end
+
+local function backend_cancel(id)
+	if backend.job and backend.callbacks[id] then
+		-- 不再处理已取消请求的结果
+		backend.callbacks[id] = nil
+		backend_send({ method = "$/cancelRequest", params = { id = id } })
+	end
+end
+
 ---@param virt_lines 虚拟行内容
 ---@param line number 行号(0-based index)
 local function set_extmarks(virt_lines, line)
@@ -18,8 +135,27 @@ local function set_extmarks(virt_lines, line)
 	})
 end
 
-local function commit_function()
-	assert(codebase_panel_buf, "Codebase panel buffer not found")
+local function format_row(row)
+	local fields = {}
+	for i, value in ipairs(row) do
+		if value == vim.NIL then
+			value = ""
+		end
+		-- 缓冲区中的一行不能包含换行符
+		fields[i] = (tostring(value):gsub("\n", "\\n"))
+	end
+	return table.concat(fields, "\t")
+end
+
+-- 正在执行的搜索请求 id，以及最后一次提交的面板内容
+local search_request_id = nil
+local last_search_key = nil
+
+---@param force boolean 为 true 时即使面板内容没有变化也重新搜索 (<C-S>)
+local function commit_function(force)
+	if codebase_panel_buf == nil or not vim.api.nvim_buf_is_valid(codebase_panel_buf) then
+		return
+	end
 	local extmarks = vim.api.nvim_buf_get_extmarks(codebase_panel_buf, codebase_ns, 0, -1, {})
 	-- print("Codebase namespace:", codebase_ns)
 
@@ -34,51 +170,84 @@ local function commit_function()
 	local sql = vim.api.nvim_buf_get_lines(codebase_panel_buf, extmarks[4][2], extmarks[5][2], false)
 	sql = table.concat(sql, "\n")
 
-	-- clear the line below "Results"
-	vim.api.nvim_buf_set_lines(codebase_panel_buf, extmarks[5][2], -1, false, { "" })
-	-- run command
-	local command = "codebase"
-	local args = { "search", "--dbname", database_name, "--query_text", user_query_text, "--sql", sql }
-	Job:new({
-		command = command,
-		args = args,
-		cwd = "~",
-
-		-- 回调函数，处理标准输出
-		on_stdout = function(self, lines)
-			-- lines 是一个 Lua 表，包含所有输出行
-			if codebase_panel_buf == nil then
-				return
-			end
-			print("on_stdout", lines)
-			vim.schedule_wrap(function()
-				vim.api.nvim_buf_set_lines(codebase_panel_buf, -1, -1, false, { lines })
-			end)()
-		end,
+	-- 结果区域的变化也会触发 TextChanged，只有输入变化时才重新搜索
+	local search_key = table.concat({ database_name, user_query_text, sql }, "\0")
+	if not force and (search_key == last_search_key or vim.trim(user_query_text) == "") then
+		return
+	end
+	last_search_key = search_key
+	-- 新的查询使正在执行的旧查询失效
+	if search_request_id then
+		backend_cancel(search_request_id)
+	end
 
-		-- 回调函数，处理标准错误
-		on_stderr = function(self, lines)
-			if codebase_panel_buf == nil or lines == nil then
-				return
-			end
-			vim.schedule_wrap(function()
-				vim.api.nvim_buf_set_lines(codebase_panel_buf, -1, -1, false, { "--- [stderr] " .. lines })
-			end)()
-		end,
+	local start = uv.hrtime()
+	local first_row_ms = nil
+	local row_count = 0
+	-- 旧的结果保留到新结果的第一批到达，避免闪烁
+	local function replace_results(lines)
+		local results_line = vim.api.nvim_buf_get_extmarks(codebase_panel_buf, codebase_ns, 0, -1, {})[5][2]
+		vim.api.nvim_buf_set_lines(codebase_panel_buf, results_line, -1, false, lines)
+	end
+	local function append_results(lines)
+		vim.api.nvim_buf_set_lines(codebase_panel_buf, -1, -1, false, lines)
+	end
 
-		-- 回调函数，在命令完成后执行
-		on_exit = function(self, code, signal)
-			if codebase_panel_buf == nil then
-				return
-			end
-			print("on_exit", code, signal)
-			vim.schedule_wrap(function()
-				vim.api.nvim_buf_set_lines(codebase_panel_buf, -1, -1, false, {
-					"--- Command finished with exit code: " .. code .. " ---",
-				})
-			end)()
-		end,
-	}):start()
+	search_request_id = backend_request("search", {
+		dbname = database_name,
+		query_text = user_query_text,
+		sql = sql,
+	}, function(columns, rows)
+		if not vim.api.nvim_buf_is_valid(codebase_panel_buf) then
+			return
+		end
+		local lines = {}
+		for _, row in ipairs(rows) do
+			table.insert(lines, format_row(row))
+		end
+		if first_row_ms == nil then
+			first_row_ms = (uv.hrtime() - start) / 1e6
+			replace_results(vim.list_extend({ table.concat(columns, "\t") }, lines))
+		else
+			append_results(lines)
+		end
+		row_count = row_count + #rows
+	end, function(err, _)
+		search_request_id = nil
+		if not vim.api.nvim_buf_is_valid(codebase_panel_buf) then
+			return
+		end
+		local status
+		if err then
+			status = "--- [error] " .. err.message .. " ---"
+		else
+			status = string.format(
+				"--- %d rows, first after %.0f ms, done after %.0f ms ---",
+				row_count,
+				first_row_ms or 0,
+				(uv.hrtime() - start) / 1e6
+			)
+		end
+		if first_row_ms == nil then
+			replace_results({ status })
+		else
+			append_results({ status })
+		end
+	end)
+end
+
+local function schedule_live_search()
+	if live_search_timer == nil then
+		live_search_timer = uv.new_timer()
+	end
+	live_search_timer:stop()
+	live_search_timer:start(
+		LIVE_SEARCH_DEBOUNCE_MS,
+		0,
+		vim.schedule_wrap(function()
+			commit_function(false)
+		end)
+	)
 end
 
 local function run_codebase_config_async()
@@ -139,7 +308,7 @@ function M.open_codebase_panel()
 	local head_extmarks = {
 		{
 			{
-				"Keymaps:  <C-S> -> submit",
+				"Keymaps:  <C-S> -> submit (results also update as you type)",
 				"Question",
 			},
 		},
@@ -170,9 +339,18 @@ function M.open_codebase_panel()
 	vim.keymap.set(
 		{ "n", "i" },
 		"<C-S>",
-		commit_function,
+		function()
+			commit_function(true)
+		end,
 		{ buffer = codebase_panel_buf, noremap = true, silent = true, desc = "Submit Codebase Query" }
 	)
+	-- 边输入边搜索
+	vim.api.nvim_create_autocmd({ "TextChanged", "TextChangedI" }, {
+		buffer = codebase_panel_buf,
+		callback = schedule_live_search,
+	})
+	-- 提前启动后端，第一次搜索时模型已经加载
+	backend_start()
 	vim.keymap.set("n", "<leader>tb", function()
 		local current_script_path = debug.getinfo(1, "S").source:sub(2)
 		local create_sql_file = vim.fs.dirname(vim.fs.dirname(current_script_path)) .. "/create_tables.sql"
@@ -27,6 +27,34 @@ def main():
         default=None,
         help="Use git to detect changes since specified commit (default: HEAD)",
     )
+    index_parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="Re-index files whose embedding failed in earlier runs",
+    )
+    index_parser.add_argument(
+        "--enqueue",
+        action="store_true",
+        help="With --git or --add: write the files to the work queue for "
+        "--worker processes instead of embedding them here",
+    )
+    index_parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="Claim and index files from the work queue until it is empty",
+    )
+    index_parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print wall/CPU time and throughput of each indexing stage",
+    )
+    index_parser.add_argument(
+        "--profile-output",
+        type=str,
+        default=None,
+        help="Write the stage metrics to a file: Prometheus text if it ends "
+        "with .prom, JSON otherwise",
+    )
 
     config_parser = subparsers.add_parser("config", help="Show configuration")
 
@@ -44,13 +72,134 @@ def main():
     search_parser.add_argument(
         "--sql",
         type=str,
-        default="""
-SELECT file_path, embedding <=> %(embedding)s::vector AS distance
-FROM code_chunks
-ORDER BY embedding <=> %(embedding)s::vector
-LIMIT 10;
-            """,
+        default=None,
+        help="Custom SQL, %%(embedding)s is replaced by the query embedding "
+        "(default: top 10 by cosine distance)",
+    )
+    search_parser.add_argument(
+        "--like",
+        type=str,
+        default="",
+        help="Find code similar to an indexed file, the chunk of a file at a line "
+        "(path:line) or a directory, using the stored embeddings; no model is loaded",
+    )
+    search_parser.add_argument(
+        "--queries-file",
+        type=str,
+        default="",
+        help="Run many queries in one batch: JSONL in ('-' for stdin), JSONL out",
+    )
+    search_parser.add_argument(
+        "--top-k",
+        type=int,
+        default=10,
+        help="Number of results for --queries-file, --rerank and --like",
+    )
+    search_parser.add_argument(
+        "--rerank",
+        action="store_true",
+        help="Re-rank the top rerank.candidates vector results with a local cross-encoder",
+    )
+    search_parser.add_argument(
+        "--snippets",
+        action="store_true",
+        help="Print a bounded code snippet for each result (first column must be file_path)",
+    )
+    search_parser.add_argument(
+        "--snippet-lines",
+        type=int,
+        default=None,
+        help="Lines per snippet (default: snippet.lines in config)",
+    )
+
+    search_parser.add_argument(
+        "--format",
+        choices=["table", "jsonl", "json", "tsv"],
+        default="table",
+        help="Output format; jsonl, json and tsv stream rows from a server-side "
+        "cursor as they arrive",
+    )
+    search_parser.add_argument(
+        "--limit",
+        type=int,
+        default=None,
+        help="Print at most this many rows",
+    )
+    search_parser.add_argument(
+        "--group-by-directory",
+        action="store_true",
+        help="Print the results of each directory together (table format)",
+    )
+    search_parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="Do not use a running `codebase serve`, load the model in this process",
+    )
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="Keep the embedding model and database connection warm"
+    )
+    serve_parser.add_argument(
+        "--socket",
+        type=str,
+        default="",
+        help="Unix socket path (default: daemon.socket in config)",
+    )
+
+    rpc_parser = subparsers.add_parser(
+        "rpc", help="JSON-RPC search backend on stdin/stdout for editor plugins"
+    )
+    rpc_parser.add_argument(
+        "--dbname", type=str, default="", help="Default PGVector database name"
+    )
+
+    eval_parser = subparsers.add_parser(
+        "eval", help="Measure recall and latency of the ANN search against exact search"
+    )
+    eval_parser.add_argument(
+        "--dbname", type=str, default="", help="PGVector database name"
+    )
+    eval_parser.add_argument(
+        "--queries",
+        type=int,
+        default=100,
+        help="Number of query vectors sampled from the indexed chunks",
+    )
+    eval_parser.add_argument(
+        "--queries-file",
+        type=str,
+        default="",
+        help='JSONL query set instead of sampled vectors ("-" for stdin); lines with a '
+        '"relevant" list of file paths also get label recall',
     )
+    eval_parser.add_argument(
+        "--seed",
+        type=float,
+        default=0.0,
+        help="Seed in [-1, 1] of the query sample, for comparable runs",
+    )
+    eval_parser.add_argument("--top-k", type=int, default=10)
+    eval_parser.add_argument(
+        "--ef-search",
+        type=str,
+        default="10,20,40,80,160,320",
+        help="Comma-separated hnsw.ef_search values to sweep",
+    )
+    eval_parser.add_argument(
+        "--candidates",
+        type=str,
+        default="",
+        help="Comma-separated Matryoshka two-stage candidate counts to sweep "
+        "(default: matryoshka.candidates if enabled)",
+    )
+    eval_parser.add_argument(
+        "--directories",
+        type=str,
+        default="",
+        help="Comma-separated directory counts of the coarse-to-fine search to "
+        "sweep (default: directory_index.directories if enabled)",
+    )
+    eval_parser.add_argument("--json", action="store_true", help="Print JSON")
 
     args = parser.parse_args()
     match args.command:
@@ -67,6 +216,18 @@ LIMIT 10;
             from codebase.search import main as search_main
 
             search_main(args)
+        case "eval":
+            from codebase.evaluation import main as eval_main
+
+            eval_main(args)
+        case "serve":
+            from codebase.daemon import main as serve_main
+
+            serve_main(args)
+        case "rpc":
+            from codebase.rpc import main as rpc_main
+
+            rpc_main(args)
         case _:
             parser.print_help()
             exit(1)
@@ -1,6 +1,6 @@
 import os
+import json
 from pathlib import Path
-from jsonc_parser.parser import JsoncParser
 from collections.abc import MutableMapping
 
 
@@ -48,6 +48,58 @@ def get_xdg_config_path(app_name: str, config_file: str) -> Path:
     return config_path
 
 
+def get_xdg_cache_path(app_name: str, cache_file: str) -> Path:
+    """
+    根据 XDG 规范获取缓存文件的完整路径（$XDG_CACHE_HOME 或 ~/.cache）。
+    """
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+    cache_dir = Path(xdg_cache_home) if xdg_cache_home else Path.home() / ".cache"
+    return cache_dir / app_name / cache_file
+
+
+def load_jsonc(path: Path) -> dict:
+    """
+    解析 JSONC 配置文件。
+
+    解析结果按文件的 mtime 和大小缓存为普通 JSON，文件未修改时直接读取缓存，
+    不必导入并运行 jsonc_parser，缩短每次 CLI 启动的时间。缓存不可用时退回直接解析。
+    """
+    stat = path.stat()
+    key = str(path.resolve())
+    cache_path = get_xdg_cache_path("codebase", "config-cache.json")
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache: dict = json.load(f)
+        entry = cache.get(key)
+        if (
+            entry is not None
+            and entry["mtime_ns"] == stat.st_mtime_ns
+            and entry["size"] == stat.st_size
+        ):
+            return entry["config"]
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        cache = {}
+
+    from jsonc_parser.parser import JsoncParser
+
+    config = JsoncParser.parse_file(path)
+    cache[key] = {
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "config": config,
+    }
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # 先写临时文件再替换，避免并发启动的进程读到写了一半的缓存
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    return config
+
+
 def find_local_config() -> Path | None:
     """
     使用 pathlib 从当前目录开始，向父目录逐级向上寻找 '.codebase' 文件夹。
@@ -79,13 +131,9 @@ def find_local_config() -> Path | None:
         current_path = parent_path
 
 
-CONFIG = {
-    "pgvector": {
-        "dbname": "codebase_indexing",
-        "user": "postgres",
-        "host": "127.0.0.1",
-        "port": "5432",
-        "default_sql": """
+# 默认的 pgvector.default_sql。MCP semantic_search 只在用户修改了它 (如加上 WHERE 条件) 时执行它，
+# 否则使用可分页的 top-k 检索
+DEFAULT_PGVECTOR_SQL = """
 SELECT file_path, embedding <=> %(embedding)s::vector as distance
 FROM code_chunks
 -- always use double %%
@@ -94,10 +142,139 @@ FROM code_chunks
 ORDER BY embedding <=> %(embedding)s::vector
 LIMIT 10;
 """
+
+CONFIG = {
+    "pgvector": {
+        "dbname": "codebase_indexing",
+        "user": "postgres",
+        "host": "127.0.0.1",
+        "port": "5432",
+        "default_sql": DEFAULT_PGVECTOR_SQL,
+    },
+    # 搜索结果附带的代码片段，在 SQL 中截取，避免传输整个文件
+    "snippet": {
+        # 每条结果最多返回的行数
+        "lines": 20,
+        # 单条结果片段的字节上限
+        "max_bytes_per_result": 2048,
+        # 单次响应中所有片段的字节上限
+        "max_bytes_per_response": 16384,
     },
-    # openai | sentence_transformer
+    # 可选的 cross-encoder 重排序：取向量检索的前 candidates 个结果在本地 CPU 上重新打分
+    "rerank": {
+        "enabled": False,
+        "model": "cross-encoder/ms-marco-MiniLM-L-6-v2",
+        "candidates": 50,
+        "batch_size": 16,
+        # 送入模型的每个代码块的最大字符数
+        "max_chars": 2048,
+        # 超出时间预算则退回向量检索的顺序
+        "budget_ms": 500,
+        # 缓存 (query, 内容哈希) -> 分数 的条目数
+        "cache_size": 10000,
+    },
+    # Matryoshka (MRL) 两阶段检索: 先用截断后的低维前缀向量粗召回，再用完整向量精确重排
+    # 需要建表时传入 -v coarse_dim=256，创建 embedding_coarse 列及其 HNSW 索引
+    "matryoshka": {
+        "enabled": False,
+        # 粗召回向量的维度，必须与建表时的 coarse_dim 一致
+        "coarse_dim": 256,
+        # 完整向量的维度，null 表示直接使用模型输出；设置后必须与建表时的 dim 一致
+        "full_dim": None,
+        # 粗召回的候选数量
+        "candidates": 200,
+    },
+    "indexing": {
+        # 每次调用 encode_batch 的文件数，本地模型在批内按 token 长度分桶
+        "batch_size": 32,
+    },
+    # 分布式索引: codebase index --enqueue 写入 index_jobs 表，codebase index --worker 认领
+    "work_queue": {
+        # 认领的任务在租约到期前未完成 (如 worker 崩溃) 时会被其它 worker 重新认领
+        "lease_seconds": 600,
+        # 每个任务最多被认领的次数，避免反复导致 worker 崩溃的任务被无限重试
+        "max_attempts": 3,
+        # 没有可认领的任务但其它 worker 仍持有租约时，等待的秒数
+        "poll_interval": 1,
+    },
+    # 超过 max_tokens 的输入切分为相互重叠的窗口分别编码，再按 token 数加权平均为一个向量
+    "windowing": {
+        "enabled": True,
+        "max_tokens": 8192,
+        "overlap": 256,
+        # 单个输入最多的窗口数，超出的部分被截断
+        "max_windows": 16,
+        # tokenizer.json 的路径，null 表示 <model>/tokenizer.json；找不到时按 4 个字符一个 token 估算
+        "tokenizer": None,
+    },
+    # 近重复检测: 编码前计算每个文件 token 片段的 64 位 SimHash 指纹，与已索引或本次较早索引的代表文件
+    # 相差不超过 max_distance (0-3) 位的文件只链接到代表文件 (duplicate_of)，不生成 embedding，也不进入 HNSW 索引；
+    # 少于 min_tokens 个 token 的文件总是单独编码。需要 create_tables.sql 中的 simhash 和 duplicate_of 列
+    "dedup": {"enabled": False, "max_distance": 3, "min_tokens": 64},
+    # 目录级索引 (由粗到细检索): 先按目录中心向量选出最接近查询的 directories 个目录，再只在这些目录的文件中精确检索，
+    # 结果集中在少数子系统中，也不需要扫描整个 HNSW 索引。需要建表时传入 -v directory_depth=3 (目录截取的层数)，
+    # codebase index 在写入时更新变化目录的中心向量；开启后优先于 matryoshka 两阶段检索
+    "directory_index": {"enabled": False, "directories": 8},
+    # `codebase serve` 常驻进程，null 表示 $XDG_RUNTIME_DIR/codebase-<配置摘要>.sock，
+    # 每种配置 (如各项目的 .codebase/config.jsonc) 各有一个守护进程
+    "daemon": {"socket": None},
+    # MCP server: 设置 metrics_port 后在 127.0.0.1 上提供 /metrics (Prometheus 文本格式) 和 /stats (JSON)；
+    # query_cache_size 为缓存的查询向量个数，semantic_search 翻页时不再重新生成向量；
+    # warmup: 启动时在后台加载并试运行模型、连接数据库并执行 queries 个示例查询（预编译语句），
+    # prewarm 为 true 时再用 pg_prewarm 扩展（需 CREATE EXTENSION pg_prewarm）把索引和表读入 shared buffers
+    "mcp": {
+        "metrics_port": None,
+        "query_cache_size": 256,
+        "warmup": {"enabled": True, "queries": 3, "prewarm": True},
+    },
+    # openai | sentence_transformer | onnx
     "model_provider": "openai",
-    "openai": {"url": "http://localhost:8000"},
+    "openai": {
+        "url": "http://localhost:8000",
+        # 单个请求的超时（秒）
+        "timeout": 30,
+        # 连接错误、429、5xx 的重试次数，重试间隔为带随机抖动的指数退避
+        "max_retries": 5,
+        "backoff_base": 0.5,
+        "backoff_max": 30,
+        # 每个请求最多包含的文本数；遇到 413 或超时自动减半，成功后逐步恢复
+        "batch_size": 32,
+        # 同时进行的请求数上限
+        "max_concurrency": 4,
+        # 每分钟估算的 token 数上限，0 表示不限制
+        "tokens_per_minute": 0,
+        # base64 | float；base64 体积更小、解析更快，服务端不支持时自动退回 float
+        "encoding_format": "base64",
+        # 接受 gzip 压缩的响应；向量数据压缩率很低，只在慢速网络上值得开启
+        "gzip": False,
+    },
+    # 本地 sentence-transformers 模型，批处理方式与 onnx 相同
+    "sentence_transformer": {"batch_size": 32, "max_batch_tokens": 16384},
+    # codebase index 时启动多个本地编码进程 (sentence_transformer / onnx)，每个进程一份模型
+    "encode_pool": {
+        # 进程数，0 或 1 表示在当前进程内编码
+        "processes": 0,
+        # 每个进程的线程数，0 表示 CPU 核数 / processes
+        "threads": 0,
+        # 每次分给一个进程的文本数
+        "chunk_size": 16,
+    },
+    # 使用 ONNX Runtime 在 CPU 上推理，需要安装 codebase[onnx]
+    "onnx": {
+        # ONNX 模型目录，null 表示 <model>/onnx；不存在时自动导出
+        "path": None,
+        # 动态 int8 量化
+        "quantize": False,
+        # intra-op 线程数，0 表示由 ONNX Runtime 决定
+        "threads": 0,
+        # last_token (Qwen3-Embedding) | mean | cls
+        "pooling": "last_token",
+        "max_length": 8192,
+        # 每批最多的文本数
+        "batch_size": 16,
+        # 每批补齐后的 token 总数上限 (批大小 x 批内最长输入)，输入按长度分桶
+        "max_batch_tokens": 16384,
+    },
     # the last '/' matters
     # Qwen3-Embedding uses cosine similarity, see https://arxiv.org/pdf/2506.05176
     "model": "/home/jiangyinzuo/Qwen3-Embedding-0.6B/",
@@ -107,8 +284,8 @@ LIMIT 10;
 xdg_config_path = get_xdg_config_path("codebase", "config.jsonc")
 if xdg_config_path.exists():
     try:
-        # 直接加载 JSONC 文件
-        global_jsonc_config: dict = JsoncParser.parse_file(xdg_config_path)
+        # 加载 JSONC 文件，解析结果按 mtime 缓存
+        global_jsonc_config: dict = load_jsonc(xdg_config_path)
         recursive_merge(CONFIG, global_jsonc_config)
     except Exception as e:
         print(f"加载 JSONC 失败: {e}")
@@ -119,8 +296,8 @@ if local_config_path:
     local_jsonc_path = local_config_path / "config.jsonc"
     if local_jsonc_path.exists():
         try:
-            # 直接加载 JSONC 文件
-            local_jsonc_config: dict = JsoncParser.parse_file(local_jsonc_path)
+            # 加载 JSONC 文件，解析结果按 mtime 缓存
+            local_jsonc_config: dict = load_jsonc(local_jsonc_path)
             recursive_merge(CONFIG, local_jsonc_config)
         except Exception as e:
             print(f"加载本地 JSONC 失败: {e}")
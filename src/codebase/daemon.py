@@ -0,0 +1,240 @@
+"""
+`codebase serve`: keep the embedding model and database connections warm
+behind a Unix domain socket, so that `codebase search` does not load the
+model in every process.
+
+The protocol is one JSON object per line in each direction. A request is
+``{"method": ..., "params": {...}, "config": ...}`` and a response is
+``{"ok": true, "result": ...}`` or ``{"ok": false, "error": "..."}``.
+
+A daemon answers with the configuration it resolved at startup, including
+the `.codebase/config.jsonc` of its working directory. The default socket
+name carries a digest of that configuration and every request carries the
+client's digest, so a client in another project never gets the results of
+another project's database or model: it finds no daemon, or the daemon
+refuses and the client searches in-process.
+"""
+
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+from argparse import Namespace
+from pathlib import Path
+
+
+class DaemonError(Exception):
+    pass
+
+
+def config_digest() -> str:
+    """
+    Digest of the resolved configuration. The database name is left out,
+    requests name their database, and so is the daemon section.
+    """
+    from codebase.config import CONFIG
+
+    config = {key: value for key, value in CONFIG.items() if key != "daemon"}
+    config["pgvector"] = {
+        key: value for key, value in CONFIG["pgvector"].items() if key != "dbname"
+    }
+    text = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf8")).hexdigest()[:16]
+
+
+def default_socket_path() -> Path:
+    from codebase.config import CONFIG
+
+    configured = CONFIG["daemon"]["socket"]
+    if configured:
+        return Path(configured).expanduser()
+    # One daemon per configuration
+    digest = config_digest()
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return Path(runtime_dir) / f"codebase-{digest}.sock"
+    return Path(tempfile.gettempdir()) / f"codebase-{os.getuid()}-{digest}.sock"
+
+
+def daemon_request(
+    method: str, params: dict, socket_path: Path | None = None, timeout: float = 60
+):
+    """
+    Send one request to a running daemon.
+
+    Returns None when no daemon is listening or the daemon runs with another
+    configuration, so that the caller can fall back to doing the work
+    in-process. Errors reported by the daemon raise DaemonError.
+    """
+    socket_path = socket_path or default_socket_path()
+    if not socket_path.exists():
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(str(socket_path))
+            request = {"method": method, "params": params, "config": config_digest()}
+            request = json.dumps(request) + "\n"
+            sock.sendall(request.encode("utf8"))
+            with sock.makefile("r", encoding="utf8") as reader:
+                line = reader.readline()
+    except (ConnectionRefusedError, FileNotFoundError):
+        # Stale socket file of a daemon that is gone
+        return None
+    if not line:
+        raise DaemonError("daemon closed the connection")
+    response = json.loads(line)
+    if response.get("config_mismatch"):
+        return None
+    if not response["ok"]:
+        raise DaemonError(response["error"])
+    return response["result"]
+
+
+class DaemonModel:
+    """Stands in for the embedding model, encoding with a running daemon."""
+
+    def __init__(self, socket_path: Path | None = None):
+        self.socket_path: Path | None = socket_path
+
+    def encode(self, text: str):
+        import numpy as np
+
+        embedding = daemon_request("encode", {"text": text}, self.socket_path)
+        if embedding is None:
+            raise DaemonError("the daemon is no longer running")
+        return np.asarray(embedding, dtype=np.float32)
+
+
+class DaemonState:
+    """Model and per-database connectors shared by all connections."""
+
+    def __init__(self, model):
+        self.model = model
+        # Requests from clients with another configuration are refused
+        self.config_digest: str = config_digest()
+        self.connectors: dict[str, object] = {}
+        # psycopg connections and the model are used by one request at a time
+        self.lock = threading.Lock()
+
+    def connector(self, dbname: str):
+        from codebase.config import CONFIG
+        from codebase.pgvector import PGVectorConnector
+
+        dbname = dbname or CONFIG["pgvector"]["dbname"]
+        if dbname not in self.connectors:
+            self.connectors[dbname] = PGVectorConnector(
+                {**CONFIG["pgvector"], "dbname": dbname}
+            )
+        return self.connectors[dbname]
+
+    def drop_connector(self, dbname: str):
+        """Reconnect on the next request for dbname."""
+        from codebase.config import CONFIG
+
+        self.connectors.pop(dbname or CONFIG["pgvector"]["dbname"], None)
+
+    def handle(self, method: str, params: dict):
+        from codebase.search import run_batch, run_search
+
+        if method == "ping":
+            return "pong"
+        if method == "encode":
+            with self.lock:
+                return self.model.encode(params["text"]).tolist()
+        with self.lock:
+            dbname = params.get("dbname", "")
+            try:
+                if method == "search":
+                    return run_search(
+                        self.connector(dbname), lambda: self.model, params
+                    )
+                if method == "batch_search":
+                    return run_batch(
+                        self.connector(dbname),
+                        self.model,
+                        params["queries"],
+                        params["top_k"],
+                    )
+            except Exception:
+                # Reconnect on the next request
+                self.drop_connector(dbname)
+                raise
+        raise DaemonError(f"unknown method: {method}")
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        state: DaemonState = self.server.state  # type: ignore[attr-defined]
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if request.get("config", state.config_digest) != state.config_digest:
+                    response = {
+                        "ok": False,
+                        "error": "the daemon runs with another configuration",
+                        "config_mismatch": True,
+                    }
+                else:
+                    result = state.handle(
+                        request["method"], request.get("params", {})
+                    )
+                    response = {"ok": True, "result": result}
+            except Exception as e:
+                response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(
+                (json.dumps(response, default=str) + "\n").encode("utf8")
+            )
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, state: DaemonState):
+        self.state = state
+        super().__init__(str(socket_path), DaemonRequestHandler)
+        # Only the current user may talk to the daemon
+        os.chmod(socket_path, 0o600)
+
+
+def create_server(socket_path: Path, state: DaemonState) -> DaemonServer:
+    if socket_path.exists():
+        try:
+            running = daemon_request("ping", {}, socket_path, timeout=1) is not None
+        except (DaemonError, OSError, ValueError):
+            running = False
+        if running:
+            raise DaemonError(f"a daemon is already listening on {socket_path}")
+        socket_path.unlink(missing_ok=True)
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    return DaemonServer(socket_path, state)
+
+
+def main(args: Namespace):
+    import signal
+    import sys
+
+    socket_path = Path(args.socket) if args.socket else default_socket_path()
+
+    print("Loading embedding model...", file=sys.stderr)
+    from codebase.model_provider import get_embedding_model
+
+    state = DaemonState(get_embedding_model())
+    # Connect to the default database up front
+    state.connector("")
+
+    server = create_server(socket_path, state)
+    # Make `kill` run the cleanup below
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"codebase daemon listening on {socket_path}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        socket_path.unlink(missing_ok=True)
@@ -0,0 +1,173 @@
+"""
+Near-duplicate detection before embedding: vendored libraries, generated
+stubs and copied fixtures get a 64-bit SimHash of their token shingles.
+Files within a few bits of an already indexed (or earlier in this run)
+representative are linked to it instead of being embedded.
+
+Two fingerprints within MAX_DISTANCE bits agree on at least one of their
+BANDS 16-bit bands, so candidates are found by exact band matches (an
+index lookup in the database) and then checked bit by bit.
+"""
+
+import hashlib
+import re
+from functools import lru_cache
+
+import numpy as np
+
+# Tokens: identifiers, numbers and single punctuation characters
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+SHINGLE = 3
+BANDS = 4
+BAND_BITS = 64 // BANDS
+# Largest distance for which a shared band is guaranteed
+MAX_DISTANCE = BANDS - 1
+
+# Per-position multipliers combining token hashes into a shingle hash
+_MULTIPLIERS = np.array(
+    [0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9], dtype=np.uint64
+)
+
+
+# Identifiers and keywords repeat across the files of a tree
+@lru_cache(maxsize=1 << 16)
+def _token_hash(token: str) -> int:
+    # Stable across processes, unlike hash()
+    return int.from_bytes(
+        hashlib.blake2b(token.encode("utf8"), digest_size=8).digest(), "little"
+    )
+
+
+def _mix(values: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer, spreads shingle hashes over all 64 bits."""
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def simhash(text: str, min_tokens: int = 0) -> int | None:
+    """
+    64-bit SimHash of the distinct SHINGLE-token shingles of text, as a signed int
+    (fits a BIGINT column). None when text has fewer than min_tokens tokens:
+    short files are cheap to embed and collide easily.
+    """
+    tokens = TOKEN_RE.findall(text)
+    if len(tokens) < max(min_tokens, SHINGLE):
+        return None
+    vocabulary = {token: i for i, token in enumerate(dict.fromkeys(tokens))}
+    ids = np.fromiter(map(vocabulary.__getitem__, tokens), np.intp, len(tokens))
+    token_hashes = np.fromiter(map(_token_hash, vocabulary), np.uint64, len(vocabulary))
+    token_hashes = token_hashes[ids]
+    with np.errstate(over="ignore"):
+        shingles = np.zeros(len(tokens) - SHINGLE + 1, dtype=np.uint64)
+        for i in range(SHINGLE):
+            shingles += token_hashes[i : len(shingles) + i] * _MULTIPLIERS[i]
+        # Every distinct shingle counts once, else a repeated one (a row of
+        # "#" in a banner comment) outvotes the rest of the file
+        shingles = _mix(np.unique(shingles))
+    # Bit votes: +1 where a shingle hash has the bit set, -1 otherwise
+    bits = np.unpackbits(shingles.view(np.uint8).reshape(-1, 8), axis=1)
+    votes = 2 * bits.sum(axis=0, dtype=np.int64) - len(shingles)
+    value = int.from_bytes(np.packbits(votes > 0).tobytes(), "little")
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return ((a ^ b) & 0xFFFFFFFFFFFFFFFF).bit_count()
+
+
+def bands(fingerprint: int) -> tuple[int, ...]:
+    """The BANDS 16-bit bands of fingerprint, high bits first, like the SQL index expressions."""
+    mask = (1 << BAND_BITS) - 1
+    return tuple(
+        (fingerprint >> (BAND_BITS * (BANDS - 1 - i))) & mask for i in range(BANDS)
+    )
+
+
+class NearDuplicateIndex:
+    """In-memory representatives of one indexing run, looked up by band."""
+
+    def __init__(self, max_distance: int = MAX_DISTANCE):
+        if not 0 <= max_distance <= MAX_DISTANCE:
+            raise ValueError(f"max_distance must be between 0 and {MAX_DISTANCE}")
+        self.max_distance: int = max_distance
+        self.fingerprints: dict[str, int] = {}
+        # (band number, band value) -> file paths
+        self.buckets: dict[tuple[int, int], set[str]] = {}
+
+    def add(self, file_path: str, fingerprint: int):
+        self.discard(file_path)
+        self.fingerprints[file_path] = fingerprint
+        for key in enumerate(bands(fingerprint)):
+            self.buckets.setdefault(key, set()).add(file_path)
+
+    def discard(self, file_path: str):
+        fingerprint = self.fingerprints.pop(file_path, None)
+        if fingerprint is None:
+            return
+        for key in enumerate(bands(fingerprint)):
+            self.buckets[key].discard(file_path)
+
+    def find(self, fingerprint: int) -> str | None:
+        """The closest representative within max_distance, ties by path."""
+        candidates = set()
+        for key in enumerate(bands(fingerprint)):
+            candidates |= self.buckets.get(key, set())
+        best = None
+        for file_path in candidates:
+            distance = hamming_distance(fingerprint, self.fingerprints[file_path])
+            if distance <= self.max_distance and (
+                best is None or (distance, file_path) < best
+            ):
+                best = (distance, file_path)
+        return best[1] if best is not None else None
+
+
+class Deduplicator:
+    """
+    Decides, batch by batch, which files of an indexing run are embedded and
+    which are linked to a representative: a file already indexed as one, or
+    a file embedded earlier in the run.
+    """
+
+    def __init__(self, max_distance: int = MAX_DISTANCE, min_tokens: int = 64):
+        self.index = NearDuplicateIndex(max_distance)
+        self.min_tokens: int = min_tokens
+        self.linked: int = 0
+        # Files assigned in this run: the stored fingerprints of the ones
+        # not flushed yet are stale
+        self.assigned: set[str] = set()
+
+    def assign(
+        self, updater, files: list[tuple[str, str]]
+    ) -> tuple[list[int | None], dict[int, str]]:
+        """
+        :param files: (file_path, code_text) of one batch
+        :return: the fingerprint of every file (None when too short) and
+                 {position in files: representative path} of the duplicates
+        """
+        fingerprints = [simhash(text, self.min_tokens) for _, text in files]
+        paths = [file_path for file_path, _ in files]
+        known = [f for f in fingerprints if f is not None]
+        if known:
+            for file_path, fingerprint in updater.find_representatives(known, paths):
+                if file_path not in self.assigned:
+                    self.index.add(file_path, fingerprint)
+        duplicates = {}
+        for i, (file_path, fingerprint) in enumerate(zip(paths, fingerprints)):
+            # A re-indexed file is no longer its own stored representative
+            self.index.discard(file_path)
+            if fingerprint is None:
+                continue
+            representative = self.index.find(fingerprint)
+            if representative is None:
+                self.index.add(file_path, fingerprint)
+            else:
+                duplicates[i] = representative
+        self.assigned.update(paths)
+        self.linked += len(duplicates)
+        return fingerprints, duplicates
+
+    def forget(self, file_path: str):
+        """file_path could not be embedded and cannot represent others."""
+        self.index.discard(file_path)
@@ -0,0 +1,272 @@
+"""
+`codebase eval`: recall of the approximate (HNSW) search against exact search
+on this corpus, over a sweep of hnsw.ef_search and, for Matryoshka two-stage
+search, of the coarse candidate count and, for the coarse-to-fine directory
+search, of the number of directories searched. Reports recall@k, latency percentiles
+and which settings are on the recall/latency Pareto frontier.
+"""
+
+from argparse import Namespace
+import time
+
+import numpy as np
+
+from codebase.search import (
+    DEFAULT_EF_SEARCH,
+    DIRECTORY_SEARCH_SQL,
+    SEARCH_SQL,
+    TWO_STAGE_SEARCH_SQL,
+)
+
+
+def sample_query_vectors(
+    connector, n: int, seed: float | None = None
+) -> list[np.ndarray]:
+    """
+    Use the embeddings of n random chunks as query vectors, so no embedding
+    model is needed. seed (in [-1, 1]) makes the sample repeatable.
+    """
+    if seed is not None:
+        connector.cur.execute("SELECT setseed(%s)", (seed,))
+    connector.cur.execute(
+        # Near-duplicates have no embedding
+        "SELECT embedding FROM code_chunks WHERE embedding IS NOT NULL "
+        "ORDER BY random() LIMIT %s",
+        (n,),
+    )
+    return [
+        np.asarray(row[0].to_numpy(), dtype=np.float32)
+        for row in connector.cur.fetchall()
+    ]
+
+
+def exact_top_k(connector, embedding: np.ndarray, top_k: int) -> list[str]:
+    """Sequential scan with index scans disabled: ground truth for recall."""
+    connector.cur.execute("SET LOCAL enable_indexscan = off")
+    _, records = connector.execute_select(
+        SEARCH_SQL, {"embedding": embedding, "top_k": top_k}
+    )
+    connector.conn.rollback()
+    return [record[0] for record in records]
+
+
+def recall(found: list[str], expected: list[str]) -> float:
+    if not expected:
+        return 1.0
+    return len(set(found) & set(expected)) / len(expected)
+
+
+def latency_percentiles(latencies: list[float]) -> dict:
+    """p50/p95/p99 of latencies given in seconds, in milliseconds."""
+    milliseconds = np.asarray(latencies) * 1000
+    return {
+        "p50_ms": float(np.percentile(milliseconds, 50)),
+        "p95_ms": float(np.percentile(milliseconds, 95)),
+        "p99_ms": float(np.percentile(milliseconds, 99)),
+    }
+
+
+def measure(
+    connector,
+    queries: list[np.ndarray],
+    truth: list[list[str]],
+    sql: str,
+    make_params,
+    relevant: list[list[str]] | None = None,
+) -> dict:
+    """Run sql for every query, compare with truth and time each call."""
+    # Prepare the statement before timing
+    connector.execute_select(sql, make_params(queries[0]), prepare=True)
+    latencies, recalls, label_recalls = [], [], []
+    for i, embedding in enumerate(queries):
+        params = make_params(embedding)
+        start = time.perf_counter()
+        _, records = connector.execute_select(sql, params, prepare=True)
+        latencies.append(time.perf_counter() - start)
+        found = [record[0] for record in records]
+        recalls.append(recall(found, truth[i]))
+        if relevant is not None:
+            label_recalls.append(recall(found, relevant[i]))
+    result = {"recall@k": float(np.mean(recalls)), **latency_percentiles(latencies)}
+    if relevant is not None:
+        result["label_recall@k"] = float(np.mean(label_recalls))
+    return result
+
+
+def mark_pareto_frontier(results: list[dict], latency_key: str = "p50_ms"):
+    """
+    Set "pareto" on every result: True when no other result has at least the
+    same recall at no more latency, with one of the two strictly better.
+    """
+    for result in results:
+        result["pareto"] = not any(
+            other["recall@k"] >= result["recall@k"]
+            and other[latency_key] <= result[latency_key]
+            and (
+                other["recall@k"] > result["recall@k"]
+                or other[latency_key] < result[latency_key]
+            )
+            for other in results
+        )
+
+
+def run_eval(
+    connector,
+    queries: list[np.ndarray],
+    top_k: int,
+    ef_searches: list[int],
+    candidates: list[int] | None = None,
+    coarse_dim: int | None = None,
+    relevant: list[list[str]] | None = None,
+    directories: list[int] | None = None,
+) -> list[dict]:
+    """
+    :return: one result per setting: the exact scan, every ef_search of the
+             HNSW search, every candidate count of the two-stage search and
+             every directory count (in candidates) of the directory search
+    """
+    from codebase.model_provider import truncate_embedding
+
+    truth, latencies = [], []
+    for embedding in queries:
+        start = time.perf_counter()
+        truth.append(exact_top_k(connector, embedding, top_k))
+        latencies.append(time.perf_counter() - start)
+    exact = {"mode": "exact", "ef_search": None, "candidates": None, "recall@k": 1.0}
+    exact.update(latency_percentiles(latencies))
+    if relevant is not None:
+        exact["label_recall@k"] = float(
+            np.mean([recall(found, labels) for found, labels in zip(truth, relevant)])
+        )
+    results = [exact]
+
+    for ef_search in ef_searches:
+        connector.set_ef_search(ef_search)
+        results.append(
+            {
+                "mode": "hnsw",
+                "ef_search": ef_search,
+                "candidates": None,
+                **measure(
+                    connector,
+                    queries,
+                    truth,
+                    SEARCH_SQL,
+                    lambda q: {"embedding": q, "top_k": top_k},
+                    relevant,
+                ),
+            }
+        )
+
+    for n in candidates or []:
+        ef_search = max(DEFAULT_EF_SEARCH, n)
+        connector.set_ef_search(ef_search)
+        results.append(
+            {
+                "mode": f"two-stage ({coarse_dim}d)",
+                "ef_search": ef_search,
+                "candidates": n,
+                **measure(
+                    connector,
+                    queries,
+                    truth,
+                    TWO_STAGE_SEARCH_SQL,
+                    lambda q: {
+                        "embedding": q,
+                        "embedding_coarse": truncate_embedding(q, coarse_dim),
+                        "candidates": n,
+                        "top_k": top_k,
+                    },
+                    relevant,
+                ),
+            }
+        )
+
+    for n in directories or []:
+        results.append(
+            {
+                "mode": "directories",
+                "ef_search": None,
+                "candidates": n,
+                **measure(
+                    connector,
+                    queries,
+                    truth,
+                    DIRECTORY_SEARCH_SQL,
+                    lambda q: {"embedding": q, "directories": n, "top_k": top_k},
+                    relevant,
+                ),
+            }
+        )
+
+    mark_pareto_frontier(results)
+    return results
+
+
+def parse_int_list(text: str) -> list[int]:
+    return [int(item) for item in text.split(",") if item.strip()]
+
+
+def main(args: Namespace):
+    import json
+    import sys
+
+    from tabulate import tabulate
+
+    from codebase.config import CONFIG
+    from codebase.pgvector import PGVectorConnector
+
+    if len(args.dbname) > 0:
+        CONFIG["pgvector"]["dbname"] = args.dbname
+    connector = PGVectorConnector()
+
+    relevant = None
+    if args.queries_file:
+        from codebase.model_provider import get_embedding_model
+        from codebase.search import read_queries_file
+
+        items = read_queries_file(args.queries_file)
+        if any(not item.get("query") for item in items):
+            print('ERROR: Every line of the queries file needs a non-empty "query".')
+            exit(1)
+        print(f"Converting {len(items)} queries to embeddings...", file=sys.stderr)
+        queries = list(get_embedding_model().encode_batch([i["query"] for i in items]))
+        # Labelled queries: "relevant" lists the files that should be found
+        if all("relevant" in item for item in items):
+            relevant = [item["relevant"] for item in items]
+    else:
+        queries = sample_query_vectors(connector, args.queries, args.seed)
+    if not queries:
+        print("ERROR: No queries, is the database indexed?")
+        exit(1)
+
+    candidates = None
+    coarse_dim = CONFIG["matryoshka"]["coarse_dim"]
+    if args.candidates:
+        candidates = parse_int_list(args.candidates)
+    elif CONFIG["matryoshka"]["enabled"]:
+        candidates = [CONFIG["matryoshka"]["candidates"]]
+
+    directories = None
+    if args.directories:
+        directories = parse_int_list(args.directories)
+    elif CONFIG["directory_index"]["enabled"]:
+        directories = [CONFIG["directory_index"]["directories"]]
+
+    results = run_eval(
+        connector,
+        queries,
+        args.top_k,
+        parse_int_list(args.ef_search),
+        candidates,
+        coarse_dim,
+        relevant,
+        directories,
+    )
+
+    if args.json:
+        report = {"queries": len(queries), "top_k": args.top_k, "results": results}
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{len(queries)} queries, top_k={args.top_k}")
+        print(tabulate(results, headers="keys", floatfmt=".3f"))
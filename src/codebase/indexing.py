@@ -1,8 +1,17 @@
 from pathlib import Path
+import numpy as np
 from codebase.pgvector import PGVectorConnector
-from codebase.ts_chunk import remove_header_junk
+from codebase.ts_chunk import strip_header
 from tree_sitter import Language
-from codebase.model_provider import EMBEDDING_MODEL, ModelProvider
+from codebase.model_provider import (
+    EmbeddingError,
+    ModelProvider,
+    create_indexing_model,
+    truncate_embedding,
+)
+from codebase.dedup import Deduplicator, hamming_distance
+from codebase.profiling import Profiler
+from codebase.windowing import Windower
 from argparse import Namespace
 import subprocess
 import os
@@ -10,9 +19,28 @@ import os
 
 class Indexer:
 
-    def __init__(self, model: ModelProvider, language_map: dict[str, Language]):
+    def __init__(
+        self,
+        model: ModelProvider,
+        language_map: dict[str, Language],
+        coarse_dim: int | None = None,
+        windower: Windower | None = None,
+        batch_size: int = 32,
+        profiler: Profiler | None = None,
+        deduplicator: Deduplicator | None = None,
+    ):
         self.model: ModelProvider = model
         self.language_map: dict[str, Language] = language_map
+        # 不为 None 时同时写入 Matryoshka 截断后的低维向量 embedding_coarse
+        self.coarse_dim: int | None = coarse_dim
+        # 不为 None 时按 token 数切分超长文件，分窗口编码后合并为一个向量
+        self.windower: Windower | None = windower
+        # 每次 encode_batch 的文件数
+        self.batch_size: int = batch_size
+        # 记录各阶段 (git/read/parse/embed/db_write) 的耗时与吞吐
+        self.profiler: Profiler = profiler if profiler is not None else Profiler()
+        # 不为 None 时编码前计算 SimHash 指纹，近重复文件只链接到代表文件，不生成 embedding
+        self.deduplicator: Deduplicator | None = deduplicator
 
     def get_git_changes(
         self, target_commit: str = "HEAD"
@@ -117,22 +145,78 @@ class Indexer:
         )
         return result.stdout.strip().split("\n") if result.stdout.strip() else []
 
-    def process_git_changes(
-        self, updater: PGVectorConnector, target_commit: str = "HEAD"
-    ) -> None:
-        """处理git变更，包括.codebaseignore过滤"""
+    def _get_git_blobs(self) -> dict[str, str]:
+        """HEAD 中每个文件的 git blob id"""
+        result = subprocess.run(
+            ["git", "ls-tree", "-r", "-z", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        blobs = {}
+        for entry in result.stdout.split("\0"):
+            if not entry:
+                continue
+            # <mode> <type> <object>\t<path>
+            info, file_path = entry.split("\t", 1)
+            _, object_type, object_id = info.split()
+            if object_type == "blob":
+                blobs[file_path] = object_id
+        return blobs
+
+    def _read_blobs(self, blobs: list[str]) -> dict[str, str]:
+        """用一次 git cat-file --batch 读取多个 blob 的内容，本地仓库中不存在的 blob 不在结果中"""
+        if not blobs:
+            return {}
+        output = subprocess.run(
+            ["git", "cat-file", "--batch"],
+            input="\n".join(blobs).encode() + b"\n",
+            capture_output=True,
+            check=True,
+        ).stdout
+        contents = {}
+        pos = 0
+        while pos < len(output):
+            end = output.index(b"\n", pos)
+            # "<object> <type> <size>" 后跟内容和换行，或 "<object> missing"
+            header = output[pos:end].split()
+            pos = end + 1
+            if len(header) == 3:
+                size = int(header[2])
+                contents[header[0].decode()] = output[pos : pos + size].decode(
+                    "utf-8", errors="replace"
+                )
+                pos += size + 1
+        return contents
+
+    def _fetch_blobs(self, blobs: list[str]) -> dict[str, str]:
+        """git fetch 后重新读取本地仓库中不存在的 blob；fetch 失败时返回已能读取的部分"""
+        result = subprocess.run(["git", "fetch", "--quiet"], capture_output=True)
+        if result.returncode != 0:
+            print(f"git fetch 失败: {result.stderr.decode(errors='replace').strip()}")
+        return self._read_blobs(blobs)
+
+    def _git_change_set(
+        self, updater: PGVectorConnector, target_commit: str
+    ) -> tuple[list[str], list[str], bool]:
+        """
+        检测git变更并按.codebaseignore过滤。
+        返回 (新增和修改的文件, 删除的文件, 是否首次索引)
+        """
         # 检查是否是首次索引（没有上次commit记录）
         last_commit_hash = updater.get_last_commit_hash()
 
         # 获取git变更
-        if last_commit_hash is None:
-            # 首次索引，获取所有文件
-            added = self._get_all_git_files()
-            modified, deleted = [], []
-            print("首次索引: 索引所有git文件")
-        else:
-            # 增量索引，获取变更
-            added, modified, deleted = self.get_git_changes(target_commit)
+        with self.profiler.stage("git") as stage:
+            if last_commit_hash is None:
+                # 首次索引，获取所有文件
+                added = self._get_all_git_files()
+                modified, deleted = [], []
+                print("首次索引: 索引所有git文件")
+            else:
+                # 增量索引，获取变更
+                added, modified, deleted = self.get_git_changes(target_commit)
+            stage.count(len(added) + len(modified) + len(deleted))
 
         # 加载忽略规则
         ignore_patterns = self._load_codebase_ignore()
@@ -145,27 +229,26 @@ class Indexer:
         print(
             f"Git变更检测: 新增 {len(added)} 个文件, 修改 {len(modified)} 个文件, 删除 {len(deleted)} 个文件"
         )
+        return added + modified, deleted, last_commit_hash is None
 
-        # 处理新增和修改的文件
-        for file_path in added + modified:
-            p = Path(file_path)
-            if p.exists() and p.is_file():
-                file_embedding = self._file_to_embedding(
-                    p, self.language_map.get(p.suffix)
-                )
-                if file_embedding is None:
-                    continue
-                embedding, code_text = file_embedding
-                updater.append_file_chunk(str(p), code_text, embedding)
+    def process_git_changes(
+        self, updater: PGVectorConnector, target_commit: str = "HEAD"
+    ) -> None:
+        """处理git变更，包括.codebaseignore过滤"""
+        changed, deleted, first_index = self._git_change_set(updater, target_commit)
 
-        # 处理删除的文件
+        # 先记录删除的文件，它们不会被选为近重复文件的代表文件
         for file_path in deleted:
             updater.append_files_to_remove(file_path)
 
+        # 处理新增和修改的文件
+        paths = [Path(file_path) for file_path in changed]
+        self._index_files(updater, [p for p in paths if p.exists() and p.is_file()])
+
         updater.flush()
 
         # 如果是首次索引，更新commit hash
-        if last_commit_hash is None:
+        if first_index:
             import subprocess
 
             current_commit = subprocess.run(
@@ -173,44 +256,286 @@ class Indexer:
             ).stdout.strip()
             updater.update_last_commit_hash(current_commit)
 
-    def _file_to_embedding(
-        self, file_path: Path, language: Language | None
-    ) -> tuple[list[float], str] | None:
+    def enqueue_git_changes(
+        self, updater: PGVectorConnector, target_commit: str = "HEAD"
+    ) -> None:
         """
-        Convert a file to an embedding using the SentenceTransformer model.
+        把git变更写入工作队列而不在本进程中编码。任务带有 HEAD 中的 blob id，
+        其它机器上的 worker 只要有同一仓库的克隆就能读取内容。删除的文件直接从索引中删除。
         """
-        with open(file_path, "r", encoding="utf-8") as file:
-            content = file.read()
-            if language is not None:
-                content = remove_header_junk(content, language)
-            if content.strip() == "":
-                return None
+        changed, deleted, _ = self._git_change_set(updater, target_commit)
+        blobs = self._get_git_blobs()
+        jobs = [(path, blobs[path]) for path in changed if path in blobs]
+        updater.enqueue_jobs(jobs)
+        print(f"写入工作队列: {len(jobs)} 个文件")
 
-        # Generate the embedding
-        embedding: list[float] = self.model.encode(content)
-
-        return embedding, content
+        for file_path in deleted:
+            updater.append_files_to_remove(file_path)
+        updater.flush()
 
-    def process_files(
+    def enqueue_files(
         self, updater: PGVectorConnector, files_to_add: str, files_to_delete: str
     ) -> None:
-        files_to_add_list: list[str] = files_to_add.split()
-        for file_path in files_to_add_list:
+        """把 --add 的文件写入工作队列，worker 读取各自工作区中的同名文件"""
+        paths = [Path(file_path.strip()) for file_path in files_to_add.split()]
+        jobs = [(str(p), None) for p in paths if p.exists() and p.is_file()]
+        updater.enqueue_jobs(jobs)
+        print(f"写入工作队列: {len(jobs)} 个文件")
+
+        for file_path in files_to_delete.split():
             p = Path(file_path.strip())
-            if p.exists() and p.is_file():
-                file_embedding = self._file_to_embedding(
-                    p, self.language_map.get(p.suffix)
+            if p.is_file():
+                updater.append_files_to_remove(str(p))
+        updater.flush()
+
+    def process_jobs(
+        self,
+        updater: PGVectorConnector,
+        worker_id: str,
+        lease_seconds: float = 600,
+        max_attempts: int = 3,
+        poll_interval: float = 1,
+    ) -> int:
+        """
+        作为 worker 循环认领并处理工作队列中的任务，直到队列中没有可认领的任务。
+        每批任务的索引结果和任务删除在同一事务中提交；worker 崩溃时租约到期后任务被重新认领。
+        本地仓库中没有的 blob 先 git fetch 再读取，仍没有时不完成该任务，租约到期后由其它 worker 重新认领。
+
+        :return: 处理的任务数
+        """
+        import time
+
+        processed = 0
+        while True:
+            with self.profiler.stage("claim") as stage:
+                jobs = updater.claim_jobs(
+                    worker_id, self.batch_size, lease_seconds, max_attempts
                 )
-                if file_embedding is None:
+                stage.count(len(jobs))
+            if not jobs:
+                pending, exhausted = updater.count_jobs(max_attempts)
+                if pending == exhausted:
+                    if exhausted:
+                        print(f"{exhausted} 个任务超过 {max_attempts} 次尝试，不再认领")
+                    break
+                # 其余任务正由其它 worker 处理，等待它们完成或租约到期
+                time.sleep(poll_interval)
+                continue
+
+            with self.profiler.stage("read") as stage:
+                blobs = [blob for _, _, blob in jobs if blob is not None]
+                contents = self._read_blobs(blobs)
+                if len(contents) < len(set(blobs)):
+                    # 本地克隆可能还没有获取协调者的 HEAD
+                    contents |= self._fetch_blobs(
+                        [blob for blob in blobs if blob not in contents]
+                    )
+                stage.count(0, sum(len(text) for text in contents.values()))
+            paths: list[Path] = []
+            texts: list[str | None] = []
+            for job_id, file_path, blob in jobs:
+                if blob is not None and blob not in contents:
+                    # 不标记完成：租约到期后由能读取该 blob 的 worker 重新认领
+                    print(f"blob {blob} ({file_path}) 不在本地仓库中，留给其它 worker")
+                    continue
+                updater.append_done_job(job_id)
+                processed += 1
+                if blob is None and not Path(file_path).is_file():
+                    updater.append_failed_file(file_path, "文件不存在")
                     continue
-                embedding, code_text = file_embedding
-                updater.append_file_chunk(str(p), code_text, embedding)
+                paths.append(Path(file_path))
+                texts.append(None if blob is None else contents[blob])
+            self._index_files(updater, paths, texts)
+            updater.flush()
+
+        print(f"worker {worker_id} 处理了 {processed} 个任务")
+        return processed
+
+    def _read_code(
+        self, file_path: Path, content: str | None = None
+    ) -> tuple[str, int] | None:
+        """
+        读取文件并去除文件头；给出 content 时不读取文件。
+        返回 (code_text, start_line)，start_line 是 code_text 在原文件中的起始行号；没有代码时返回 None。
+        """
+        language = self.language_map.get(file_path.suffix)
+        start_line = 1
+        if content is None:
+            with self.profiler.stage("read") as stage:
+                with open(file_path, "r", encoding="utf-8") as file:
+                    content = file.read()
+                    stage.count(1, os.fstat(file.fileno()).st_size)
+        if language is not None:
+            with self.profiler.stage("parse") as stage:
+                content, start_line = strip_header(content, language)
+                stage.count()
+        if content.strip() == "":
+            return None
+        return content, start_line
+
+    def _encode_batch(self, texts: list[str]) -> np.ndarray:
+        if self.windower is not None:
+            return self.windower.encode_batch(self.model, texts)
+        return self.model.encode_batch(texts)
+
+    def _index_files(
+        self,
+        updater: PGVectorConnector,
+        paths: list[Path],
+        contents: list[str | None] | None = None,
+    ) -> None:
+        """
+        每 batch_size 个文件调用一次 encode_batch，本地模型可以把长度相近的文件放在同一批，减少 padding。
+        contents 与 paths 一一对应，为 None 的文件从磁盘读取。
+        """
+        if contents is None:
+            contents = [None] * len(paths)
+        # 本次索引的文件，它们原来是否为近重复由本次的结果决定
+        indexing = {str(p) for p in paths}
+        for start in range(0, len(paths), self.batch_size):
+            files = []
+            end = start + self.batch_size
+            for p, content in zip(paths[start:end], contents[start:end]):
+                code = self._read_code(p, content)
+                if code is not None:
+                    files.append((p, *code))
+            if not files:
+                continue
+            representatives = self._index_batch(updater, files)
+            if representatives:
+                stale = self._stale_duplicates(updater, representatives, indexing)
+                if stale:
+                    # 链接到的文件内容已改变，重新查找代表文件或生成 embedding
+                    self._index_batch(updater, stale)
+
+    def _index_batch(
+        self, updater: PGVectorConnector, files: list[tuple[Path, str, int]]
+    ) -> dict[str, int | None]:
+        """
+        为一批 (path, code_text, start_line) 生成 embedding 并写入 updater。
+
+        :return: 开启近重复检测时，成功索引的文件: 仍是代表文件的为新的指纹，成为近重复的为 None
+        """
+        fingerprints: list[int | None] = [None] * len(files)
+        duplicates: dict[int, str] = {}
+        if self.deduplicator is not None:
+            with self.profiler.stage("fingerprint") as stage:
+                fingerprints, duplicates = self.deduplicator.assign(
+                    updater, [(str(p), code_text) for p, code_text, _ in files]
+                )
+                stage.count(len(files))
+        embed = [i for i in range(len(files)) if i not in duplicates]
+
+        errors: dict[int, str] = {}
+        embeddings = {}
+        texts = [files[i][1] for i in embed]
+        if texts:
+            self.profiler.observe_depth("encode_batch", len(texts))
+            with self.profiler.stage("embed") as stage:
+                stage.count(
+                    len(texts), sum(len(text.encode("utf8")) for text in texts)
+                )
+                try:
+                    encoded = self._encode_batch(texts)
+                except EmbeddingError as e:
+                    # 不写入空向量，失败的文件记入 failed_files 等待重试
+                    encoded, errors = e.embeddings, e.errors
+            # errors 的键是 texts 中的位置
+            errors = {embed[j]: error for j, error in errors.items()}
+            if encoded is not None:
+                embeddings = dict(zip(embed, encoded))
+
+        representatives: dict[str, int | None] = {}
+        failed = {str(files[i][0]) for i in errors}
+        for i, (p, code_text, start_line) in enumerate(files):
+            if i in errors:
+                print(f"生成 embedding 失败: {p}: {errors[i]}")
+                updater.append_failed_file(str(p), errors[i])
+                if self.deduplicator is not None:
+                    self.deduplicator.forget(str(p))
+                continue
+            if duplicates.get(i) in failed:
+                updater.append_failed_file(
+                    str(p), f"代表文件 {duplicates[i]} 生成 embedding 失败"
+                )
+                continue
+            if i in duplicates:
+                updater.append_duplicate(
+                    str(p), code_text, start_line, fingerprints[i], duplicates[i]
+                )
+                representatives[str(p)] = None
+                continue
+            embedding = embeddings[i]
+            embedding_coarse = None
+            if self.coarse_dim is not None:
+                embedding_coarse = truncate_embedding(embedding, self.coarse_dim)
+            updater.append_file_chunk(
+                str(p),
+                code_text,
+                embedding,
+                start_line,
+                embedding_coarse,
+                simhash=fingerprints[i],
+            )
+            representatives[str(p)] = fingerprints[i]
+        return representatives if self.deduplicator is not None else {}
+
+    def _stale_duplicates(
+        self,
+        updater: PGVectorConnector,
+        representatives: dict[str, int | None],
+        indexing: set[str],
+    ) -> list[tuple[Path, str, int]]:
+        """
+        重新索引的文件在数据库中的近重复文件里，与它的新内容相差超过 max_distance 位
+        (或它已成为近重复、新内容没有指纹) 的文件。本次也在索引的文件不需要处理。
+
+        :return: [(path, code_text, start_line)]
+        """
+        max_distance = self.deduplicator.index.max_distance
+        stale = []
+        for file_path, code_text, start_line, simhash, representative in (
+            updater.fetch_duplicate_rows(list(representatives))
+        ):
+            if file_path in indexing:
+                continue
+            fingerprint = representatives[representative]
+            if (
+                fingerprint is None
+                or simhash is None
+                or hamming_distance(simhash, fingerprint) > max_distance
+            ):
+                stale.append((Path(file_path), code_text, start_line))
+        return stale
+
+    def _index_file(self, updater: PGVectorConnector, p: Path) -> None:
+        self._index_files(updater, [p])
+
+    def process_files(
+        self, updater: PGVectorConnector, files_to_add: str, files_to_delete: str
+    ) -> None:
+        files_to_add_list: list[str] = files_to_add.split()
+        paths = [Path(file_path.strip()) for file_path in files_to_add_list]
 
         files_to_delete_list: list[str] = files_to_delete.split()
         for file_path in files_to_delete_list:
             p = Path(file_path.strip())
             if p.is_file():
                 updater.append_files_to_remove(str(p))
+
+        self._index_files(updater, [p for p in paths if p.exists() and p.is_file()])
+        updater.flush()
+
+
+    def process_failed_files(self, updater: PGVectorConnector) -> None:
+        """重新索引 failed_files 中的文件，已不存在的文件从索引中删除"""
+        failed_files = updater.get_failed_files()
+        print(f"重试 {len(failed_files)} 个生成 embedding 失败的文件")
+        paths = [Path(file_path) for file_path in failed_files]
+        for p in paths:
+            if not p.is_file():
+                updater.append_files_to_remove(str(p))
+        self._index_files(updater, [p for p in paths if p.is_file()])
         updater.flush()
 
 
@@ -219,14 +544,25 @@ def main(args: Namespace):
     import tree_sitter_cpp
 
     # 检查参数互斥性
-    if hasattr(args, "git") and args.git is not None:
+    retry_failed = getattr(args, "retry_failed", False)
+    worker = getattr(args, "worker", False)
+    enqueue = getattr(args, "enqueue", False)
+    if worker:
+        if args.add or args.delete or retry_failed or enqueue or args.git is not None:
+            raise ValueError("--worker 参数不能与其它索引参数同时使用")
+    elif enqueue and retry_failed:
+        raise ValueError("--enqueue 参数只能与 --git 或 --add/--delete 同时使用")
+    elif hasattr(args, "git") and args.git is not None:
+        if args.add or args.delete or retry_failed:
+            raise ValueError("--git 参数不能与 --add/--delete/--retry-failed 同时使用")
+    elif retry_failed:
         if args.add or args.delete:
-            raise ValueError("--git 参数不能与 --add/--delete 同时使用")
+            raise ValueError("--retry-failed 参数不能与 --add/--delete 同时使用")
     elif not args.add and not args.delete:
-        raise ValueError("必须指定 --add/--delete 或 --git 参数")
+        raise ValueError("必须指定 --add/--delete、--git 或 --retry-failed 参数")
 
     if len(args.dbname) > 0:
-        from pgvector import CONFIG
+        from codebase.pgvector import CONFIG
 
         CONFIG["pgvector"]["dbname"] = args.dbname
 
@@ -236,17 +572,97 @@ def main(args: Namespace):
         ".cpp": CPP,
         ".hpp": CPP,
     }
-    updater = PGVectorConnector()
-    indexer = Indexer(EMBEDDING_MODEL, language_map)
+    from codebase.config import CONFIG
+
+    profiler = Profiler()
+    updater = PGVectorConnector(profiler=profiler)
+    matryoshka_config = CONFIG["matryoshka"]
+    windower = None
+    windowing_config = CONFIG["windowing"]
+    if windowing_config["enabled"]:
+        from codebase.windowing import TokenCounter
+
+        windower = Windower(
+            TokenCounter.for_model(CONFIG["model"], windowing_config["tokenizer"]),
+            windowing_config["max_tokens"],
+            windowing_config["overlap"],
+            windowing_config["max_windows"],
+        )
+    batch_size = CONFIG["indexing"]["batch_size"]
+    pool_config = CONFIG["encode_pool"]
+    if pool_config["processes"] > 1:
+        # 每批文件要足够分给所有编码进程
+        batch_size = max(
+            batch_size, pool_config["processes"] * pool_config["chunk_size"]
+        )
+    deduplicator = None
+    dedup_config = CONFIG["dedup"]
+    if dedup_config["enabled"]:
+        deduplicator = Deduplicator(
+            dedup_config["max_distance"], dedup_config["min_tokens"]
+        )
+        updater.dedup = True
+    # 写入时同时更新变化目录的中心向量
+    updater.directory_index = bool(CONFIG["directory_index"]["enabled"])
+    # 使用编码进程池时，进程在整个索引过程中只启动一次
+    # 只写入工作队列时不需要模型
+    model = None if enqueue else create_indexing_model()
+    indexer = Indexer(
+        model,
+        language_map,
+        matryoshka_config["coarse_dim"] if matryoshka_config["enabled"] else None,
+        windower,
+        batch_size,
+        profiler,
+        deduplicator,
+    )
+
+    try:
+        if worker:
+            import socket
+
+            queue_config = CONFIG["work_queue"]
+            indexer.process_jobs(
+                updater,
+                f"{socket.gethostname()}:{os.getpid()}",
+                queue_config["lease_seconds"],
+                queue_config["max_attempts"],
+                queue_config["poll_interval"],
+            )
+        elif hasattr(args, "git") and args.git is not None:
+            if enqueue:
+                indexer.enqueue_git_changes(updater, args.git)
+            else:
+                indexer.process_git_changes(updater, args.git)
+            # 更新最后一次索引的commit hash
+            import subprocess
 
-    if hasattr(args, "git") and args.git is not None:
-        indexer.process_git_changes(updater, args.git)
-        # 更新最后一次索引的commit hash
-        import subprocess
+            current_commit = subprocess.run(
+                ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+            ).stdout.strip()
+            updater.update_last_commit_hash(current_commit)
+        elif retry_failed:
+            indexer.process_failed_files(updater)
+        elif enqueue:
+            indexer.enqueue_files(updater, args.add, args.delete)
+        else:
+            indexer.process_files(updater, args.add, args.delete)
+    finally:
+        if model is not None:
+            model.close()
 
-        current_commit = subprocess.run(
-            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
-        ).stdout.strip()
-        updater.update_last_commit_hash(current_commit)
-    else:
-        indexer.process_files(updater, args.add, args.delete)
+    if windower is not None and windower.stats.split > 0:
+        stats = windower.stats
+        print(
+            f"超长输入: {stats.inputs} 个文件中 {stats.split} 个被切分为 {stats.windows} 个窗口，"
+            f"{stats.truncated} 个超过 {windower.max_windows} 个窗口被截断"
+        )
+
+    if deduplicator is not None and deduplicator.linked > 0:
+        print(f"近重复文件: {deduplicator.linked} 个文件链接到代表文件，未生成 embedding")
+
+    if getattr(args, "profile", False):
+        print(profiler.summary())
+    profile_output = getattr(args, "profile_output", None)
+    if profile_output:
+        profiler.write(profile_output)
@@ -1,65 +1,584 @@
+import asyncio
+import base64
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
 from mcp.server.fastmcp import FastMCP
 from mcp.server.fastmcp import Context
 import numpy as np
 
 from codebase.config import CONFIG
-from codebase.model_provider import EMBEDDING_MODEL
+from codebase.model_provider import get_embedding_model
 from codebase.pgvector import PGVectorConnector
+from codebase.profiling import Profiler, RequestMetrics
+from codebase.rerank import (
+    get_reranker,
+    loaded_reranker,
+    rerank_enabled,
+    rerank_records,
+)
+from codebase.search import (
+    MAX_EF_SEARCH,
+    batch_search,
+    custom_default_sql,
+    dedup_enabled,
+    directory_groups,
+    fetch_bounded_snippets,
+    format_snippet,
+    search_like,
+    search_top_k,
+)
 
 # Create FastMCP server
 mcp = FastMCP("codebase-semantic-search")
 
+# The connector is kept for the lifetime of the server so that the search
+# statement stays prepared on the connection between tool calls.
+_pgvector_connector: PGVectorConnector | None = None
+
+# Latency and outcome of every tool call, see server_stats
+METRICS = RequestMetrics()
+
+# Largest page of semantic_search, responses stay small
+MAX_TOP_K = 100
+
+
+def get_pgvector_connector() -> PGVectorConnector:
+    global _pgvector_connector
+    if _pgvector_connector is None:
+        _pgvector_connector = PGVectorConnector()
+    return _pgvector_connector
+
+
+class Warmup:
+    """
+    State of the warm-up at server start (see warm_up). ready is set once
+    tool calls can proceed: right away when there is no warm-up, else when
+    the model and the connection are warm or the warm-up failed.
+    """
+
+    def __init__(self):
+        # disabled | running | prewarming | ready | failed
+        self.state: str = "disabled"
+        self.error: str | None = None
+        # {relation: blocks} read by pg_prewarm, None without the extension
+        self.prewarmed: dict[str, int] | None = None
+        self.profiler = Profiler()
+        self.ready = threading.Event()
+        self.ready.set()
+
+    def to_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "error": self.error,
+            "seconds": {
+                name: stats.wall for name, stats in self.profiler.stages.items()
+            },
+            "prewarmed_blocks": self.prewarmed,
+        }
+
+
+WARMUP = Warmup()
+
+# Probe queries of the warm-up, they exercise the model and the search path
+WARMUP_QUERIES = [
+    "open a database connection",
+    "parse command line arguments",
+    "read a file line by line",
+    "handle an error and retry",
+    "sort a list of records",
+]
+
+
+async def wait_until_ready():
+    """Calls arriving during the warm-up wait for it instead of racing it."""
+    if not WARMUP.ready.is_set():
+        with METRICS.phase("warmup_wait"):
+            await asyncio.to_thread(WARMUP.ready.wait)
+
+
+class QueryEmbeddingCache:
+    """LRU cache of query embeddings, so that later pages of a search and
+    repeated queries are not encoded again."""
+
+    def __init__(self, size: int):
+        self.size: int = size
+        self.embeddings: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, query: str) -> np.ndarray | None:
+        embedding = self.embeddings.get(query)
+        if embedding is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.embeddings.move_to_end(query)
+        return embedding
+
+    def put(self, query: str, embedding: np.ndarray):
+        self.embeddings[query] = embedding
+        self.embeddings.move_to_end(query)
+        while len(self.embeddings) > self.size:
+            self.embeddings.popitem(last=False)
+
+
+QUERY_EMBEDDINGS = QueryEmbeddingCache(CONFIG["mcp"]["query_cache_size"])
+
+
+def encode_cursor(
+    query: str, offset: int, top_k: int, max_distance: float | None, rerank: bool
+) -> str:
+    """Opaque pagination cursor holding everything the next page needs."""
+    state = json.dumps(
+        [query, offset, top_k, max_distance, rerank],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(state.encode("utf8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, int, int, float | None, bool]:
+    """Raises ValueError for a cursor that encode_cursor did not make."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        query, offset, top_k, max_distance, rerank = json.loads(
+            base64.urlsafe_b64decode(padded)
+        )
+    except (ValueError, TypeError) as e:
+        raise ValueError("invalid cursor") from e
+    # An offset past the HNSW result window would make LIMIT or OFFSET negative
+    if not (
+        isinstance(query, str)
+        and isinstance(offset, int)
+        and 0 <= offset < MAX_EF_SEARCH
+        and isinstance(top_k, int)
+        and 1 <= top_k <= MAX_TOP_K
+        and (max_distance is None or isinstance(max_distance, (int, float)))
+        and isinstance(rerank, bool)
+    ):
+        raise ValueError("invalid cursor")
+    return query, offset, top_k, max_distance, rerank
+
 
 @mcp.tool()
-async def semantic_search(query: str) -> str:
-    """Perform semantic search on the codebase using the default SQL query.
+async def semantic_search(
+    query: str = "",
+    include_snippets: bool = True,
+    rerank: bool | None = None,
+    top_k: int = 10,
+    max_distance: float | None = None,
+    cursor: str | None = None,
+    collapse_duplicates: bool = True,
+    group_by_directory: bool = False,
+) -> str:
+    """Perform semantic search on the codebase.
     
     Args:
         query: The search query text
+        include_snippets: Attach a bounded code snippet to each result
+        rerank: Re-rank vector candidates with a local cross-encoder
+            (default: rerank.enabled in config)
+        top_k: Number of results per page, 1 to 100
+        max_distance: Leave out results with a larger cosine distance
+            (0 = identical, 2 = opposite); fewer results may be returned
+        cursor: The next_cursor of a previous call, to fetch the next page.
+            Its query, top_k, max_distance and rerank are used and the
+            query is not encoded again
+        collapse_duplicates: With near-duplicate detection enabled, count
+            the near-duplicates of each result instead of listing them
+        group_by_directory: List the results under the directory of their
+            file, directories in order of their best result
         
     Returns:
-        Formatted search results with file paths and similarity distances
+        Formatted search results with file paths and similarity distances,
+        ending with a next_cursor line when more results are available
     """
-    if not query:
-        return "Error: Query parameter is required"
+    with METRICS.request("semantic_search") as request:
+        await wait_until_ready()
+        offset = 0
+        if cursor:
+            try:
+                query, offset, top_k, max_distance, rerank = decode_cursor(cursor)
+            except ValueError:
+                request.error = True
+                return "Error: invalid cursor"
+        if not query:
+            request.error = True
+            return "Error: Query parameter is required"
+        if not 1 <= top_k <= MAX_TOP_K:
+            request.error = True
+            return f"Error: top_k must be between 1 and {MAX_TOP_K}"
 
-    try:
-        # Convert query text to embedding
-        query_embedding = EMBEDDING_MODEL.encode(query)
-
-        # Use default SQL from config
-        default_sql = CONFIG["pgvector"].get(
-            "default_sql",
-            """
-SELECT file_path, embedding <=> %(embedding)s::vector as distance
-FROM code_chunks
-ORDER BY embedding <=> %(embedding)s::vector
-LIMIT 10;
-            """,
-        )
+        try:
+            query_embedding = QUERY_EMBEDDINGS.get(query)
+            if query_embedding is None:
+                with METRICS.phase("encode"):
+                    query_embedding = get_embedding_model().encode(query)
+                QUERY_EMBEDDINGS.put(query, query_embedding)
 
-        # Execute search
-        pgvector_connector = PGVectorConnector()
-        sql_params = {"embedding": query_embedding}
-        column_names, records = pgvector_connector.execute_select(
-            default_sql, sql_params
-        )
+            # One row more than the page tells whether there is a next
+            # one; HNSW returns at most MAX_EF_SEARCH rows in all
+            limit = min(top_k + 1, MAX_EF_SEARCH - offset)
+            pgvector_connector = get_pgvector_connector()
+            if rerank is None:
+                rerank = rerank_enabled()
+            if rerank:
+                with METRICS.phase("sql"):
+                    _, candidates = search_top_k(
+                        pgvector_connector,
+                        query_embedding,
+                        CONFIG["rerank"]["candidates"],
+                        max_distance=max_distance,
+                    ) or (None, [])
+                with METRICS.phase("rerank"):
+                    records = rerank_records(
+                        pgvector_connector,
+                        get_reranker(),
+                        query,
+                        candidates,
+                        top_k=offset + limit,
+                    )[offset:]
+            elif (custom_sql := custom_default_sql()) is not None:
+                # A customized pgvector.default_sql (e.g. a file_path filter)
+                # is kept; pages are cut from its rows
+                with METRICS.phase("sql"):
+                    _, rows = pgvector_connector.execute_select(
+                        custom_sql, {"embedding": query_embedding}, prepare=True
+                    ) or (None, [])
+                records = [
+                    row
+                    for row in rows
+                    if max_distance is None or row[1] <= max_distance
+                ][offset : offset + limit]
+            else:
+                with METRICS.phase("sql"):
+                    _, records = search_top_k(
+                        pgvector_connector,
+                        query_embedding,
+                        limit,
+                        offset=offset,
+                        max_distance=max_distance,
+                    ) or (None, [])
+
+            # Format results
+            if not records:
+                request.empty = True
+                return "No results found"
+            next_cursor = None
+            if len(records) > top_k:
+                records = records[:top_k]
+                next_cursor = encode_cursor(
+                    query, offset + top_k, top_k, max_distance, rerank
+                )
 
-        # Format results
-        if not records:
-            return "No results found"
+            snippets = [None] * len(records)
+            if include_snippets:
+                with METRICS.phase("snippets"):
+                    snippets = fetch_bounded_snippets(
+                        pgvector_connector, [record[0] for record in records]
+                    )
 
-        result_text = "Semantic search results:\n\n"
-        for i, record in enumerate(records, 1):
-            result_text += f"{i}. {record[0]} (distance: {record[1]:.4f})\n"
+            duplicates = fetch_duplicates(pgvector_connector, records)
 
-        return result_text
+            with METRICS.phase("format"):
+                result_text = "Semantic search results:\n\n"
+                order = list(range(len(records)))
+                headers = {}
+                if group_by_directory:
+                    groups = directory_groups(records)
+                    order = [i for positions in groups.values() for i in positions]
+                    headers = {
+                        positions[0]: f"{directory or './'}\n"
+                        for directory, positions in groups.items()
+                    }
+                for position in order:
+                    record, snippet = records[position], snippets[position]
+                    i = offset + 1 + position
+                    result_text += headers.get(position, "")
+                    copies = duplicates.get(record[0], [])
+                    result_text += f"{i}. {record[0]} (distance: {record[1]:.4f}"
+                    if rerank and record[-1] is not None:
+                        result_text += f", score: {record[-1]:.4f}"
+                    if copies and collapse_duplicates:
+                        result_text += f", +{len(copies)} near-duplicates"
+                    result_text += ")\n"
+                    if not collapse_duplicates:
+                        result_text += "".join(
+                            f"   = {copy} (near-duplicate)\n" for copy in copies
+                        )
+                    if snippet is not None:
+                        result_text += format_snippet(record[0], *snippet)
+                if next_cursor is not None:
+                    result_text += f"\nnext_cursor: {next_cursor}\n"
 
+            return result_text
+
+        except Exception as e:
+            request.error = True
+            # Drop the cached connection, the next call reconnects
+            global _pgvector_connector
+            _pgvector_connector = None
+            return f"Error during semantic search: {str(e)}"
+
+
+def fetch_duplicates(pgvector_connector, records: list) -> dict[str, list[str]]:
+    """Near-duplicates linked to the result files, when dedup is enabled."""
+    if not dedup_enabled():
+        return {}
+    with METRICS.phase("duplicates"):
+        return pgvector_connector.fetch_duplicates([record[0] for record in records])
+
+
+@mcp.tool()
+async def batch_semantic_search(queries: list[str], top_k: int = 10) -> str:
+    """Run several semantic searches at once, cheaper than calling
+    semantic_search repeatedly.
+
+    Args:
+        queries: The search query texts
+        top_k: Number of results per query
+
+    Returns:
+        Search results for each query, in the order the queries were given
+    """
+    with METRICS.request("batch_semantic_search") as request:
+        await wait_until_ready()
+        if not queries or any(not query for query in queries):
+            request.error = True
+            return "Error: queries must be a non-empty list of non-empty strings"
+
+        try:
+            # One embedding batch and one SQL statement for all queries
+            with METRICS.phase("encode_batch"):
+                query_embeddings = get_embedding_model().encode_batch(queries)
+            with METRICS.phase("batch_sql"):
+                results = batch_search(
+                    get_pgvector_connector(), query_embeddings, top_k
+                )
+
+            request.empty = not any(results)
+            result_text = "Batch semantic search results:\n"
+            for query, hits in zip(queries, results):
+                result_text += f"\n## {query}\n"
+                if not hits:
+                    result_text += "No results found\n"
+                for i, (file_path, distance) in enumerate(hits, 1):
+                    result_text += f"{i}. {file_path} (distance: {distance:.4f})\n"
+
+            return result_text
+
+        except Exception as e:
+            request.error = True
+            global _pgvector_connector
+            _pgvector_connector = None
+            return f"Error during batch semantic search: {str(e)}"
+
+
+@mcp.tool()
+async def find_similar(
+    path: str, top_k: int = 10, include_snippets: bool = True
+) -> str:
+    """Find code similar to an indexed file, using its stored embedding.
+    No query text is embedded, so this is fast and works even when the
+    embedding server is unavailable.
+
+    Args:
+        path: An indexed file path, "path:line" for the chunk of the file
+            at that line, or a directory to search around the mean of its
+            files
+        top_k: Number of results, the source files themselves excluded
+        include_snippets: Attach a bounded code snippet to each result
+
+    Returns:
+        Formatted results with file paths and similarity distances
+    """
+    with METRICS.request("find_similar") as request:
+        await wait_until_ready()
+        if not path:
+            request.error = True
+            return "Error: path parameter is required"
+
+        try:
+            pgvector_connector = get_pgvector_connector()
+            with METRICS.phase("sql"):
+                sources, records = search_like(pgvector_connector, path, top_k)
+            if sources is None:
+                request.empty = True
+                return f"{path} is not indexed"
+            if not records:
+                request.empty = True
+                return "No results found"
+
+            snippets = [None] * len(records)
+            if include_snippets:
+                with METRICS.phase("snippets"):
+                    snippets = fetch_bounded_snippets(
+                        pgvector_connector, [record[0] for record in records]
+                    )
+
+            duplicates = fetch_duplicates(pgvector_connector, records)
+
+            with METRICS.phase("format"):
+                result_text = f"Code similar to {path}:\n\n"
+                for i, (record, snippet) in enumerate(zip(records, snippets), 1):
+                    result_text += f"{i}. {record[0]} (distance: {record[1]:.4f}"
+                    if duplicates.get(record[0]):
+                        result_text += f", +{len(duplicates[record[0]])} near-duplicates"
+                    result_text += ")\n"
+                    if snippet is not None:
+                        result_text += format_snippet(record[0], *snippet)
+
+            return result_text
+
+        except Exception as e:
+            request.error = True
+            global _pgvector_connector
+            _pgvector_connector = None
+            return f"Error during find similar: {str(e)}"
+
+
+def cache_counts() -> dict[str, tuple[int, int]]:
+    """(hits, misses) of the caches on the query path that are in use."""
+    caches = {
+        "query_embedding": (QUERY_EMBEDDINGS.hits, QUERY_EMBEDDINGS.misses)
+    }
+    reranker = loaded_reranker()
+    if reranker is not None:
+        caches["rerank"] = (reranker.cache_hits, reranker.cache_misses)
+    return caches
+
+
+def stats_dict() -> dict:
+    return {**METRICS.to_dict(cache_counts()), "warmup": WARMUP.to_dict()}
+
+
+@mcp.tool()
+async def server_stats() -> str:
+    """Latency percentiles of each search phase (encode, sql, rerank,
+    snippets, format), request, error and empty result counts and cache hit
+    ratios since the server started, and the state of the start-up warm-up.
+
+    Returns:
+        The statistics as JSON
+    """
+    return json.dumps(stats_dict(), indent=2)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics: Prometheus text; GET /stats: the server_stats JSON;
+    GET /ready: the warm-up state, 503 until it is done."""
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            content = METRICS.to_prometheus(caches=cache_counts())
+            content_type = "text/plain; version=0.0.4"
+        elif self.path == "/stats":
+            content = json.dumps(stats_dict())
+            content_type = "application/json"
+        elif self.path == "/ready":
+            # 200 once the warm-up is done, for health checks
+            ready = WARMUP.state in ("disabled", "ready")
+            body = json.dumps(WARMUP.to_dict()).encode("utf8")
+            self.send_response(200 if ready else 503)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        else:
+            self.send_error(404)
+            return
+        body = content.encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # stdout is the MCP stdio transport
+        pass
+
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    """Serve the metrics on 127.0.0.1:port in a daemon thread."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def warm_up(warmup: Warmup, queries: int = 3, prewarm: bool = True):
+    """
+    Load and exercise the embedding model (and the reranker when enabled),
+    connect to the database and run the probe queries so that the search
+    statements are prepared. Tool calls may proceed after that; pg_prewarm
+    then reads the index and table pages into shared buffers on a second
+    connection.
+    """
+    import sys
+
+    try:
+        with warmup.profiler.stage("model") as stats:
+            model = get_embedding_model()
+            embeddings = [model.encode(text) for text in WARMUP_QUERIES[:queries]]
+            stats.count(len(embeddings))
+            if rerank_enabled():
+                get_reranker()
+        with warmup.profiler.stage("connect"):
+            connector = get_pgvector_connector()
+        with warmup.profiler.stage("queries") as stats:
+            for embedding in embeddings:
+                # Same statements as semantic_search
+                _, records = search_top_k(connector, embedding, 11)
+                fetch_bounded_snippets(connector, [record[0] for record in records])
+                stats.count()
     except Exception as e:
-        return f"Error during semantic search: {str(e)}"
+        warmup.state = "failed"
+        warmup.error = f"{type(e).__name__}: {e}"
+        global _pgvector_connector
+        _pgvector_connector = None
+        print(f"codebase-mcp warm-up failed: {warmup.error}", file=sys.stderr)
+        return
+    finally:
+        warmup.ready.set()
+
+    if prewarm:
+        warmup.state = "prewarming"
+        try:
+            with warmup.profiler.stage("prewarm") as stats:
+                warmup.prewarmed = PGVectorConnector().prewarm()
+                stats.count(sum((warmup.prewarmed or {}).values()))
+        except Exception as e:
+            warmup.error = f"prewarm: {type(e).__name__}: {e}"
+    warmup.state = "ready"
+    seconds = ", ".join(
+        f"{name} {stats.wall:.2f} s" for name, stats in warmup.profiler.stages.items()
+    )
+    print(f"codebase-mcp ready ({seconds})", file=sys.stderr)
+
+
+def start_warmup(warmup_config: dict) -> threading.Thread:
+    """Warm up in a daemon thread, the MCP handshake is not held up."""
+    WARMUP.state = "running"
+    WARMUP.ready.clear()
+    thread = threading.Thread(
+        target=warm_up,
+        args=(WARMUP, warmup_config["queries"], warmup_config["prewarm"]),
+        daemon=True,
+    )
+    thread.start()
+    return thread
 
 
 def main():
+    metrics_port = CONFIG["mcp"]["metrics_port"]
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    if CONFIG["mcp"]["warmup"]["enabled"]:
+        start_warmup(CONFIG["mcp"]["warmup"])
     # Run the FastMCP server
     mcp.run()
 
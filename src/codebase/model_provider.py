@@ -1,43 +1,481 @@
 import abc
+import base64
+import binascii
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
 from typing import override
-import requests
+import numpy as np
 from codebase.config import CONFIG
 
 
 class ModelProvider(abc.ABC):
+    """
+    Embeddings are returned as C-contiguous float32 numpy arrays: ``encode``
+    gives a 1-D vector and ``encode_batch`` a 2-D ``(len(texts), dim)`` matrix,
+    so they can be handed to the pgvector binary adapter without any copy.
+    """
 
     @abc.abstractmethod
-    def encode(self, text: str) -> list[float]:
+    def encode(self, text: str) -> np.ndarray:
         pass
 
     @abc.abstractmethod
-    def encode_batch(self, texts: list[str]) -> list[list[float]]:
+    def encode_batch(self, texts: list[str]) -> np.ndarray:
         pass
 
+    def close(self):
+        """Release resources held by the provider, such as worker processes."""
+
+
+class EmbeddingError(Exception):
+    """
+    Some texts could not be embedded, even after retries.
+
+    ``errors`` maps the index of every failed text to its last error. When at
+    least one text succeeded ``embeddings`` holds the full matrix with NaN rows
+    for the failed texts, otherwise it is None.
+    """
+
+    def __init__(
+        self, message: str, errors: dict[int, str], embeddings: np.ndarray | None = None
+    ):
+        super().__init__(message)
+        self.errors: dict[int, str] = errors
+        self.embeddings: np.ndarray | None = embeddings
+
+
+def l2_normalize(embedding: np.ndarray) -> np.ndarray:
+    """L2-normalize a vector, or each row of a matrix."""
+    norm = np.linalg.norm(embedding, axis=-1, keepdims=True)
+    return np.ascontiguousarray(embedding / np.maximum(norm, 1e-12), dtype=np.float32)
+
+
+def truncate_embedding(embedding: np.ndarray, dim: int) -> np.ndarray:
+    """
+    Matryoshka (MRL) truncation: keep the first ``dim`` components of a vector
+    (or of each row of a matrix) and L2-normalize them again.
+    """
+    return l2_normalize(embedding[..., :dim])
+
+
+class MatryoshkaProvider(ModelProvider):
+    """Wraps another provider and truncates its embeddings to ``dim``."""
+
+    def __init__(self, provider: ModelProvider, dim: int):
+        self.provider: ModelProvider = provider
+        self.dim: int = dim
+
+    @override
+    def encode(self, text: str) -> np.ndarray:
+        return truncate_embedding(self.provider.encode(text), self.dim)
+
+    @override
+    def encode_batch(self, texts: list[str]) -> np.ndarray:
+        return truncate_embedding(self.provider.encode_batch(texts), self.dim)
+
+    @override
+    def close(self):
+        self.provider.close()
+
+
+def token_budget_batches(
+    lengths: list[int], max_batch_tokens: int, max_batch_size: int
+) -> list[list[int]]:
+    """
+    Group input indices into batches of similar token length.
+
+    Inputs are sorted by length, so a batch only pads to inputs about as long
+    as its own, and a batch is closed once its padded size (``batch size x
+    longest input``) would exceed max_batch_tokens or it holds max_batch_size
+    inputs. An input longer than the budget gets a batch of its own.
+    """
+    batches: list[list[int]] = []
+    batch: list[int] = []
+    for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        # Sorted ascending: the new input is the longest of the batch
+        if batch and (
+            len(batch) == max_batch_size
+            or (len(batch) + 1) * lengths[i] > max_batch_tokens
+        ):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
 
 class SentenceTransformerProvider(ModelProvider):
 
-    def __init__(self, model_name_or_path: str):
+    def __init__(
+        self,
+        model_name_or_path: str,
+        batch_size: int = 32,
+        max_batch_tokens: int = 16384,
+    ):
         from sentence_transformers import SentenceTransformer
 
         self.model: SentenceTransformer = SentenceTransformer(model_name_or_path)
+        self.batch_size: int = batch_size
+        self.max_batch_tokens: int = max_batch_tokens
 
     @override
-    def encode(self, text: str) -> list[float]:
+    def encode(self, text: str) -> np.ndarray:
         result = self.model.encode(text, convert_to_numpy=True, convert_to_tensor=False)
-        return result.tolist()
+        return np.ascontiguousarray(result, dtype=np.float32)
+
+    @override
+    def encode_batch(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        lengths = [
+            len(ids)
+            for ids in self.model.tokenizer(
+                texts, truncation=True, max_length=self.model.max_seq_length
+            )["input_ids"]
+        ]
+        results: np.ndarray | None = None
+        for batch in token_budget_batches(
+            lengths, self.max_batch_tokens, self.batch_size
+        ):
+            embeddings = self.model.encode(
+                [texts[i] for i in batch],
+                batch_size=len(batch),
+                convert_to_numpy=True,
+                convert_to_tensor=False,
+            )
+            if results is None:
+                results = np.empty((len(texts), embeddings.shape[1]), np.float32)
+            # Back to the input order
+            results[batch] = embeddings
+        return np.ascontiguousarray(results, dtype=np.float32)
+
+
+def pool_hidden_states(
+    hidden_states: np.ndarray, attention_mask: np.ndarray, pooling: str
+) -> np.ndarray:
+    """
+    Pool token states ``(batch, seq, dim)`` into L2-normalized sentence
+    embeddings ``(batch, dim)``.
+
+    pooling: "last_token" (Qwen3-Embedding and other decoder models),
+    "mean" or "cls".
+    """
+    if pooling == "cls":
+        pooled = hidden_states[:, 0]
+    elif pooling == "mean":
+        mask = attention_mask[..., None].astype(hidden_states.dtype)
+        pooled = (hidden_states * mask).sum(axis=1) / np.maximum(
+            mask.sum(axis=1), 1e-9
+        )
+    elif pooling == "last_token":
+        # Works for both left and right padding
+        last = attention_mask.shape[1] - 1 - np.argmax(attention_mask[:, ::-1], axis=1)
+        pooled = hidden_states[np.arange(hidden_states.shape[0]), last]
+    else:
+        raise ValueError(f"Unsupported pooling: {pooling}")
+    return l2_normalize(pooled)
+
+
+class OnnxProvider(ModelProvider):
+    """
+    Runs the embedding model with ONNX Runtime on CPU. The model is exported
+    to ONNX on first use (needs ``optimum``) and optionally quantized to int8
+    with dynamic quantization.
+    """
+
+    def __init__(
+        self,
+        model_name_or_path: str,
+        onnx_dir: str | None = None,
+        quantize: bool = False,
+        threads: int = 0,
+        pooling: str = "last_token",
+        max_length: int = 8192,
+        batch_size: int = 16,
+        max_batch_tokens: int = 16384,
+    ):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name_or_path)
+        self.pooling: str = pooling
+        self.max_length: int = max_length
+        self.batch_size: int = batch_size
+        self.max_batch_tokens: int = max_batch_tokens
+
+        model_file = self.prepare_model(model_name_or_path, onnx_dir, quantize)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            str(model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names: list[str] = [i.name for i in self.session.get_inputs()]
+
+    @staticmethod
+    def prepare_model(
+        model_name_or_path: str, onnx_dir: str | None, quantize: bool
+    ) -> Path:
+        """Return the ONNX file to load, exporting/quantizing it if missing."""
+        onnx_path = Path(onnx_dir) if onnx_dir else Path(model_name_or_path) / "onnx"
+        fp32_file = onnx_path / "model.onnx"
+        if not fp32_file.exists():
+            from optimum.onnxruntime import ORTModelForFeatureExtraction
+
+            ORTModelForFeatureExtraction.from_pretrained(
+                model_name_or_path, export=True
+            ).save_pretrained(onnx_path)
+        if not quantize:
+            return fp32_file
+
+        int8_file = onnx_path / "model_quantized.onnx"
+        if not int8_file.exists():
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            quantize_dynamic(fp32_file, int8_file, weight_type=QuantType.QInt8)
+        return int8_file
+
+    @override
+    def encode(self, text: str) -> np.ndarray:
+        return self.encode_batch([text])[0]
 
     @override
-    def encode_batch(self, texts: list[str]) -> list[list[float]]:
-        results = self.model.encode(
-            texts, convert_to_numpy=True, convert_to_tensor=False
+    def encode_batch(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        # Tokenize once without padding, then pad each length bucket only to
+        # its own longest input
+        encodings = self.tokenizer(
+            texts, truncation=True, max_length=self.max_length
         )
-        return [result.tolist() for result in results]
+        lengths = [len(ids) for ids in encodings["input_ids"]]
+        results: np.ndarray | None = None
+        for batch in token_budget_batches(
+            lengths, self.max_batch_tokens, self.batch_size
+        ):
+            inputs = self.tokenizer.pad(
+                {name: [encodings[name][i] for i in batch] for name in encodings},
+                return_tensors="np",
+            )
+            feed = {
+                name: inputs[name].astype(np.int64)
+                for name in self.input_names
+                if name in inputs
+            }
+            if "position_ids" in self.input_names:
+                positions = np.cumsum(inputs["attention_mask"], axis=1) - 1
+                feed["position_ids"] = np.maximum(positions, 0).astype(np.int64)
+            hidden_states = self.session.run(None, feed)[0]
+            embeddings = pool_hidden_states(
+                hidden_states, inputs["attention_mask"], self.pooling
+            )
+            if results is None:
+                results = np.empty((len(texts), embeddings.shape[1]), np.float32)
+            # Back to the input order
+            results[batch] = embeddings
+        return np.ascontiguousarray(results, dtype=np.float32)
+
+
+_WORKER_MODEL: ModelProvider | None = None
+_WORKER_ERROR: Exception | None = None
+
+
+def _init_encode_worker(factory, threads: int, worker_counter):
+    global _WORKER_ERROR
+    try:
+        _load_worker_model(factory, threads, worker_counter)
+    except Exception as e:
+        # A failing initializer makes Pool restart the worker forever; report
+        # the error through the first task instead
+        _WORKER_ERROR = e
+
+
+def _load_worker_model(factory, threads: int, worker_counter):
+    global _WORKER_MODEL
+    if threads > 0:
+        # Before the model library creates its thread pools
+        for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ[variable] = str(threads)
+        if hasattr(os, "sched_setaffinity"):
+            with worker_counter.get_lock():
+                worker = worker_counter.value
+                worker_counter.value += 1
+            # Pin every worker to its own cores when there are enough of them
+            cpus = sorted(os.sched_getaffinity(0))
+            own_cpus = cpus[worker * threads : (worker + 1) * threads]
+            if len(own_cpus) == threads:
+                os.sched_setaffinity(0, own_cpus)
+    _WORKER_MODEL = factory(threads)
+
+
+def _encode_in_worker(texts: list[str]) -> np.ndarray:
+    if _WORKER_ERROR is not None:
+        raise _WORKER_ERROR
+    return _WORKER_MODEL.encode_batch(texts)
+
+
+class EncodePoolProvider(ModelProvider):
+    """
+    Encodes with ``processes`` worker processes, each holding its own model
+    built by ``factory(threads)`` and limited to ``threads`` threads. Small
+    models stop scaling with intra-op threads long before a many-core CPU is
+    busy; separate processes keep every core working.
+
+    Workers start in __init__ and stop in close().
+    """
+
+    def __init__(
+        self, factory, processes: int, threads: int = 0, chunk_size: int = 16
+    ):
+        import multiprocessing
+
+        if threads <= 0:
+            threads = max(1, (os.cpu_count() or 1) // processes)
+        self.processes: int = processes
+        self.chunk_size: int = chunk_size
+        # spawn: forking after PyTorch/OpenMP initialized is unsafe
+        context = multiprocessing.get_context("spawn")
+        self.pool = context.Pool(
+            processes,
+            initializer=_init_encode_worker,
+            initargs=(factory, threads, context.Value("i", 0)),
+        )
+
+    @override
+    def encode(self, text: str) -> np.ndarray:
+        return self.encode_batch([text])[0]
+
+    @override
+    def encode_batch(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        # Enough chunks to keep all workers busy, longest first so that the
+        # slow chunks don't end up last. Workers bucket their chunk by tokens.
+        chunk_size = min(self.chunk_size, -(-len(texts) // self.processes))
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        chunks = [
+            order[start : start + chunk_size]
+            for start in range(0, len(order), chunk_size)
+        ]
+        results: np.ndarray | None = None
+        for chunk, embeddings in zip(
+            chunks,
+            self.pool.imap(_encode_in_worker, [[texts[i] for i in c] for c in chunks]),
+        ):
+            if results is None:
+                results = np.empty((len(texts), embeddings.shape[1]), np.float32)
+            results[chunk] = embeddings
+        return results
+
+    @override
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for rate limiting, about 4 characters per token."""
+    return len(text) // 4 + 1
+
+
+class RateLimiter:
+    """
+    Client-side limits shared by all threads using a provider: at most
+    ``max_concurrency`` requests in flight and a token bucket refilled at
+    ``tokens_per_minute`` (0 disables it).
+    """
+
+    def __init__(self, max_concurrency: int = 4, tokens_per_minute: int = 0):
+        self.semaphore = threading.BoundedSemaphore(max(1, max_concurrency))
+        self.tokens_per_minute: int = tokens_per_minute
+        self.available: float = float(tokens_per_minute)
+        self.updated: float = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire_tokens(self, tokens: int):
+        if self.tokens_per_minute <= 0:
+            return
+        # A request larger than the whole bucket waits for a full bucket
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.available = min(
+                    self.tokens_per_minute,
+                    self.available
+                    + (now - self.updated) * self.tokens_per_minute / 60.0,
+                )
+                self.updated = now
+                if self.available >= tokens:
+                    self.available -= tokens
+                    return
+                wait = (tokens - self.available) * 60.0 / self.tokens_per_minute
+            time.sleep(wait)
+
+    @contextmanager
+    def request(self, tokens: int):
+        self.acquire_tokens(tokens)
+        with self.semaphore:
+            yield
+
+
+def decode_embeddings(embeddings: list) -> np.ndarray:
+    """
+    Decode the "embedding" fields of an OpenAI-style response into a float32
+    matrix. base64 strings (little-endian float32) are joined and viewed as
+    one buffer without creating a Python float per component; lists of floats
+    from servers that ignore encoding_format are accepted too.
+    """
+    if embeddings and all(isinstance(e, str) for e in embeddings):
+        buffer = bytearray(b"".join(base64.b64decode(e) for e in embeddings))
+        matrix = np.frombuffer(buffer, dtype="<f4").reshape(len(embeddings), -1)
+        return np.ascontiguousarray(matrix, dtype=np.float32)
+    return np.array(
+        [
+            np.frombuffer(base64.b64decode(e), dtype="<f4") if isinstance(e, str) else e
+            for e in embeddings
+        ],
+        dtype=np.float32,
+        order="C",
+    )
+
+
+class _BatchTooLarge(Exception):
+    """413 or a read timeout: retry the batch in smaller pieces."""
+
+
+class _RequestFailed(Exception):
+    def __init__(self, message: str, splittable: bool):
+        super().__init__(message)
+        # A 400 or 422 may be caused by one bad text in the batch. Other client
+        # errors (401, 403, 404, ...) fail every text the same way.
+        self.splittable: bool = splittable
 
 
 class OpenAICompatibleProvider(ModelProvider):
+    """
+    Client of an OpenAI compatible ``/v1/embeddings`` server.
 
-    __HEADERS = {"Content-Type": "application/json"}
+    Transient failures (connection errors, 429, 5xx) are retried with jittered
+    exponential backoff. The batch size adapts to the server: it is halved on
+    413 and read timeouts and grows back by one after each successful request.
+    Texts that still fail are reported through EmbeddingError, never as empty
+    vectors.
+
+    Embeddings are requested base64-encoded by default, which is smaller on
+    the wire and much cheaper to decode than JSON floats. A server that
+    rejects encoding_format=base64 is switched to floats. gzip only pays off
+    on slow links: float32 data barely compresses.
+    """
 
     def __init__(
         self,
@@ -46,6 +484,15 @@ class OpenAICompatibleProvider(ModelProvider):
         endpoint: str = "/v1/embeddings",
         http_proxy: str | None = None,
         https_proxy: str | None = None,
+        timeout: float = 30.0,
+        max_retries: int = 5,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        batch_size: int = 32,
+        max_concurrency: int = 4,
+        tokens_per_minute: int = 0,
+        encoding_format: str = "base64",
+        gzip: bool = False,
     ):
         self.model_name: str = model_name
         self.url: str = url
@@ -54,59 +501,287 @@ class OpenAICompatibleProvider(ModelProvider):
             "http": http_proxy,
             "https": https_proxy,
         }
+        self.timeout: float = timeout
+        self.max_retries: int = max_retries
+        self.backoff_base: float = backoff_base
+        self.backoff_max: float = backoff_max
+        self.max_batch_size: int = max(1, batch_size)
+        self.batch_size: int = self.max_batch_size
+        self.rate_limiter = RateLimiter(max_concurrency, tokens_per_minute)
+        # "base64" or "float"
+        self.encoding_format: str = encoding_format
+        # Floats are tried once after a 400/422, not on every split of the batch
+        self.float_fallback_tried: bool = False
+        self.headers: dict[str, str] = {
+            "Content-Type": "application/json",
+            "Accept-Encoding": "gzip" if gzip else "identity",
+        }
 
     @override
-    def encode(self, text: str) -> list[float]:
-        payload = {
-            "input": text,
-            "model": self.model_name,
-            "encoding_format": "float",
-        }
+    def encode(self, text: str) -> np.ndarray:
+        return self.encode_batch([text])[0]
+
+    @override
+    def encode_batch(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        results: list[np.ndarray | None] = [None] * len(texts)
+        errors: dict[int, str] = {}
+        start = 0
+        while start < len(texts):
+            # batch_size may shrink while the batch is being sent
+            end = min(start + self.batch_size, len(texts))
+            self._encode_indices(texts, list(range(start, end)), results, errors)
+            start = end
+
+        if not errors:
+            return np.ascontiguousarray(np.stack(results), dtype=np.float32)
+
+        embeddings = None
+        done = [r for r in results if r is not None]
+        if done:
+            nan_row = np.full(len(done[0]), np.nan, dtype=np.float32)
+            embeddings = np.stack([nan_row if r is None else r for r in results])
+        first = min(errors)
+        raise EmbeddingError(
+            f"{len(errors)} of {len(texts)} texts failed to embed: {errors[first]}",
+            errors,
+            embeddings,
+        )
+
+    def _encode_indices(
+        self,
+        texts: list[str],
+        indices: list[int],
+        results: list[np.ndarray | None],
+        errors: dict[int, str],
+    ):
         try:
-            # Send the POST request
-            # Use the 'json' parameter for the payload, which automatically
-            # serializes the dict to JSON and sets the Content-Type header.
-            response = requests.post(
-                self.url + self.endpoint,
-                headers=self.__HEADERS,
-                json=payload,
-                timeout=10,
-                proxies=self.proxies,
-            )
+            embeddings = self._post([texts[i] for i in indices])
+        except _BatchTooLarge as e:
+            if len(indices) == 1:
+                errors[indices[0]] = str(e)
+                return
+            self.batch_size = max(1, min(self.batch_size, len(indices)) // 2)
+            print(f"Embedding request too large ({e}), batch size -> {self.batch_size}")
+            middle = len(indices) // 2
+            self._encode_indices(texts, indices[:middle], results, errors)
+            self._encode_indices(texts, indices[middle:], results, errors)
+            return
+        except _RequestFailed as e:
+            if e.splittable and len(indices) > 1:
+                # Isolate the texts the server rejects
+                middle = len(indices) // 2
+                self._encode_indices(texts, indices[:middle], results, errors)
+                self._encode_indices(texts, indices[middle:], results, errors)
+            else:
+                for i in indices:
+                    errors[i] = str(e)
+            return
 
-            # Check for HTTP errors (e.g., 404, 500)
-            response.raise_for_status()
+        for i, embedding in zip(indices, embeddings):
+            results[i] = embedding
+        self.batch_size = min(self.max_batch_size, self.batch_size + 1)
 
-            # print("Request was successful!")
-            # print(f"Status Code: {response.status_code}")
+    def _backoff(self, attempt: int, retry_after: float | None) -> float:
+        # "Full jitter": spread the retries of concurrent clients
+        delay = random.uniform(
+            0, min(self.backoff_max, self.backoff_base * 2**attempt)
+        )
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    def _post(self, texts: list[str]) -> np.ndarray:
+        # requests is only needed once the first embedding is requested
+        import requests
 
-            # The response is typically in JSON format
-            response_data = response.json()
-            # print("Response Body:")
-            # print(json.dumps(response_data, indent=2))
-            return response_data["data"][0]["embedding"]
+        payload = {
+            "input": texts,
+            "model": self.model_name,
+            "encoding_format": self.encoding_format,
+        }
+        tokens = sum(estimate_tokens(text) for text in texts)
+        error = ""
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                with self.rate_limiter.request(tokens):
+                    # Use the 'json' parameter for the payload, which automatically
+                    # serializes the dict to JSON and sets the Content-Type header.
+                    response = requests.post(
+                        self.url + self.endpoint,
+                        headers=self.headers,
+                        json=payload,
+                        timeout=self.timeout,
+                        proxies=self.proxies,
+                    )
+                status = response.status_code
+                if status == 413:
+                    raise _BatchTooLarge("413 Payload Too Large")
+                if status == 429 or status >= 500:
+                    error = f"HTTP {status}"
+                    try:
+                        retry_after = float(response.headers.get("Retry-After"))
+                    except (TypeError, ValueError):
+                        pass
+                else:
+                    # Other HTTP errors (e.g., 400, 404) are not retried
+                    response.raise_for_status()
+                    # Items may come back out of order, "index" is authoritative.
+                    data = sorted(
+                        response.json()["data"], key=lambda item: item["index"]
+                    )
+                    if len(data) != len(texts):
+                        raise ValueError(
+                            f"expected {len(texts)} embeddings, got {len(data)}"
+                        )
+                    return decode_embeddings([item["embedding"] for item in data])
+            except requests.exceptions.ReadTimeout as e:
+                if len(texts) > 1:
+                    raise _BatchTooLarge(f"timeout: {e}")
+                error = f"timeout: {e}"
+            except requests.exceptions.HTTPError as e:
+                if (
+                    payload["encoding_format"] == "base64"
+                    and status in (400, 422)
+                    and not self.float_fallback_tried
+                ):
+                    return self._post_float_fallback(texts, e)
+                raise _RequestFailed(str(e), splittable=status in (400, 422))
+            except (
+                requests.exceptions.RequestException,
+                ValueError,
+                KeyError,
+                binascii.Error,
+            ) as e:
+                error = f"{type(e).__name__}: {e}"
 
-        except requests.exceptions.RequestException as e:
-            print(f"An error occurred: {e}")
+            if attempt < self.max_retries:
+                time.sleep(self._backoff(attempt, retry_after))
 
-        return []
+        raise _RequestFailed(
+            f"{error} (after {self.max_retries + 1} attempts)", splittable=False
+        )
 
-    @override
-    def encode_batch(self, texts: list[str]) -> list[list[float]]:
-        return []
+    def _post_float_fallback(self, texts: list[str], error: Exception) -> np.ndarray:
+        """
+        Retry a request rejected with encoding_format=base64 as floats, once
+        per provider. Only when that succeeds was base64 the problem; keep
+        floats from then on.
+        """
+        self.float_fallback_tried = True
+        self.encoding_format = "float"
+        try:
+            embeddings = self._post(texts)
+        except _RequestFailed:
+            # The texts were rejected, not the encoding
+            self.encoding_format = "base64"
+            raise _RequestFailed(str(error), splittable=True)
+        except BaseException:
+            # A timeout or interrupt does not show that floats work
+            self.encoding_format = "base64"
+            raise
+        print("Embedding server does not accept encoding_format=base64, using float")
+        return embeddings
 
 
-def __create_embedding_model():
+def __create_base_embedding_model():
     if CONFIG["model_provider"] == "openai":
+        openai_config = CONFIG["openai"]
         return OpenAICompatibleProvider(
-            CONFIG["model"], CONFIG["openai"]["url"]
+            CONFIG["model"],
+            openai_config["url"],
+            timeout=openai_config["timeout"],
+            max_retries=openai_config["max_retries"],
+            backoff_base=openai_config["backoff_base"],
+            backoff_max=openai_config["backoff_max"],
+            batch_size=openai_config["batch_size"],
+            max_concurrency=openai_config["max_concurrency"],
+            tokens_per_minute=openai_config["tokens_per_minute"],
+            encoding_format=openai_config["encoding_format"],
+            gzip=openai_config["gzip"],
         )
     elif CONFIG["model_provider"] == "sentence_transformer":
-        return SentenceTransformerProvider(CONFIG["model"])
+        st_config = CONFIG["sentence_transformer"]
+        return SentenceTransformerProvider(
+            CONFIG["model"],
+            batch_size=st_config["batch_size"],
+            max_batch_tokens=st_config["max_batch_tokens"],
+        )
+    elif CONFIG["model_provider"] == "onnx":
+        onnx_config = CONFIG["onnx"]
+        return OnnxProvider(
+            CONFIG["model"],
+            onnx_dir=onnx_config["path"],
+            quantize=onnx_config["quantize"],
+            threads=onnx_config["threads"],
+            pooling=onnx_config["pooling"],
+            max_length=onnx_config["max_length"],
+            batch_size=onnx_config["batch_size"],
+            max_batch_tokens=onnx_config["max_batch_tokens"],
+        )
     raise ValueError(f"Unsupported model provider: {CONFIG['model_provider']}")
 
 
-EMBEDDING_MODEL = __create_embedding_model()
+def __apply_matryoshka(model: ModelProvider) -> ModelProvider:
+    full_dim = CONFIG["matryoshka"]["full_dim"]
+    if full_dim is not None:
+        model = MatryoshkaProvider(model, full_dim)
+    return model
+
+
+def __create_embedding_model():
+    return __apply_matryoshka(__create_base_embedding_model())
+
+
+def create_pool_worker_model(threads: int) -> ModelProvider:
+    """Build the configured local model inside an encode pool worker."""
+    if CONFIG["model_provider"] == "onnx":
+        CONFIG["onnx"]["threads"] = threads
+    model = __create_base_embedding_model()
+    if isinstance(model, SentenceTransformerProvider):
+        import torch
+
+        torch.set_num_threads(threads)
+    return model
+
+
+def create_indexing_model() -> ModelProvider:
+    """
+    The model for one `codebase index` run: an EncodePoolProvider when
+    encode_pool.processes > 1 and the model runs locally, otherwise the
+    shared embedding model. Call close() when the run is done.
+    """
+    pool_config = CONFIG["encode_pool"]
+    if pool_config["processes"] <= 1 or CONFIG["model_provider"] == "openai":
+        return get_embedding_model()
+    return __apply_matryoshka(
+        EncodePoolProvider(
+            create_pool_worker_model,
+            pool_config["processes"],
+            pool_config["threads"],
+            pool_config["chunk_size"],
+        )
+    )
+
+
+_EMBEDDING_MODEL: ModelProvider | None = None
+
+
+def get_embedding_model() -> ModelProvider:
+    """Build the configured embedding model on first use."""
+    global _EMBEDDING_MODEL
+    if _EMBEDDING_MODEL is None:
+        _EMBEDDING_MODEL = __create_embedding_model()
+    return _EMBEDDING_MODEL
+
+
+def __getattr__(name: str):
+    # EMBEDDING_MODEL used to be built at import time, keep it importable
+    if name == "EMBEDDING_MODEL":
+        return get_embedding_model()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == "__main__":
     openai_provider = OpenAICompatibleProvider(
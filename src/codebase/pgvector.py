@@ -1,5 +1,11 @@
+import numpy as np
 import psycopg
+from pgvector.psycopg import register_vector
 from codebase.config import CONFIG
+from codebase.profiling import Profiler
+
+# CONFIG["pgvector"] 中不属于连接参数的键
+NON_CONNECTION_KEYS = {"default_sql"}
 
 
 class PGVectorConnector:
@@ -7,14 +13,33 @@ class PGVectorConnector:
     def __init__(
         self,
         db_params: dict[str, str] = CONFIG["pgvector"],
+        profiler: Profiler | None = None,
     ):
-        del db_params["default_sql"]
-        self.db_params: dict[str, str] = db_params
+        # 不能修改传入的字典，否则 CONFIG 在第二次创建连接时会缺少 default_sql
+        self.db_params: dict[str, str] = {
+            k: v for k, v in db_params.items() if k not in NON_CONNECTION_KEYS
+        }
         self.chunks: list[tuple] = []
         self.files_to_remove: list[str] = []
+        # 开启近重复检测时的近重复文件 (file_path, code_text, start_line, simhash, duplicate_of)，不写入向量
+        self.duplicates: list[tuple[str, str, int, int, str]] = []
+        # 开启近重复检测时为 True：写入文件的指纹，删除代表文件前把它的行交给一个近重复文件
+        self.dedup: bool = False
+        # 开启目录级索引时为 True：写入时按新旧向量之差更新所在目录的向量和
+        self.directory_index: bool = False
+        # 生成 embedding 失败的文件 (file_path, error)，写入 failed_files 表
+        self.failed_files: list[tuple[str, str]] = []
+        # 已完成的工作队列任务 id，与索引结果在同一事务中删除
+        self.done_jobs: list[int] = []
+        # 认领任务时使用的 worker 标识，只删除仍由自己持有租约的任务
+        self.worker_id: str | None = None
+        # 不为 None 时记录写入数据库的耗时、行数和缓冲区峰值
+        self.profiler: Profiler | None = profiler
 
         try:
             self.conn = psycopg.connect(**self.db_params)
+            # 注册 pgvector 适配器: numpy 数组以二进制格式传输, 不再经过文本序列化
+            register_vector(self.conn)
             self.cur = self.conn.cursor()
         except psycopg.Error as e:
             print(f"数据库连接失败: {e}")
@@ -26,64 +51,610 @@ class PGVectorConnector:
         if hasattr(self, "conn") and self.conn:
             self.conn.close()
 
-    def append_file_chunk(self, file_path: str, code_text: str, embedding: list):
-        self.chunks.append((file_path, code_text, embedding))
+    def append_file_chunk(
+        self,
+        file_path: str,
+        code_text: str,
+        embedding: np.ndarray,
+        start_line: int = 1,
+        embedding_coarse: np.ndarray | None = None,
+        simhash: int | None = None,
+    ):
+        chunk = (
+            file_path,
+            code_text,
+            np.ascontiguousarray(embedding, dtype=np.float32),
+            start_line,
+        )
+        if embedding_coarse is not None:
+            chunk += (np.ascontiguousarray(embedding_coarse, dtype=np.float32),)
+        if self.dedup:
+            chunk += (simhash,)
+        self.chunks.append(chunk)
+
+    def append_duplicate(
+        self,
+        file_path: str,
+        code_text: str,
+        start_line: int,
+        simhash: int,
+        duplicate_of: str,
+    ):
+        """写入近重复文件：没有 embedding，搜索时由代表文件 duplicate_of 代替"""
+        self.duplicates.append((file_path, code_text, start_line, simhash, duplicate_of))
 
     def append_files_to_remove(self, file_path: str):
         self.files_to_remove.append(file_path)
 
+    def append_failed_file(self, file_path: str, error: str):
+        self.failed_files.append((file_path, error))
+
+    def append_done_job(self, job_id: int):
+        self.done_jobs.append(job_id)
+
     def flush(self):
-        if len(self.chunks) == 0 and len(self.files_to_remove) == 0:
+        if self.profiler is None:
+            return self._flush()
+        self.profiler.observe_depth("pending_rows", len(self.chunks))
+        with self.profiler.stage("db_write") as stage:
+            stage.count(
+                len(self.chunks) + len(self.duplicates) + len(self.files_to_remove)
+            )
+            self._flush()
+
+    def _flush(self):
+        if (
+            not self.chunks
+            and not self.duplicates
+            and not self.files_to_remove
+            and not self.done_jobs
+        ):
+            if self.failed_files:
+                self._flush_failed_files([])
+                return
             print("没有数据需要插入。")
             # Commit any pending transaction to avoid leaving it in inconsistent state
             self.conn.commit()
             return
         try:
+            changed_paths = (
+                [chunk[0] for chunk in self.chunks]
+                + [duplicate[0] for duplicate in self.duplicates]
+                + self.files_to_remove
+            )
+            if self.directory_index:
+                # 写入前各目录中这些文件的向量，写入后减去它们、加上新的向量
+                self._lock_files(changed_paths)
+                before = self._directory_sums(changed_paths)
+
             delete_query = """
                 DELETE FROM code_chunks
                 WHERE file_path = ANY(%s);
             """
             if self.files_to_remove:
+                if self.dedup:
+                    changed_paths += self._promote_duplicates()
                 self.cur.execute(delete_query, (self.files_to_remove,))
 
-            insert_query = """
-                INSERT INTO code_chunks (file_path, code_text, embedding)
-                VALUES (%s, %s, %s::vector)
-                ON CONFLICT (file_path) DO UPDATE SET
-                    code_text = EXCLUDED.code_text,
-                    embedding = EXCLUDED.embedding;
-            """
+            # 开启 Matryoshka 时元组中多一个低维向量
+            coarse = bool(self.chunks) and len(self.chunks[0]) == 5 + self.dedup
+            insert_query = self._insert_query(coarse)
 
             self.cur.executemany(insert_query, self.chunks)
+            inserted = self.cur.rowcount
+            if self.dedup:
+                inserted += self._write_duplicates()
+            if self.directory_index:
+                self._update_directory_centroids(
+                    before, self._directory_sums(changed_paths)
+                )
+
+            # 租约已过期并被其它 worker 重新认领的任务由新的持有者删除
+            if self.done_jobs:
+                self.cur.execute(
+                    "DELETE FROM index_jobs WHERE id = ANY(%s) AND leased_by = %s;",
+                    (self.done_jobs, self.worker_id),
+                )
 
             self.conn.commit()
             print(
-                f"成功批量插入 {self.cur.rowcount} 条数据，删除 {len(self.files_to_remove)} 条数据。"
+                f"成功批量插入 {inserted} 条数据，删除 {len(self.files_to_remove)} 条数据。"
             )
+            self._flush_failed_files(changed_paths)
             self.chunks.clear()
+            self.duplicates.clear()
             self.files_to_remove.clear()
+            self.done_jobs.clear()
         except (Exception, psycopg.DatabaseError) as error:
             print(f"批量插入失败: {error}")
             if self.conn:
                 self.conn.rollback()
 
-    def execute_select(self, sql: str, sql_params: dict):
+    def _insert_query(self, coarse: bool) -> str:
+        """写入 append_file_chunk 中的元组的语句，已存在的文件被更新"""
+        columns = ["file_path", "code_text", "embedding", "start_line"]
+        # 开启 Matryoshka 时同时写入低维向量
+        if coarse:
+            columns.append("embedding_coarse")
+        # 开启近重复检测时在同一语句中写入指纹：之后再 UPDATE 会在 HNSW 索引中多出一个条目
+        if self.dedup:
+            columns.append("simhash")
+        values = ["%b" if column.startswith("embedding") else "%s" for column in columns]
+        updates = [f"{column} = EXCLUDED.{column}" for column in columns[1:]]
+        if self.dedup:
+            # 重新索引的文件是代表文件
+            updates.append("duplicate_of = NULL")
+        return f"""
+            INSERT INTO code_chunks ({", ".join(columns)})
+            VALUES ({", ".join(values)})
+            ON CONFLICT (file_path) DO UPDATE SET {", ".join(updates)};
+        """
+
+    def _write_duplicates(self) -> int:
+        """
+        写入近重复文件。近重复文件先删除再插入，不必知道 embedding_coarse 等可选列是否存在，它们的值均为 NULL。
+        已链接到某个文件的近重复文件在该文件本身成为近重复时改为链接到新的代表文件。
+        """
+        if not self.duplicates:
+            return 0
+        self.cur.execute(
+            "DELETE FROM code_chunks WHERE file_path = ANY(%s);",
+            ([duplicate[0] for duplicate in self.duplicates],),
+        )
+        self.cur.executemany(
+            """
+            INSERT INTO code_chunks
+                (file_path, code_text, start_line, simhash, duplicate_of)
+            VALUES (%s, %s, %s, %s, %s);
+            """,
+            self.duplicates,
+        )
+        inserted = self.cur.rowcount
+        self.cur.executemany(
+            "UPDATE code_chunks SET duplicate_of = %s WHERE duplicate_of = %s;",
+            [(duplicate[4], duplicate[0]) for duplicate in self.duplicates],
+        )
+        return inserted
+
+    def _promote_duplicates(self) -> list[str]:
+        """
+        删除代表文件前，把它的行（包括向量）交给它的一个近重复文件，其余近重复文件改为链接到这个文件，
+        这样删除代表文件后它们仍能被搜索到，且不需要重新生成 embedding。
+
+        :return: 接替代表文件的近重复文件
+        """
+        self.cur.execute(
+            """
+            SELECT DISTINCT ON (duplicate_of) duplicate_of, file_path
+            FROM code_chunks
+            WHERE duplicate_of = ANY(%(removed)s) AND file_path <> ALL(%(removed)s)
+            ORDER BY duplicate_of, file_path;
+            """,
+            {"removed": self.files_to_remove},
+        )
+        heirs = self.cur.fetchall()
+        for representative, heir in heirs:
+            self.cur.execute(
+                "DELETE FROM code_chunks WHERE file_path = %s "
+                "RETURNING code_text, start_line, simhash;",
+                (heir,),
+            )
+            code_text, start_line, simhash = self.cur.fetchone()
+            self.cur.execute(
+                """
+                UPDATE code_chunks SET file_path = %s, code_text = %s,
+                    start_line = %s, simhash = %s, duplicate_of = NULL
+                WHERE file_path = %s;
+                """,
+                (heir, code_text, start_line, simhash, representative),
+            )
+            self.cur.execute(
+                "UPDATE code_chunks SET duplicate_of = %s WHERE duplicate_of = %s;",
+                (heir, representative),
+            )
+        return [heir for _, heir in heirs]
+
+    def _lock_files(self, file_paths: list[str]):
+        """
+        在事务结束前锁住 file_paths，同一文件的写入在多个 worker 间依次进行，
+        后一个 worker 读到的旧向量是前一个已提交的向量，目录的向量和不会丢失或重复更新。
+        尚未写入的文件没有行可锁，因此用按路径哈希的 advisory lock；按哈希排序加锁，不会死锁。
+        """
+        if not file_paths:
+            return
+        self.cur.execute(
+            """
+            SELECT pg_advisory_xact_lock(key)
+            FROM (
+                SELECT DISTINCT hashtext(file_path) AS key
+                FROM unnest(%s::text[]) AS file_path
+                ORDER BY key
+            ) keys;
+            """,
+            (file_paths,),
+        )
+
+    def _directory_sums(
+        self, file_paths: list[str]
+    ) -> dict[str, tuple[int, np.ndarray]]:
+        """file_paths 中有向量的文件按目录 (code_chunks.directory) 统计的个数与向量和"""
+        if not file_paths:
+            return {}
+        self.cur.execute(
+            """
+            SELECT directory, count(*), sum(embedding)
+            FROM code_chunks
+            WHERE file_path = ANY(%s) AND embedding IS NOT NULL
+            GROUP BY directory;
+            """,
+            (file_paths,),
+        )
+        return {
+            directory: (files, embedding_sum.to_numpy().astype(np.float64))
+            for directory, files, embedding_sum in self.cur.fetchall()
+        }
+
+    def _update_directory_centroids(
+        self,
+        before: dict[str, tuple[int, np.ndarray]],
+        after: dict[str, tuple[int, np.ndarray]],
+    ):
+        """
+        把写入前后的差值加到 directory_centroids 的个数与向量和上，只涉及变化的文件，与目录大小无关；
+        目录中已没有向量时删除它。按目录排序更新，多个 worker 同时写入时按相同顺序锁住目录，不会死锁。
+        """
+        deltas = []
+        for directory in sorted(before.keys() | after.keys()):
+            files, embedding_sum = after.get(directory, (0, 0.0))
+            old_files, old_sum = before.get(directory, (0, 0.0))
+            delta = np.asarray(embedding_sum - old_sum, dtype=np.float32)
+            if files != old_files or delta.any():
+                deltas.append((directory, files - old_files, delta))
+        if not deltas:
+            return
+        self.cur.executemany(
+            """
+            INSERT INTO directory_centroids (directory, files, embedding_sum)
+            VALUES (%s, %s, %b)
+            ON CONFLICT (directory) DO UPDATE SET
+                files = directory_centroids.files + EXCLUDED.files,
+                embedding_sum = directory_centroids.embedding_sum + EXCLUDED.embedding_sum;
+            """,
+            deltas,
+        )
+        self.cur.execute(
+            "DELETE FROM directory_centroids WHERE directory = ANY(%s) AND files <= 0;",
+            ([delta[0] for delta in deltas],),
+        )
+
+    def find_representatives(
+        self, fingerprints: list[int], exclude: list[str]
+    ) -> list[tuple[str, int]]:
+        """
+        查找与 fingerprints 中任一指纹至少有一个 16 位分段相同的代表文件（候选，汉明距离由调用方计算）。
+        exclude 中的文件和等待删除的文件不作为代表文件。
+
+        :return: [(file_path, simhash)]
+        """
+        from codebase.dedup import bands
+
+        band_values = list(zip(*(bands(fingerprint) for fingerprint in fingerprints)))
+        self.cur.execute(
+            """
+            SELECT file_path, simhash FROM code_chunks
+            WHERE duplicate_of IS NULL AND simhash IS NOT NULL
+              AND (((simhash >> 48) & 65535) = ANY(%(band0)s)
+                OR ((simhash >> 32) & 65535) = ANY(%(band1)s)
+                OR ((simhash >> 16) & 65535) = ANY(%(band2)s)
+                OR (simhash & 65535) = ANY(%(band3)s))
+              AND file_path <> ALL(%(exclude)s);
+            """,
+            {
+                **{f"band{i}": list(values) for i, values in enumerate(band_values)},
+                "exclude": exclude + self.files_to_remove,
+            },
+            prepare=True,
+        )
+        return self.cur.fetchall()
+
+    def fetch_duplicates(self, file_paths: list[str]) -> dict[str, list[str]]:
+        """
+        获取代表文件的近重复文件。
+
+        :return: {代表文件: [近重复文件]}
+        """
+        if not file_paths:
+            return {}
+        try:
+            self.cur.execute(
+                """
+                SELECT duplicate_of, array_agg(file_path ORDER BY file_path)
+                FROM code_chunks
+                WHERE duplicate_of = ANY(%s)
+                GROUP BY duplicate_of;
+                """,
+                (file_paths,),
+                prepare=True,
+            )
+            return dict(self.cur.fetchall())
+        except psycopg.Error as e:
+            print(f"获取近重复文件失败: {e}")
+            self.conn.rollback()
+            return {}
+
+    def fetch_duplicate_rows(
+        self, file_paths: list[str]
+    ) -> list[tuple[str, str, int, int | None, str]]:
+        """
+        获取链接到 file_paths 的近重复文件，用于代表文件内容改变后重新检查它们。
+
+        :return: [(file_path, code_text, start_line, simhash, duplicate_of)]
+        """
+        if not file_paths:
+            return []
+        self.cur.execute(
+            """
+            SELECT file_path, code_text, start_line, simhash, duplicate_of
+            FROM code_chunks
+            WHERE duplicate_of = ANY(%s)
+            ORDER BY file_path;
+            """,
+            (file_paths,),
+        )
+        return self.cur.fetchall()
+
+    def _flush_failed_files(self, done_paths: list[str]):
+        """记录本次失败的文件，并移除已成功索引或已删除的文件。failed_files 表不存在时只打印错误。"""
+        try:
+            if done_paths:
+                self.cur.execute(
+                    "DELETE FROM failed_files WHERE file_path = ANY(%s);",
+                    (done_paths,),
+                )
+            if self.failed_files:
+                self.cur.executemany(
+                    """
+                    INSERT INTO failed_files (file_path, error)
+                    VALUES (%s, %s)
+                    ON CONFLICT (file_path) DO UPDATE SET
+                        error = EXCLUDED.error,
+                        failed_at = CURRENT_TIMESTAMP;
+                    """,
+                    self.failed_files,
+                )
+                print(
+                    f"{len(self.failed_files)} 个文件生成 embedding 失败，"
+                    "可使用 codebase index --retry-failed 重试。"
+                )
+            self.conn.commit()
+        except psycopg.Error as e:
+            print(f"更新 failed_files 失败: {e}")
+            self.conn.rollback()
+        self.failed_files.clear()
+
+    def get_failed_files(self) -> list[str]:
+        """获取生成 embedding 失败、等待重试的文件"""
+        try:
+            self.cur.execute("SELECT file_path FROM failed_files ORDER BY file_path")
+            return [row[0] for row in self.cur.fetchall()]
+        except psycopg.Error as e:
+            print(f"读取 failed_files 失败: {e}")
+            self.conn.rollback()
+            return []
+
+    def enqueue_jobs(self, jobs: list[tuple[str, str | None]]):
+        """
+        写入 (file_path, blob) 任务。已在队列中的文件更新 blob 并释放租约，
+        正在处理旧版本的 worker 完成后不会删除它，新版本会被重新认领。
+        """
+        try:
+            self.cur.executemany(
+                """
+                INSERT INTO index_jobs (file_path, blob)
+                VALUES (%s, %s)
+                ON CONFLICT (file_path) DO UPDATE SET
+                    blob = EXCLUDED.blob,
+                    leased_by = NULL,
+                    leased_until = NULL,
+                    attempts = 0,
+                    enqueued_at = CURRENT_TIMESTAMP;
+                """,
+                jobs,
+            )
+            self.conn.commit()
+        except psycopg.Error as e:
+            print(f"写入 index_jobs 失败: {e}")
+            self.conn.rollback()
+            raise
+
+    def claim_jobs(
+        self, worker_id: str, limit: int, lease_seconds: float, max_attempts: int
+    ) -> list[tuple[int, str, str | None]]:
+        """
+        认领最多 limit 个未被认领或租约已过期的任务，返回 [(id, file_path, blob)]。
+        FOR UPDATE SKIP LOCKED 让多个 worker 并发认领时互不等待，也不会拿到同一个任务。
+        时间使用数据库的 now()，不依赖各台机器的时钟。
+        """
+        self.worker_id = worker_id
+        self.cur.execute(
+            """
+            -- MATERIALIZED: 作为 IN 子查询时可能在嵌套循环中被重复执行，SKIP LOCKED 每次锁住不同的任务
+            WITH claimable AS MATERIALIZED (
+                SELECT id FROM index_jobs
+                WHERE (leased_until IS NULL OR leased_until < now())
+                    AND attempts < %(max_attempts)s
+                ORDER BY id
+                LIMIT %(limit)s
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE index_jobs SET
+                leased_by = %(worker_id)s,
+                leased_until = now() + make_interval(secs => %(lease_seconds)s),
+                attempts = attempts + 1
+            WHERE id IN (SELECT id FROM claimable)
+            RETURNING id, file_path, blob;
+            """,
+            {
+                "worker_id": worker_id,
+                "lease_seconds": lease_seconds,
+                "max_attempts": max_attempts,
+                "limit": limit,
+            },
+        )
+        jobs = sorted(self.cur.fetchall())
+        self.conn.commit()
+        return jobs
+
+    def count_jobs(self, max_attempts: int) -> tuple[int, int]:
+        """返回 (未完成的任务数, 其中超过重试次数而不再被认领的任务数)"""
+        self.cur.execute(
+            "SELECT count(*), count(*) FILTER (WHERE attempts >= %s) FROM index_jobs",
+            (max_attempts,),
+        )
+        pending, exhausted = self.cur.fetchone()
+        self.conn.commit()
+        return pending, exhausted
+
+    def execute_select(
+        self,
+        sql: str,
+        sql_params: dict,
+        prepare: bool | None = None,
+        ef_search: int | None = None,
+    ):
         """
         执行 SELECT 查询并返回结果。
 
         :param sql: SQL 查询语句
         :param sql_params: 查询参数字典
+        :param prepare: 为 True 时立即使用服务端预编译语句，适合在同一连接上反复执行的热点查询；
+                        为 None 时由 psycopg 按 prepare_threshold 自动决定
+        :param ef_search: 不为 None 时只在这次查询中使用这个 hnsw.ef_search，查询后恢复原值，
+                          复用的连接上之后的查询不受影响
         :return: 包含列名和查询结果的元组 (column_names, results)
         """
+        previous = None
         try:
-            self.cur.execute(sql, sql_params)
+            if ef_search is not None:
+                self.cur.execute(
+                    "SELECT current_setting('hnsw.ef_search', true), "
+                    "set_config('hnsw.ef_search', %s, false)",
+                    (str(ef_search),),
+                )
+                previous = self.cur.fetchone()
+            self.cur.execute(sql, sql_params, prepare=prepare)
             results = self.cur.fetchall()
             column_names = [desc[0] for desc in self.cur.description] if self.cur.description else None
             return column_names, results
 
         except (Exception, psycopg.DatabaseError) as error:
             print(f"执行查询时出错: {error}")
+            # 回滚失败的事务，保证复用的连接还能继续执行查询
+            self.conn.rollback()
             return []
+        finally:
+            if previous is not None:
+                self._restore_ef_search(previous[0])
+
+    def _restore_ef_search(self, value: str | None):
+        # 回滚可能已经撤销了修改，这里总是写回原值
+        try:
+            if value is None:
+                self.cur.execute("RESET hnsw.ef_search")
+            else:
+                self.cur.execute(
+                    "SELECT set_config('hnsw.ef_search', %s, false)", (value,)
+                )
+        except psycopg.Error as error:
+            print(f"恢复 hnsw.ef_search 时出错: {error}")
+            self.conn.rollback()
+
+    def iter_select(self, sql: str, sql_params: dict, batch_size: int = 500):
+        """
+        使用服务端游标执行查询，按批产出结果，内存占用与结果集大小无关。
+        第一次产出列名，之后每次产出最多 batch_size 行；提前关闭生成器时游标随之关闭。
+        """
+        try:
+            with self.conn.cursor(name="codebase_stream") as cur:
+                cur.execute(sql, sql_params)
+                yield [desc[0] for desc in cur.description] if cur.description else []
+                while rows := cur.fetchmany(batch_size):
+                    yield rows
+        finally:
+            # 服务端游标只在事务中存在，结束只读的查询事务
+            self.conn.rollback()
+
+    def set_ef_search(self, ef_search: int):
+        """
+        设置当前会话的 hnsw.ef_search，HNSW 最多只返回 ef_search 个结果。
+        之后在这个连接上的所有查询都使用这个值，只调大一次查询时使用 execute_select(ef_search=...)
+        """
+        self.cur.execute(
+            "SELECT set_config('hnsw.ef_search', %s, false)", (str(ef_search),)
+        )
+
+    def fetch_snippets(
+        self, file_paths: list[str], lines: int, max_chars: int
+    ) -> dict[str, tuple[int, str]]:
+        """
+        在数据库端截取代码片段，只传输每个文件的前 lines 行（最多 max_chars 个字符）。
+
+        :return: {file_path: (start_line, snippet)}
+        """
+        if not file_paths:
+            return {}
+        try:
+            self.cur.execute(
+                """
+                SELECT file_path, start_line,
+                       array_to_string(
+                           (string_to_array(left(code_text, %(max_chars)s::int), E'\\n'))
+                               [1:%(lines)s::int],
+                           E'\\n'
+                       )
+                FROM code_chunks
+                WHERE file_path = ANY(%(file_paths)s);
+                """,
+                {"file_paths": file_paths, "lines": lines, "max_chars": max_chars},
+                prepare=True,
+            )
+            return {row[0]: (row[1], row[2]) for row in self.cur.fetchall()}
+        except psycopg.Error as e:
+            print(f"获取代码片段失败: {e}")
+            self.conn.rollback()
+            return {}
+
+    def prewarm_relations(self) -> list[str]:
+        """code_chunks 的索引（包括 HNSW 索引）、表本身和 TOAST 表，按预热顺序排列"""
+        self.cur.execute(
+            """
+            SELECT indexrelid::regclass::text FROM pg_index
+            WHERE indrelid = 'code_chunks'::regclass
+            UNION ALL
+            SELECT 'code_chunks'
+            UNION ALL
+            SELECT reltoastrelid::regclass::text FROM pg_class
+            WHERE oid = 'code_chunks'::regclass AND reltoastrelid <> 0;
+            """
+        )
+        return [row[0] for row in self.cur.fetchall()]
+
+    def prewarm(self) -> dict[str, int] | None:
+        """
+        用 pg_prewarm 把 prewarm_relations() 读入 shared buffers，第一次查询不再从磁盘读取页面。
+
+        :return: {relation: 读入的块数}；数据库中没有 pg_prewarm 扩展时返回 None
+        """
+        self.cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_prewarm'")
+        if self.cur.fetchone() is None:
+            self.conn.rollback()
+            return None
+        blocks = {}
+        for relation in self.prewarm_relations():
+            self.cur.execute("SELECT pg_prewarm(%s::regclass)", (relation,))
+            blocks[relation] = self.cur.fetchone()[0]
+        self.conn.rollback()
+        return blocks
 
     def get_last_commit_hash(self) -> str | None:
         """获取最后一次索引的commit hash"""
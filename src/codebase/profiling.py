@@ -0,0 +1,327 @@
+"""
+Instrumentation.
+
+Profiler: per-stage wall and CPU time of indexing runs, item and byte counts
+of each stage (git, read, parse, embed, db) and the peak depth of the buffers
+between them, exported as a text summary, JSON or Prometheus text. CPU time
+is that of this process; work done in encode pool workers or by the embedding
+server shows up as wall time of the stage waiting for it.
+
+RequestMetrics: latency histograms of the phases of long-running servers'
+requests, with request, error and empty result counts.
+"""
+
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class StageStats:
+    """Accumulated time and throughput of one stage."""
+
+    def __init__(self):
+        self.calls: int = 0
+        self.wall: float = 0.0
+        self.cpu: float = 0.0
+        self.items: int = 0
+        self.bytes: int = 0
+
+    def count(self, items: int = 1, nbytes: int = 0):
+        self.items += items
+        self.bytes += nbytes
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "wall_seconds": self.wall,
+            "cpu_seconds": self.cpu,
+            "items": self.items,
+            "bytes": self.bytes,
+            "items_per_second": self.items / self.wall if self.wall > 0 else 0.0,
+        }
+
+
+class Profiler:
+    """
+    Collects StageStats by stage name. Nested stages are counted in both the
+    inner and the outer stage.
+    """
+
+    def __init__(self):
+        self.stages: dict[str, StageStats] = {}
+        # peak value of each observed queue or buffer
+        self.max_depths: dict[str, int] = {}
+        self.start: float = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageStats]:
+        """Time the block as one call of the stage; count items on the yielded stats."""
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield stats
+        finally:
+            stats.cpu += time.process_time() - cpu
+            stats.wall += time.perf_counter() - wall
+            stats.calls += 1
+
+    def observe_depth(self, name: str, depth: int):
+        if depth > self.max_depths.get(name, 0):
+            self.max_depths[name] = depth
+
+    def to_dict(self) -> dict:
+        return {
+            "total_seconds": time.perf_counter() - self.start,
+            "stages": {name: stats.to_dict() for name, stats in self.stages.items()},
+            "max_depths": dict(self.max_depths),
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self, prefix: str = "codebase_index") -> str:
+        """Prometheus text format, e.g. for the node_exporter textfile collector."""
+        data = self.to_dict()
+        # (metric, stats key, help)
+        metrics = [
+            ("stage_wall_seconds", "wall_seconds", "Wall time spent in the stage"),
+            ("stage_cpu_seconds", "cpu_seconds", "CPU time of this process in stage"),
+            ("stage_calls_total", "calls", "Number of times the stage ran"),
+            ("stage_items_total", "items", "Items processed by the stage"),
+            ("stage_bytes_total", "bytes", "Bytes processed by the stage"),
+        ]
+        lines = [
+            f"# HELP {prefix}_duration_seconds Wall time of the indexing run",
+            f"# TYPE {prefix}_duration_seconds gauge",
+            f"{prefix}_duration_seconds {data['total_seconds']}",
+        ]
+        for metric, key, help_text in metrics:
+            lines.append(f"# HELP {prefix}_{metric} {help_text}")
+            lines.append(f"# TYPE {prefix}_{metric} counter")
+            for name, stats in data["stages"].items():
+                lines.append(f'{prefix}_{metric}{{stage="{name}"}} {stats[key]}')
+        if data["max_depths"]:
+            lines.append(
+                f"# HELP {prefix}_max_queue_depth Peak depth of a queue or buffer"
+            )
+            lines.append(f"# TYPE {prefix}_max_queue_depth gauge")
+            for name, depth in data["max_depths"].items():
+                lines.append(f'{prefix}_max_queue_depth{{queue="{name}"}} {depth}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        from tabulate import tabulate
+
+        data = self.to_dict()
+        total = data["total_seconds"]
+        rows = [
+            [
+                name,
+                stats["calls"],
+                stats["wall_seconds"],
+                100 * stats["wall_seconds"] / total if total > 0 else 0.0,
+                stats["cpu_seconds"],
+                stats["items"],
+                stats["items_per_second"],
+                stats["bytes"] / 2**20,
+            ]
+            for name, stats in data["stages"].items()
+        ]
+        table = tabulate(
+            rows,
+            headers=[
+                "stage", "calls", "wall s", "wall %", "cpu s", "items", "items/s", "MiB"
+            ],
+            floatfmt=".2f",
+        )
+        depths = ", ".join(
+            f"{name}={depth}" for name, depth in data["max_depths"].items()
+        )
+        text = f"{table}\ntotal {total:.2f} s"
+        if depths:
+            text += f", max queue depth: {depths}"
+        return text
+
+    def write(self, path: str):
+        """Write JSON, or Prometheus text when path ends with .prom"""
+        with open(path, "w", encoding="utf-8") as f:
+            if path.endswith(".prom"):
+                f.write(self.to_prometheus())
+            else:
+                f.write(self.to_json() + "\n")
+
+
+class LatencyHistogram:
+    """Latencies in fixed buckets, like a Prometheus histogram."""
+
+    # Bucket upper bounds in seconds, the last bucket is +Inf
+    BOUNDS = (
+        0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+    )
+
+    def __init__(self):
+        self.buckets: list[int] = [0] * (len(self.BOUNDS) + 1)
+        self.count: int = 0
+        self.sum: float = 0.0
+
+    def observe(self, seconds: float):
+        self.buckets[bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        """Estimate, interpolating linearly inside the bucket (seconds)."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.buckets):
+            if n > 0 and cumulative + n >= rank:
+                if i == len(self.BOUNDS):
+                    return self.BOUNDS[-1]
+                lower = self.BOUNDS[i - 1] if i > 0 else 0.0
+                return lower + (self.BOUNDS[i] - lower) * (rank - cumulative) / n
+            cumulative += n
+        return self.BOUNDS[-1]
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": 1000 * self.sum / self.count if self.count else 0.0,
+            "p50_ms": 1000 * self.quantile(0.5),
+            "p95_ms": 1000 * self.quantile(0.95),
+            "p99_ms": 1000 * self.quantile(0.99),
+        }
+
+
+class RequestRecord:
+    """Outcome of one request, set by the request handler."""
+
+    def __init__(self):
+        self.error: bool = False
+        self.empty: bool = False
+
+
+class RequestMetrics:
+    """
+    Per-tool request counts and latency histograms of whole requests and of
+    their phases (encode, sql, ...). Thread-safe, so that another thread can
+    export while requests are served.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start: float = time.perf_counter()
+        self.requests: dict[str, LatencyHistogram] = {}
+        self.phases: dict[str, LatencyHistogram] = {}
+        self.errors: dict[str, int] = {}
+        self.empty: dict[str, int] = {}
+
+    @contextmanager
+    def request(self, tool: str) -> Iterator[RequestRecord]:
+        record = RequestRecord()
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            record.error = True
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                _observe(self.requests, tool, seconds)
+                if record.error:
+                    self.errors[tool] = self.errors.get(tool, 0) + 1
+                elif record.empty:
+                    self.empty[tool] = self.empty.get(tool, 0) + 1
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                _observe(self.phases, name, seconds)
+
+    def to_dict(self, caches: dict[str, tuple[int, int]] | None = None) -> dict:
+        """
+        :param caches: {cache name: (hits, misses)} of the caches on the request path
+        """
+        with self.lock:
+            requests = {
+                tool: {
+                    **histogram.to_dict(),
+                    "errors": self.errors.get(tool, 0),
+                    "empty": self.empty.get(tool, 0),
+                }
+                for tool, histogram in self.requests.items()
+            }
+            phases = {name: h.to_dict() for name, h in self.phases.items()}
+        return {
+            "uptime_seconds": time.perf_counter() - self.start,
+            "requests": requests,
+            "phases": phases,
+            "caches": {
+                name: {
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+                }
+                for name, (hits, misses) in (caches or {}).items()
+            },
+        }
+
+    def to_prometheus(
+        self,
+        prefix: str = "codebase_mcp",
+        caches: dict[str, tuple[int, int]] | None = None,
+    ) -> str:
+        lines = []
+        with self.lock:
+            for metric, label, histograms in [
+                ("request_seconds", "tool", self.requests),
+                ("phase_seconds", "phase", self.phases),
+            ]:
+                lines.append(f"# TYPE {prefix}_{metric} histogram")
+                for name, h in histograms.items():
+                    cumulative = 0
+                    bounds = [*map(str, h.BOUNDS), "+Inf"]
+                    for bound, n in zip(bounds, h.buckets):
+                        cumulative += n
+                        lines.append(
+                            f'{prefix}_{metric}_bucket{{{label}="{name}",le="{bound}"}}'
+                            f" {cumulative}"
+                        )
+                    lines.append(f'{prefix}_{metric}_sum{{{label}="{name}"}} {h.sum}')
+                    lines.append(
+                        f'{prefix}_{metric}_count{{{label}="{name}"}} {h.count}'
+                    )
+            for metric, counts in [
+                ("errors_total", self.errors),
+                ("empty_results_total", self.empty),
+            ]:
+                lines.append(f"# TYPE {prefix}_{metric} counter")
+                for tool in self.requests:
+                    lines.append(
+                        f'{prefix}_{metric}{{tool="{tool}"}} {counts.get(tool, 0)}'
+                    )
+        for metric, column in [("cache_hits_total", 0), ("cache_misses_total", 1)]:
+            lines.append(f"# TYPE {prefix}_{metric} counter")
+            for name, counts in (caches or {}).items():
+                lines.append(f'{prefix}_{metric}{{cache="{name}"}} {counts[column]}')
+        return "\n".join(lines) + "\n"
+
+
+def _observe(histograms: dict[str, LatencyHistogram], name: str, seconds: float):
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms[name] = LatencyHistogram()
+    histogram.observe(seconds)
@@ -0,0 +1,125 @@
+import time
+from collections import OrderedDict
+import numpy as np
+from codebase.config import CONFIG
+
+FETCH_CANDIDATES_SQL = """
+SELECT file_path, md5(code_text), left(code_text, %(max_chars)s::int)
+FROM code_chunks
+WHERE file_path = ANY(%(file_paths)s);
+"""
+
+
+class Reranker:
+    """
+    Re-score (query, chunk) pairs with a cross-encoder. ``model`` is anything
+    with a sentence-transformers ``CrossEncoder.predict`` compatible method.
+    """
+
+    def __init__(self, model, batch_size: int = 16, cache_size: int = 10000):
+        self.model = model
+        self.batch_size: int = batch_size
+        self.cache_size: int = cache_size
+        # (query, content hash) -> score, least recently used first
+        self.cache: OrderedDict[tuple[str, str], float] = OrderedDict()
+        self.cache_hits: int = 0
+        self.cache_misses: int = 0
+
+    def _cache_put(self, key: tuple[str, str], score: float):
+        self.cache[key] = score
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def scores(
+        self, query: str, candidates: list[tuple[str, str]], budget_ms: float
+    ) -> np.ndarray | None:
+        """
+        Score candidates given as (content hash, text) in batches.
+
+        Returns one score per candidate, or None when the latency budget runs
+        out first. Scores computed before that are kept in the cache.
+        """
+        deadline = time.perf_counter() + budget_ms / 1000.0
+        scores = np.empty(len(candidates), dtype=np.float32)
+        pending: list[int] = []
+        for i, (content_hash, _) in enumerate(candidates):
+            cached = self.cache.get((query, content_hash))
+            if cached is None:
+                self.cache_misses += 1
+                pending.append(i)
+            else:
+                self.cache_hits += 1
+                self.cache.move_to_end((query, content_hash))
+                scores[i] = cached
+
+        batch_seconds = 0.0
+        for start in range(0, len(pending), self.batch_size):
+            now = time.perf_counter()
+            # Don't start a batch that is expected to overrun the budget
+            if now + batch_seconds > deadline:
+                return None
+            batch = pending[start : start + self.batch_size]
+            batch_scores = self.model.predict(
+                [(query, candidates[i][1]) for i in batch],
+                batch_size=self.batch_size,
+                show_progress_bar=False,
+            )
+            batch_seconds = time.perf_counter() - now
+            for i, score in zip(batch, batch_scores):
+                scores[i] = score
+                self._cache_put((query, candidates[i][0]), float(score))
+
+        return scores
+
+
+def rerank_records(
+    pgvector_connector, reranker: Reranker, query: str, records: list, top_k: int
+) -> list[tuple]:
+    """
+    Re-order search records (file_path, distance, ...) by cross-encoder score
+    and keep top_k. Each returned record gains the score as its last column,
+    None when the budget ran out and the vector order was kept.
+    """
+    rerank_config = CONFIG["rerank"]
+    file_paths = [record[0] for record in records]
+    _, rows = pgvector_connector.execute_select(
+        FETCH_CANDIDATES_SQL,
+        {"file_paths": file_paths, "max_chars": rerank_config["max_chars"]},
+    )
+    texts = {file_path: (content_hash, text) for file_path, content_hash, text in rows}
+    candidates = [texts.get(file_path, ("", "")) for file_path in file_paths]
+
+    scores = reranker.scores(query, candidates, rerank_config["budget_ms"])
+    if scores is None:
+        return [(*record, None) for record in records[:top_k]]
+
+    order = np.argsort(-scores, kind="stable")[:top_k]
+    return [(*records[i], float(scores[i])) for i in order]
+
+
+_RERANKER: Reranker | None = None
+
+
+def rerank_enabled() -> bool:
+    return bool(CONFIG["rerank"]["enabled"])
+
+
+def loaded_reranker() -> Reranker | None:
+    """The reranker if it has been loaded, without loading it."""
+    return _RERANKER
+
+
+def get_reranker() -> Reranker:
+    """Load the configured cross-encoder on first use, on CPU."""
+    global _RERANKER
+    if _RERANKER is None:
+        from sentence_transformers import CrossEncoder
+
+        rerank_config = CONFIG["rerank"]
+        _RERANKER = Reranker(
+            CrossEncoder(rerank_config["model"], device="cpu"),
+            rerank_config["batch_size"],
+            rerank_config["cache_size"],
+        )
+    return _RERANKER
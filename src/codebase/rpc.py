@@ -0,0 +1,247 @@
+"""
+`codebase rpc`: long-lived search backend for editor plugins, speaking
+JSON-RPC 2.0 over stdin/stdout with one message per line.
+
+The model is loaded and the database connected once at startup. Requests
+are read on the main thread and run one at a time on a worker thread, so
+that a `$/cancelRequest` notification can stop a stale search while it
+runs: the running SQL statement is cancelled on the server and no more
+rows are sent. A search streams its rows as `search/rows` notifications,
+then answers with the row count:
+
+    -> {"jsonrpc": "2.0", "id": 1, "method": "search", "params": {"query_text": "open db"}}
+    <- {"jsonrpc": "2.0", "method": "search/rows", "params": {"id": 1, "columns": [...], "rows": [...]}}
+    <- {"jsonrpc": "2.0", "id": 1, "result": {"columns": [...], "rows": 10}}
+    -> {"jsonrpc": "2.0", "method": "$/cancelRequest", "params": {"id": 2}}
+    <- {"jsonrpc": "2.0", "id": 2, "error": {"code": -32800, "message": "request cancelled"}}
+
+search params: query_text, sql, dbname, rerank, top_k, snippets,
+snippet_lines, limit (all optional except query_text when the SQL needs
+the query embedding).
+"""
+
+import json
+import queue
+import threading
+from argparse import Namespace
+from functools import lru_cache
+
+from codebase.daemon import DaemonState
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+# Same code as the Language Server Protocol
+REQUEST_CANCELLED = -32800
+
+
+class RpcError(Exception):
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code: int = code
+
+
+class PendingRequest:
+
+    def __init__(self, request_id, method: str, params: dict):
+        self.id = request_id
+        self.method: str = method
+        self.params: dict = params
+        self.cancelled = threading.Event()
+
+    def check_cancelled(self):
+        if self.cancelled.is_set():
+            raise RpcError(REQUEST_CANCELLED, "request cancelled")
+
+
+class RpcServer:
+    """
+    Dispatches the JSON-RPC messages of one client. serve() reads messages
+    until the input ends; responses and notifications go to output.
+    """
+
+    def __init__(
+        self, state: DaemonState, output, batch_size: int = 50, cache_size: int = 256
+    ):
+        self.state: DaemonState = state
+        self.output = output
+        # Rows are sent as soon as a batch of this many has been fetched
+        self.batch_size: int = batch_size
+        # Typing, then deleting characters repeats earlier queries
+        self.encode = lru_cache(maxsize=cache_size)(state.model.encode)
+        self.write_lock = threading.Lock()
+        self.queue: queue.Queue[PendingRequest | None] = queue.Queue()
+        # Queued and running requests by id, guarded by pending_lock
+        self.pending: dict = {}
+        self.running: PendingRequest | None = None
+        self.running_connector = None
+        self.pending_lock = threading.Lock()
+
+    def send(self, message: dict):
+        from codebase.search import json_value
+
+        line = json.dumps(
+            {"jsonrpc": "2.0", **message}, ensure_ascii=False, default=json_value
+        )
+        with self.write_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def send_error(self, request_id, code: int, message: str):
+        self.send({"id": request_id, "error": {"code": code, "message": message}})
+
+    def serve(self, lines):
+        worker = threading.Thread(target=self.work, daemon=True)
+        worker.start()
+        try:
+            for line in lines:
+                if line.strip():
+                    self.receive(line)
+        finally:
+            # Answer the requests still queued, then stop
+            self.queue.put(None)
+            worker.join()
+
+    def receive(self, line: str):
+        try:
+            message = json.loads(line)
+        except ValueError as e:
+            self.send_error(None, PARSE_ERROR, f"parse error: {e}")
+            return
+        if not isinstance(message, dict) or not isinstance(
+            message.get("method"), str
+        ):
+            self.send_error(
+                message.get("id") if isinstance(message, dict) else None,
+                INVALID_REQUEST,
+                "invalid request",
+            )
+            return
+        method, params = message["method"], message.get("params") or {}
+        if "id" not in message:
+            # Notification
+            if method == "$/cancelRequest":
+                self.cancel(params.get("id"))
+            return
+        request = PendingRequest(message["id"], method, params)
+        with self.pending_lock:
+            self.pending[request.id] = request
+        self.queue.put(request)
+
+    def cancel(self, request_id):
+        with self.pending_lock:
+            request = self.pending.get(request_id)
+            if request is None:
+                return
+            request.cancelled.set()
+            if request is self.running and self.running_connector is not None:
+                # Stop the statement being executed for it
+                self.running_connector.conn.cancel()
+
+    def work(self):
+        while (request := self.queue.get()) is not None:
+            with self.pending_lock:
+                self.running = request
+            try:
+                request.check_cancelled()
+                response = {"id": request.id, "result": self.dispatch(request)}
+            except Exception as e:
+                if request.cancelled.is_set():
+                    code, text = REQUEST_CANCELLED, "request cancelled"
+                elif isinstance(e, RpcError):
+                    code, text = e.code, str(e)
+                else:
+                    code, text = INTERNAL_ERROR, f"{type(e).__name__}: {e}"
+                    self.state.drop_connector(request.params.get("dbname", ""))
+                response = {"id": request.id, "error": {"code": code, "message": text}}
+            finally:
+                with self.pending_lock:
+                    self.running = None
+                    self.running_connector = None
+                    self.pending.pop(request.id, None)
+            self.send(response)
+
+    def dispatch(self, request: PendingRequest):
+        if request.method == "ping":
+            return "pong"
+        if request.method == "search":
+            return self.search(request)
+        raise RpcError(METHOD_NOT_FOUND, f"unknown method: {request.method}")
+
+    def search(self, request: PendingRequest) -> dict:
+        from codebase.search import (
+            attach_snippets,
+            limit_batches,
+            needs_embedding,
+            stream_search,
+        )
+
+        params = request.params
+        options = {
+            "query_text": params.get("query_text", ""),
+            "sql": params.get("sql") or None,
+            "rerank": bool(params.get("rerank", False)),
+            "top_k": params.get("top_k", 10),
+            "snippets": False,
+            "snippet_lines": None,
+        }
+        if needs_embedding(options) and not options["query_text"]:
+            raise RpcError(INVALID_PARAMS, "query_text is required for this search")
+
+        connector = self.state.connector(params.get("dbname", ""))
+        with self.pending_lock:
+            self.running_connector = connector
+        request.check_cancelled()
+        column_names, batches = stream_search(
+            connector, lambda: self, options, self.batch_size
+        )
+        column_names = column_names or []
+        batches = limit_batches(batches, params.get("limit"))
+        if params.get("snippets"):
+            batches = attach_snippets(connector, batches, params.get("snippet_lines"))
+            column_names = [*column_names, "start_line", "snippet"]
+        count = 0
+        try:
+            for rows in batches:
+                request.check_cancelled()
+                self.send(
+                    {
+                        "method": "search/rows",
+                        "params": {
+                            "id": request.id,
+                            "columns": column_names,
+                            "rows": rows,
+                        },
+                    }
+                )
+                count += len(rows)
+        finally:
+            batches.close()
+        return {"columns": column_names, "rows": count}
+
+
+def main(args: Namespace):
+    import contextlib
+    import io
+    import sys
+
+    from codebase.config import CONFIG
+
+    if len(args.dbname) > 0:
+        CONFIG["pgvector"]["dbname"] = args.dbname
+
+    print("Loading embedding model...", file=sys.stderr)
+    from codebase.model_provider import get_embedding_model
+
+    state = DaemonState(get_embedding_model())
+    # Connect to the default database up front
+    state.connector("")
+
+    output = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+    lines = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8")
+    # stdout carries the protocol only, anything printed goes to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        RpcServer(state, output).serve(lines)
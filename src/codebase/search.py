@@ -1,37 +1,810 @@
 from argparse import Namespace
 
+# pgvector's default hnsw.ef_search, HNSW returns at most this many rows
+DEFAULT_EF_SEARCH = 40
+# Upper limit of hnsw.ef_search
+MAX_EF_SEARCH = 1000
 
-def main(args: Namespace):
+DEFAULT_SQL = """
+SELECT file_path, embedding <=> %(embedding)s::vector AS distance
+FROM code_chunks
+ORDER BY embedding <=> %(embedding)s::vector
+LIMIT 10;
+"""
+
+SEARCH_SQL = """
+SELECT file_path, embedding <=> %(embedding)s::vector AS distance
+FROM code_chunks
+ORDER BY embedding <=> %(embedding)s::vector
+LIMIT %(top_k)s;
+"""
+
+# Matryoshka: coarse ANN on the short prefix vector, then exact re-scoring
+# of the candidates on the full vector.
+TWO_STAGE_SEARCH_SQL = """
+SELECT file_path, embedding <=> %(embedding)s::vector AS distance
+FROM (
+    SELECT file_path, embedding
+    FROM code_chunks
+    ORDER BY embedding_coarse <=> %(embedding_coarse)s::vector
+    LIMIT %(candidates)s
+) coarse
+ORDER BY distance
+LIMIT %(top_k)s;
+"""
+
+# Coarse to fine: the directories with the nearest centroids, then exact
+# distances within them only. The cosine distance of a directory's
+# embedding sum is that of its mean. MATERIALIZED keeps the planner from walking
+# the HNSW index with a directory filter, which stops after ef_search rows.
+DIRECTORY_SEARCH_SQL = """
+WITH candidates AS MATERIALIZED (
+    SELECT file_path, embedding <=> %(embedding)s::vector AS distance
+    FROM code_chunks
+    WHERE embedding IS NOT NULL AND directory IN (
+        SELECT directory
+        FROM directory_centroids
+        ORDER BY embedding_sum <=> %(embedding)s::vector
+        LIMIT %(directories)s
+    )
+)
+SELECT file_path, distance
+FROM candidates
+ORDER BY distance
+LIMIT %(top_k)s;
+"""
+
+
+def _paged(sql: str) -> str:
+    """
+    Page of the rows of a top-k search: the inner LIMIT still bounds the
+    index scan, the distance cut-off and OFFSET apply to those rows only.
+    """
+    return f"""
+SELECT file_path, distance
+FROM ({sql.strip().rstrip(";")}) nearest
+WHERE %(max_distance)s::float8 IS NULL OR distance <= %(max_distance)s::float8
+ORDER BY distance
+OFFSET %(offset)s;
+"""
+
+
+PAGED_SEARCH_SQL = _paged(SEARCH_SQL)
+PAGED_TWO_STAGE_SEARCH_SQL = _paged(TWO_STAGE_SEARCH_SQL)
+PAGED_DIRECTORY_SEARCH_SQL = _paged(DIRECTORY_SEARCH_SQL)
+
+# One statement for many queries: each query vector drives its own ANN
+# top-k through LATERAL, rows come back grouped in input order.
+BATCH_SEARCH_SQL = """
+SELECT q.ord, c.file_path, c.distance
+FROM unnest(%(embeddings)s::vector[]) WITH ORDINALITY AS q(embedding, ord)
+CROSS JOIN LATERAL (
+    SELECT file_path, embedding <=> q.embedding AS distance
+    FROM code_chunks
+    ORDER BY embedding <=> q.embedding
+    LIMIT %(top_k)s
+) c
+ORDER BY q.ord, c.distance;
+"""
+
+# "Find similar code": the stored embedding of a file, or of its chunk that
+# starts closest before line
+LIKE_FILE_SQL = """
+SELECT file_path, embedding
+FROM code_chunks
+WHERE file_path = %(path)s
+ORDER BY start_line <= %(line)s DESC, abs(start_line - %(line)s)
+LIMIT 1;
+"""
+
+# A near-duplicate has no embedding of its own, use its representative's
+DUPLICATE_OF_SQL = """
+SELECT r.embedding
+FROM code_chunks d JOIN code_chunks r ON r.file_path = d.duplicate_of
+WHERE d.file_path = %(path)s;
+"""
+
+# Mean of the stored embeddings of every file under a directory
+LIKE_DIRECTORY_SQL = """
+SELECT array_agg(file_path), avg(embedding)
+FROM code_chunks
+WHERE starts_with(file_path, %(prefix)s);
+"""
+
+
+class SearchError(Exception):
+    """A search statement failed; execute_select has printed the database error."""
+
+
+def truncate_utf8(text: str, max_bytes: int) -> str:
+    """Cut text to at most max_bytes UTF-8 bytes without splitting a character."""
+    encoded = text.encode("utf8")
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max_bytes].decode("utf8", errors="ignore")
+
+
+def bound_snippets(
+    snippets: list[str], max_bytes_per_result: int, max_bytes_per_response: int
+) -> list[str]:
+    """
+    Apply the per-result and per-response byte budgets to snippets given in
+    result order. Once the response budget is spent the remaining snippets
+    are returned empty.
+    """
+    remaining = max_bytes_per_response
+    bounded = []
+    for snippet in snippets:
+        snippet = truncate_utf8(snippet, min(max_bytes_per_result, remaining))
+        remaining -= len(snippet.encode("utf8"))
+        bounded.append(snippet)
+    return bounded
+
+
+def fetch_bounded_snippets(
+    pgvector_connector, file_paths: list[str], lines: int | None = None
+) -> list[tuple[int, str] | None]:
+    """
+    Fetch the snippets of file_paths (in order) cut server-side and bounded by
+    CONFIG["snippet"]. Paths missing from code_chunks yield None.
+    """
+    from codebase.config import CONFIG
+
+    snippet_config = CONFIG["snippet"]
+    max_bytes_per_result = snippet_config["max_bytes_per_result"]
+    # left() in SQL counts characters, which is never less than the byte
+    # budget; the exact byte cut happens in bound_snippets.
+    rows = pgvector_connector.fetch_snippets(
+        file_paths,
+        lines if lines is not None else snippet_config["lines"],
+        max_bytes_per_result,
+    )
+    found = [rows.get(file_path) for file_path in file_paths]
+    bounded = bound_snippets(
+        [row[1] for row in found if row is not None],
+        max_bytes_per_result,
+        snippet_config["max_bytes_per_response"],
+    )
+    it = iter(bounded)
+    return [None if row is None else (row[0], next(it)) for row in found]
+
+
+def two_stage_enabled() -> bool:
+    from codebase.config import CONFIG
+
+    return bool(CONFIG["matryoshka"]["enabled"])
+
+
+def dedup_enabled() -> bool:
+    from codebase.config import CONFIG
+
+    return bool(CONFIG["dedup"]["enabled"])
+
+
+def custom_default_sql() -> str | None:
+    """pgvector.default_sql when the user changed the shipped one, else None."""
+    from codebase.config import CONFIG, DEFAULT_PGVECTOR_SQL
+
+    sql = CONFIG["pgvector"].get("default_sql")
+    if not sql or sql.split() == DEFAULT_PGVECTOR_SQL.split():
+        return None
+    return sql
+
+
+def directory_search_enabled() -> bool:
+    from codebase.config import CONFIG
+
+    return bool(CONFIG["directory_index"]["enabled"])
+
+
+def ef_search_for(rows: int) -> int | None:
+    """hnsw.ef_search that lets the index return rows rows, None when the default does."""
+    if rows <= DEFAULT_EF_SEARCH:
+        return None
+    return min(rows, MAX_EF_SEARCH)
+
+
+def search_top_k(
+    pgvector_connector,
+    embedding,
+    top_k: int,
+    two_stage: bool | None = None,
+    offset: int = 0,
+    max_distance: float | None = None,
+    directories: int | None = None,
+):
+    """
+    ANN top-k with a parameterized limit. With two_stage (default:
+    matryoshka.enabled in config) candidates come from the coarse index and
+    are re-scored on the full vector. With directories (default:
+    directory_index.directories when directory_index.enabled) only the files
+    of that many directories with the nearest centroids are searched; this
+    takes precedence over two_stage; directories=0 searches the whole index.
+
+    offset skips the nearest rows and max_distance drops rows farther than
+    it; the index scan stops after offset + top_k rows either way.
+    """
+    from codebase.config import CONFIG
+    from codebase.model_provider import truncate_embedding
+
+    if directories is None and directory_search_enabled():
+        directories = CONFIG["directory_index"]["directories"]
+    rows_needed = offset + top_k
+    if directories:
+        sql_params = {
+            "embedding": embedding,
+            "top_k": rows_needed,
+            "directories": directories,
+        }
+        if offset or max_distance is not None:
+            sql_params["offset"] = offset
+            sql_params["max_distance"] = max_distance
+            return pgvector_connector.execute_select(
+                PAGED_DIRECTORY_SEARCH_SQL, sql_params, prepare=True
+            )
+        return pgvector_connector.execute_select(
+            DIRECTORY_SEARCH_SQL, sql_params, prepare=True
+        )
+
+    if two_stage is None:
+        two_stage = two_stage_enabled()
+    sql, sql_params = SEARCH_SQL, {"embedding": embedding, "top_k": rows_needed}
+    if two_stage:
+        matryoshka_config = CONFIG["matryoshka"]
+        rows_needed = max(rows_needed, matryoshka_config["candidates"])
+        sql = TWO_STAGE_SEARCH_SQL
+        sql_params["candidates"] = rows_needed
+        sql_params["embedding_coarse"] = truncate_embedding(
+            embedding, matryoshka_config["coarse_dim"]
+        )
+    if offset or max_distance is not None:
+        sql = PAGED_TWO_STAGE_SEARCH_SQL if two_stage else PAGED_SEARCH_SQL
+        sql_params["offset"] = offset
+        sql_params["max_distance"] = max_distance
+    return pgvector_connector.execute_select(
+        sql, sql_params, prepare=True, ef_search=ef_search_for(rows_needed)
+    )
+
+
+def batch_search(
+    pgvector_connector, embeddings, top_k: int = 10
+) -> list[list[tuple[str, float]]]:
+    """
+    Run top-k search for every row of embeddings in a single SQL round trip.
+
+    :return: for each query (in input order) a list of (file_path, distance)
+    :raises SearchError: when the statement fails, rather than reporting
+                         every query as having no results
+    """
+    results: list[list[tuple[str, float]]] = [[] for _ in range(len(embeddings))]
+    if len(embeddings) == 0:
+        return results
+    result = pgvector_connector.execute_select(
+        BATCH_SEARCH_SQL,
+        {"embeddings": list(embeddings), "top_k": top_k},
+        prepare=True,
+        ef_search=ef_search_for(top_k),
+    )
+    if not result:
+        raise SearchError("batch search query failed")
+    _, records = result
+    for query_number, file_path, distance in records:
+        results[query_number - 1].append((file_path, distance))
+    return results
+
+
+def read_queries_file(path: str) -> list[dict]:
+    """
+    Read JSONL queries. Each line is either an object with a "query" field
+    (other fields are echoed back) or a bare JSON string.
+    """
+    import json
     import sys
-    from tabulate import tabulate
 
-    if len(args.dbname) > 0:
-        from codebase.pgvector import CONFIG
+    file = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        queries = []
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            queries.append(item if isinstance(item, dict) else {"query": item})
+        return queries
+    finally:
+        if file is not sys.stdin:
+            file.close()
 
-        CONFIG["pgvector"]["dbname"] = args.dbname
 
-    sql_params: dict = {}
+def run_batch(pgvector_connector, model, queries: list[str], top_k: int) -> list:
+    """Embed all queries with one encode_batch call and search them in one statement."""
+    embeddings = model.encode_batch(queries)
+    return batch_search(pgvector_connector, embeddings, top_k)
+
+
+def run_queries_file(args: Namespace):
+    import json
+    import sys
+
+    queries = read_queries_file(args.queries_file)
+    if any(not item.get("query") for item in queries):
+        print("ERROR: Every line of the queries file needs a non-empty \"query\".")
+        exit(1)
+    texts = [item["query"] for item in queries]
+
+    from codebase.daemon import DaemonError
 
-    if "%(embedding)s" in args.sql:
-        if len(args.query_text) == 0:
+    results = None
+    try:
+        if not args.no_daemon:
+            from codebase.daemon import daemon_request
+
+            results = daemon_request(
+                "batch_search",
+                {"queries": texts, "top_k": args.top_k, "dbname": args.dbname},
+            )
+        if results is None:
             print(
-                "ERROR: Query text must be provided when using embedding search. See `codebase search -h`."
+                f"Converting {len(queries)} queries to embeddings...", file=sys.stderr
+            )
+            from codebase.model_provider import get_embedding_model
+            from codebase.pgvector import PGVectorConnector
+
+            results = run_batch(
+                PGVectorConnector(), get_embedding_model(), texts, args.top_k
             )
-            exit(1)
+    except (SearchError, DaemonError) as error:
+        print(f"ERROR: {error}", file=sys.stderr)
+        exit(1)
+
+    for item, hits in zip(queries, results):
+        item["results"] = [
+            {"file_path": file_path, "distance": distance}
+            for file_path, distance in hits
+        ]
+        print(json.dumps(item, ensure_ascii=False))
+
+
+def parse_like(spec: str) -> tuple[str, int | None]:
+    """
+    Split ``path[:line]`` and make path relative to the working directory
+    like the indexed paths.
+    """
+    import os
+
+    path, line = spec, None
+    head, separator, tail = spec.rpartition(":")
+    if separator and tail.isdigit():
+        path, line = head, int(tail)
+    if os.path.isabs(path):
+        path = os.path.relpath(path)
+    return os.path.normpath(path), line
+
+
+def search_like(pgvector_connector, spec: str, top_k: int = 10):
+    """
+    ANN search around the stored embedding of a file (or its chunk at a
+    line), or around the mean embedding of the files under a directory.
+    The source files are left out of the results. No model is called.
+
+    :return: (source file paths, [(file_path, distance)]), or (None, None)
+             when nothing under spec is indexed
+    """
+    path, line = parse_like(spec)
+    _, rows = pgvector_connector.execute_select(
+        LIKE_FILE_SQL, {"path": path, "line": line or 1}, prepare=True
+    ) or (None, [])
+    if rows:
+        sources, embedding = [rows[0][0]], rows[0][1]
+        if embedding is None:
+            _, rows = pgvector_connector.execute_select(
+                DUPLICATE_OF_SQL, {"path": path}
+            ) or (None, [])
+            if not rows or rows[0][0] is None:
+                return None, None
+            embedding = rows[0][0]
+    else:
+        prefix = "" if path == "." else path.rstrip("/") + "/"
+        _, rows = pgvector_connector.execute_select(
+            LIKE_DIRECTORY_SQL, {"prefix": prefix}
+        ) or (None, [])
+        if not rows or rows[0][0] is None:
+            return None, None
+        sources, embedding = rows[0]
+
+    # Ask for enough rows that top_k remain once the sources are dropped;
+    # a directory of more than MAX_EF_SEARCH files can leave fewer
+    excluded = set(sources)
+    _, records = search_top_k(
+        pgvector_connector, embedding, min(top_k + len(excluded), MAX_EF_SEARCH)
+    ) or (None, [])
+    similar = [
+        (file_path, distance)
+        for file_path, distance in records
+        if file_path not in excluded
+    ]
+    return sources, similar[:top_k]
+
+
+def directory_groups(records: list) -> dict[str, list[int]]:
+    """
+    Positions of the records (first column file_path) by the directory of
+    the file ("" for the top level), directories in order of their best
+    result.
+    """
+    import os
+
+    groups: dict[str, list[int]] = {}
+    for i, record in enumerate(records):
+        directory = os.path.dirname(record[0])
+        groups.setdefault(directory + "/" if directory else "", []).append(i)
+    return groups
+
+
+def format_snippet(file_path: str, start_line: int, snippet: str) -> str:
+    if not snippet:
+        return ""
+    end_line = start_line + snippet.count("\n")
+    return f"==> {file_path}:{start_line}-{end_line}\n{snippet}\n"
+
+
+def needs_embedding(options: dict) -> bool:
+    sql = options["sql"]
+    return options["rerank"] or sql is None or "%(embedding)s" in sql
+
+
+def run_search(pgvector_connector, load_model, options: dict):
+    """
+    Execute one `codebase search`. options holds the search arguments
+    (query_text, sql, rerank, top_k, snippets, snippet_lines and an optional
+    limit on the rows); load_model returns the embedding model and is only
+    called when an embedding is needed. A failed query gives no rows, the
+    connector prints its error.
+
+    :return: (column_names, records, snippet blocks)
+    """
+    import sys
+
+    sql_params: dict = {}
+    sql = options["sql"] if options["sql"] is not None else DEFAULT_SQL
+    # Without a custom --sql the configured search strategy is used
+    configured = options["sql"] is None and (
+        two_stage_enabled() or directory_search_enabled()
+    )
+
+    if needs_embedding(options):
         print("Converting query text to embedding...", file=sys.stderr)
-        from codebase.model_provider import EMBEDDING_MODEL
+        sql_params["embedding"] = load_model().encode(options["query_text"])
 
-        user_query_embedding = EMBEDDING_MODEL.encode(args.query_text)
-        sql_params["embedding"] = user_query_embedding
+    if options["rerank"]:
+        from codebase.config import CONFIG
+        from codebase.rerank import get_reranker, rerank_records
+
+        # --sql is ignored, the reranker needs more candidates than it returns
+        _, candidates = search_top_k(
+            pgvector_connector, sql_params["embedding"], CONFIG["rerank"]["candidates"]
+        ) or (None, [])
+        records = rerank_records(
+            pgvector_connector,
+            get_reranker(),
+            options["query_text"],
+            candidates,
+            options["top_k"],
+        )
+        column_names = ["file_path", "distance", "score"]
+    elif configured:
+        column_names, records = search_top_k(
+            pgvector_connector, sql_params["embedding"], 10
+        ) or (None, [])
+    else:
+        column_names, records = pgvector_connector.execute_select(
+            sql, sql_params
+        ) or (None, [])
+    if options.get("limit") is not None:
+        # Before the snippets, which are fetched for the printed rows only
+        records = records[: options["limit"]]
+
+    snippet_blocks = []
+    if options["snippets"] and records:
+        # The first column of the result is expected to be file_path
+        file_paths = [record[0] for record in records]
+        snippets = fetch_bounded_snippets(
+            pgvector_connector, file_paths, options["snippet_lines"]
+        )
+        snippet_blocks = [
+            format_snippet(file_path, *snippet)
+            for file_path, snippet in zip(file_paths, snippets)
+            if snippet is not None and snippet[1]
+        ]
+    return column_names, records, snippet_blocks
+
+
+# table buffers every row to align the columns, the others stream
+OUTPUT_FORMATS = ["table", "jsonl", "json", "tsv"]
+
+
+def stream_search(
+    pgvector_connector, load_model, options: dict, batch_size: int = 500
+):
+    """
+    Like run_search, but rows come as an iterator of batches. A custom --sql
+    runs in a server-side cursor, so memory does not grow with the result
+    set. Rerank, two-stage and directory results are small and returned in
+    one batch.
+
+    :return: (column_names, batches of rows)
+    """
+    if options["rerank"] or (
+        options["sql"] is None and (two_stage_enabled() or directory_search_enabled())
+    ):
+        column_names, records, _ = run_search(
+            pgvector_connector, load_model, {**options, "snippets": False}
+        )
+        return column_names, iter([records])
+
+    import sys
+
+    sql = options["sql"] if options["sql"] is not None else DEFAULT_SQL
+    sql_params = {}
+    if needs_embedding(options):
+        print("Converting query text to embedding...", file=sys.stderr)
+        sql_params["embedding"] = load_model().encode(options["query_text"])
+    batches = pgvector_connector.iter_select(sql, sql_params, batch_size)
+    return next(batches), batches
 
-    from codebase.pgvector import PGVectorConnector
 
-    pgvector_connector = PGVectorConnector()
-    column_names, records = pgvector_connector.execute_select(args.sql, sql_params)
-    print(
-        tabulate(
-            records,
-            headers=column_names if column_names is not None else (),
-            tablefmt="plain",
+def limit_batches(batches, limit: int | None):
+    """Stop after limit rows, closing batches (and its cursor)."""
+    try:
+        remaining = limit
+        for rows in batches:
+            if remaining is not None:
+                rows = rows[:remaining]
+                remaining -= len(rows)
+            if rows:
+                yield rows
+            if remaining is not None and remaining <= 0:
+                return
+    finally:
+        if hasattr(batches, "close"):
+            batches.close()
+
+
+def attach_snippets(pgvector_connector, batches, lines: int | None):
+    """Append (start_line, snippet) to every row; the first column must be file_path."""
+    for rows in batches:
+        snippets = fetch_bounded_snippets(
+            pgvector_connector, [row[0] for row in rows], lines
         )
+        yield [
+            (*row, *(snippet if snippet is not None else (None, None)))
+            for row, snippet in zip(rows, snippets)
+        ]
+
+
+def _vector_list(value) -> list | None:
+    # pgvector columns arrive as numpy arrays, or as Vector objects from a
+    # server-side cursor
+    if hasattr(value, "to_list"):
+        return value.to_list()
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return None
+
+
+def json_value(value):
+    """json.dumps default: vectors as lists, anything else as its string."""
+    vector = _vector_list(value)
+    return vector if vector is not None else str(value)
+
+
+def _tsv_field(value) -> str:
+    """PostgreSQL COPY text format: \\N for NULL, backslash escapes."""
+    if value is None:
+        return "\\N"
+    vector = _vector_list(value)
+    if vector is not None:
+        return "[" + ",".join(map(str, vector)) + "]"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
     )
+
+
+def write_rows(file, output_format: str, column_names: list[str], batches):
+    """Write rows in a streaming format, flushing after every batch."""
+    import json
+
+    if output_format == "tsv":
+        file.write("\t".join(column_names) + "\n")
+    elif output_format == "json":
+        file.write("[")
+    separator = "\n"
+    for rows in batches:
+        for row in rows:
+            if output_format == "tsv":
+                file.write("\t".join(map(_tsv_field, row)) + "\n")
+                continue
+            line = json.dumps(
+                dict(zip(column_names, row)), ensure_ascii=False, default=json_value
+            )
+            if output_format == "json":
+                file.write(separator + line)
+                separator = ",\n"
+            else:
+                file.write(line + "\n")
+        file.flush()
+    if output_format == "json":
+        file.write("\n]\n" if separator != "\n" else "]\n")
+    file.flush()
+
+
+def stream_main(args: Namespace, options: dict):
+    """`codebase search --format jsonl|json|tsv`"""
+    import sys
+
+    if len(args.dbname) > 0:
+        from codebase.pgvector import CONFIG
+
+        CONFIG["pgvector"]["dbname"] = args.dbname
+
+    from codebase.pgvector import PGVectorConnector
+
+    def load_model():
+        # Only the query embedding comes from a running `codebase serve`,
+        # the rows are streamed from this process's own connection.
+        if not args.no_daemon:
+            from codebase.daemon import DaemonModel, daemon_request
+
+            if daemon_request("ping", {}) is not None:
+                return DaemonModel()
+        from codebase.model_provider import get_embedding_model
+
+        return get_embedding_model()
+
+    import psycopg
+
+    connector = PGVectorConnector()
+    try:
+        column_names, batches = stream_search(connector, load_model, options)
+        batches = limit_batches(batches, args.limit)
+        if options["snippets"]:
+            batches = attach_snippets(connector, batches, options["snippet_lines"])
+            column_names = [*column_names, "start_line", "snippet"]
+        write_rows(sys.stdout, args.format, column_names or [], batches)
+    except BrokenPipeError:
+        # e.g. `| head`: stop reading rows
+        batches.close()
+    except psycopg.Error as error:
+        # A bad --sql: an error message like the table output, no traceback
+        print(f"ERROR: {error}", file=sys.stderr)
+        exit(1)
+
+
+def like_main(args: Namespace):
+    """`codebase search --like path[:line]`"""
+    import sys
+
+    from tabulate import tabulate
+
+    if len(args.dbname) > 0:
+        from codebase.pgvector import CONFIG
+
+        CONFIG["pgvector"]["dbname"] = args.dbname
+
+    from codebase.pgvector import PGVectorConnector
+
+    connector = PGVectorConnector()
+    sources, records = search_like(connector, args.like, args.top_k)
+    if sources is None:
+        print(f"ERROR: {args.like} is not indexed.")
+        exit(1)
+    if args.limit is not None:
+        records = records[: args.limit]
+    column_names = ["file_path", "distance"]
+
+    output_format = getattr(args, "format", "table")
+    if output_format != "table":
+        batches = iter([records])
+        if args.snippets:
+            batches = attach_snippets(connector, batches, args.snippet_lines)
+            column_names = [*column_names, "start_line", "snippet"]
+        write_rows(sys.stdout, output_format, column_names, batches)
+        return
+
+    print(tabulate(records, headers=column_names, tablefmt="plain"))
+    if args.snippets and records:
+        file_paths = [record[0] for record in records]
+        snippets = fetch_bounded_snippets(connector, file_paths, args.snippet_lines)
+        for file_path, snippet in zip(file_paths, snippets):
+            if snippet is not None and snippet[1]:
+                print()
+                print(format_snippet(file_path, *snippet), end="")
+
+
+def main(args: Namespace):
+    from tabulate import tabulate
+
+    if getattr(args, "like", ""):
+        like_main(args)
+        return
+
+    if args.queries_file:
+        if len(args.dbname) > 0:
+            from codebase.pgvector import CONFIG
+
+            CONFIG["pgvector"]["dbname"] = args.dbname
+        run_queries_file(args)
+        return
+
+    options = {
+        "dbname": args.dbname,
+        "query_text": args.query_text,
+        "sql": args.sql,
+        "rerank": args.rerank,
+        "top_k": args.top_k,
+        "snippets": args.snippets,
+        "snippet_lines": args.snippet_lines,
+        "limit": getattr(args, "limit", None),
+    }
+    if needs_embedding(options) and len(args.query_text) == 0:
+        print(
+            "ERROR: Query text must be provided when using embedding search. See `codebase search -h`."
+        )
+        exit(1)
+
+    output_format = getattr(args, "format", "table")
+    if output_format != "table":
+        stream_main(args, options)
+        return
+
+    # A running `codebase serve` has the model loaded and the database
+    # connected already, otherwise everything is set up in this process.
+    result = None
+    if not args.no_daemon:
+        from codebase.daemon import daemon_request
+
+        result = daemon_request("search", options)
+    if result is not None:
+        column_names, records, snippet_blocks = result
+    else:
+        if len(args.dbname) > 0:
+            from codebase.pgvector import CONFIG
+
+            CONFIG["pgvector"]["dbname"] = args.dbname
+
+        from codebase.model_provider import get_embedding_model
+        from codebase.pgvector import PGVectorConnector
+
+        column_names, records, snippet_blocks = run_search(
+            PGVectorConnector(), get_embedding_model, options
+        )
+
+    if getattr(args, "group_by_directory", False) and records:
+        for n, (directory, positions) in enumerate(
+            directory_groups(records).items()
+        ):
+            if n:
+                print()
+            print(f"{directory or './'} ({len(positions)})")
+            print(
+                tabulate(
+                    [records[i] for i in positions],
+                    headers=column_names if column_names is not None else (),
+                    tablefmt="plain",
+                )
+            )
+    else:
+        print(
+            tabulate(
+                records,
+                headers=column_names if column_names is not None else (),
+                tablefmt="plain",
+            )
+        )
+    for snippet_block in snippet_blocks:
+        print()
+        print(snippet_block, end="")
@@ -5,12 +5,20 @@ def remove_header_junk(file_content: str, language: Language) -> str:
     """
     Chunk策略: 使用 Tree-sitter 移除文件开头的所有注释和 #include 语句。
     """
+    return strip_header(file_content, language)[0]
+
+
+def strip_header(file_content: str, language: Language) -> tuple[str, int]:
+    """
+    与 remove_header_junk 相同，但同时返回剩余代码在原文件中的起始行号（从 1 开始）。
+    """
     parser = Parser(language)
 
-    tree = parser.parse(bytes(file_content, "utf8"))
+    content_bytes = bytes(file_content, "utf8")
+    tree = parser.parse(content_bytes)
     root_node = tree.root_node
 
-    first_code_node_start = None
+    first_code_node = None
 
     # 遍历根节点的所有子节点
     for node in root_node.children:
@@ -20,15 +28,17 @@ def remove_header_junk(file_content: str, language: Language) -> str:
 
         # 寻找第一个非注释、非 #include 预处理、非import指令的节点
         if node.type not in ["comment", "preproc_include", "import_statement", "import_from_statement"]:
-            first_code_node_start = node.start_byte
+            first_code_node = node
             break
 
     # 如果没有找到任何代码节点，则返回空字符串
-    if first_code_node_start is None:
-        return ""
+    if first_code_node is None:
+        return "", 1
 
     # 从第一个代码节点开始切片，去除前面的所有内容
-    return file_content[first_code_node_start:].strip()
+    # start_byte 是字节偏移，文件头含中文注释时不能直接用于切片 str
+    code = content_bytes[first_code_node.start_byte :].decode("utf8").strip()
+    return code, first_code_node.start_point[0] + 1
 
 
 # --- 示例用法 ---
@@ -0,0 +1,162 @@
+"""
+Long inputs: count tokens before embedding, split inputs that exceed the
+model's maximum sequence length into overlapping windows, embed all windows
+in one batch and pool them back into one vector per input.
+"""
+
+from pathlib import Path
+import numpy as np
+from codebase.model_provider import EmbeddingError, ModelProvider, l2_normalize
+
+
+class TokenCounter:
+    """
+    Token offsets from the model's ``tokenizer.json`` (HF ``tokenizers``, no
+    model weights). Without a tokenizer every 4 characters count as a token.
+    """
+
+    # Characters per token when no tokenizer is available
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self, tokenizer_path: str | Path | None = None):
+        self.tokenizer = None
+        if tokenizer_path is not None and Path(tokenizer_path).is_file():
+            try:
+                from tokenizers import Tokenizer
+            except ImportError:
+                return
+            self.tokenizer = Tokenizer.from_file(str(tokenizer_path))
+            self.tokenizer.no_truncation()
+            self.tokenizer.no_padding()
+
+    @classmethod
+    def for_model(cls, model_name_or_path: str, tokenizer_path: str | None = None):
+        """Use tokenizer_path, else ``tokenizer.json`` next to a local model."""
+        if tokenizer_path is None:
+            tokenizer_path = Path(model_name_or_path) / "tokenizer.json"
+        return cls(tokenizer_path)
+
+    def offsets(self, text: str) -> list[tuple[int, int]]:
+        """(start, end) character offsets of every token."""
+        if self.tokenizer is None:
+            step = self.CHARS_PER_TOKEN
+            return [(i, min(i + step, len(text))) for i in range(0, len(text), step)]
+        return self.tokenizer.encode(text, add_special_tokens=False).offsets
+
+
+class WindowStats:
+    """How many inputs needed windowing during a run."""
+
+    def __init__(self):
+        self.inputs: int = 0
+        # inputs longer than max_tokens, embedded as several windows
+        self.split: int = 0
+        self.windows: int = 0
+        # inputs longer than max_windows windows, the tail was dropped
+        self.truncated: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.inputs} inputs, {self.split} split into {self.windows} windows, "
+            f"{self.truncated} truncated"
+        )
+
+
+class Windower:
+    """
+    Splits inputs longer than ``max_tokens`` into windows of ``max_tokens``
+    tokens that overlap by ``overlap`` tokens, at most ``max_windows`` per
+    input, and pools the window embeddings by token-weighted mean.
+    """
+
+    def __init__(
+        self,
+        counter: TokenCounter,
+        max_tokens: int = 8192,
+        overlap: int = 256,
+        max_windows: int = 16,
+    ):
+        if not 0 <= overlap < max_tokens:
+            raise ValueError("overlap must be smaller than max_tokens")
+        self.counter: TokenCounter = counter
+        self.max_tokens: int = max_tokens
+        self.overlap: int = overlap
+        self.max_windows: int = max_windows
+        self.stats = WindowStats()
+
+    def split(self, text: str) -> list[tuple[str, int]]:
+        """
+        Return the (window text, token count) pairs of text. Short inputs are
+        not tokenized, their UTF-8 length is used as the count.
+        """
+        self.stats.inputs += 1
+        # Cheap upper bound first: every token covers at least one byte
+        byte_length = len(text.encode("utf8"))
+        if byte_length <= self.max_tokens:
+            return [(text, max(1, byte_length))]
+        offsets = self.counter.offsets(text)
+        if len(offsets) <= self.max_tokens:
+            return [(text, max(1, len(offsets)))]
+
+        stride = self.max_tokens - self.overlap
+        windows = []
+        for start in range(0, len(offsets), stride):
+            if len(windows) == self.max_windows:
+                self.stats.truncated += 1
+                break
+            end = min(start + self.max_tokens, len(offsets))
+            windows.append(
+                (text[offsets[start][0] : offsets[end - 1][1]], end - start)
+            )
+            if end == len(offsets):
+                break
+        self.stats.split += 1
+        self.stats.windows += len(windows)
+        return windows
+
+    def encode_batch(self, model: ModelProvider, texts: list[str]) -> np.ndarray:
+        """
+        Embed texts with one ``model.encode_batch`` call over all windows and
+        pool each text's windows back into one vector.
+
+        An EmbeddingError is re-raised with indices of texts instead of windows.
+        """
+        windows = [self.split(text) for text in texts]
+        flat = [window for text_windows in windows for window, _ in text_windows]
+        try:
+            embeddings = model.encode_batch(flat)
+        except EmbeddingError as e:
+            owners = [i for i, text_windows in enumerate(windows) for _ in text_windows]
+            errors: dict[int, str] = {}
+            for window, error in e.errors.items():
+                errors.setdefault(owners[window], error)
+            pooled = None
+            if e.embeddings is not None:
+                # NaN windows make the pooled vector NaN
+                pooled = self._pool(windows, e.embeddings)
+            raise EmbeddingError(str(e), errors, pooled) from e
+        if all(len(text_windows) == 1 for text_windows in windows):
+            return embeddings
+        return self._pool(windows, embeddings)
+
+    def _pool(
+        self, windows: list[list[tuple[str, int]]], embeddings: np.ndarray
+    ) -> np.ndarray:
+        pooled = []
+        start = 0
+        for text_windows in windows:
+            end = start + len(text_windows)
+            weights = np.array([tokens for _, tokens in text_windows], np.float32)
+            pooled.append(pool_windows(embeddings[start:end], weights))
+            start = end
+        return np.ascontiguousarray(np.stack(pooled), dtype=np.float32)
+
+    def encode(self, model: ModelProvider, text: str) -> np.ndarray:
+        return self.encode_batch(model, [text])[0]
+
+
+def pool_windows(embeddings: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Token-weighted mean of window embeddings, L2-normalized."""
+    if len(embeddings) == 1:
+        return embeddings[0]
+    return l2_normalize(np.average(embeddings, axis=0, weights=weights))
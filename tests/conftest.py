@@ -47,7 +47,8 @@ def setup_test_database():
             # Create tables with pgvector extension
             subprocess.run([
                 "psql", "-h", "127.0.0.1", "-p", "5439", "-U", "postgres", 
-                "-d", "codebase_test", "-f", "create_tables.sql", "-v", "dim=1024"
+                "-d", "codebase_test", "-f", "create_tables.sql", "-v", "dim=1024",
+                "-v", "directory_depth=2"
             ], check=True)
             print("Test database 'codebase_test' created successfully")
         
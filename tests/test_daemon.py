@@ -0,0 +1,116 @@
+import threading
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from codebase.daemon import DaemonError, DaemonServer, DaemonState, daemon_request
+
+
+@pytest.fixture
+def daemon(tmp_path, mocker):
+    """在临时 socket 上启动守护进程，模型与数据库均为 mock"""
+    model = Mock()
+    model.encode.return_value = np.zeros(4, dtype=np.float32)
+    model.encode_batch.return_value = np.zeros((2, 4), dtype=np.float32)
+    connector = Mock()
+    connector.execute_select.return_value = (
+        ["file_path", "distance"],
+        [("a.py", 0.1)],
+    )
+    state = DaemonState(model)
+    mocker.patch.object(state, "connector", return_value=connector)
+
+    socket_path = tmp_path / "codebase.sock"
+    server = DaemonServer(socket_path, state)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield socket_path, model, connector
+    server.shutdown()
+    server.server_close()
+
+
+def test_daemon_search_round_trip(daemon):
+    """测试通过守护进程执行搜索"""
+    socket_path, model, connector = daemon
+    options = {
+        "dbname": "",
+        "query_text": "open database",
+        "sql": None,
+        "rerank": False,
+        "top_k": 10,
+        "snippets": False,
+        "snippet_lines": None,
+    }
+
+    result = daemon_request("search", options, socket_path)
+
+    assert result == [["file_path", "distance"], [["a.py", 0.1]], []]
+    model.encode.assert_called_once_with("open database")
+
+
+def test_daemon_batch_search(daemon):
+    """测试批量查询只调用一次 encode_batch"""
+    socket_path, model, connector = daemon
+    connector.execute_select.return_value = (
+        ["ord", "file_path", "distance"],
+        [(1, "a.py", 0.1), (2, "b.py", 0.2)],
+    )
+
+    result = daemon_request(
+        "batch_search", {"queries": ["q1", "q2"], "top_k": 1, "dbname": ""}, socket_path
+    )
+
+    assert result == [[["a.py", 0.1]], [["b.py", 0.2]]]
+    model.encode_batch.assert_called_once_with(["q1", "q2"])
+
+
+def test_daemon_model_encodes_in_daemon(daemon):
+    """测试 DaemonModel 通过守护进程生成查询向量"""
+    from codebase.daemon import DaemonModel
+
+    socket_path, model, _ = daemon
+    model.encode.return_value = np.array([0.5, 1.0], dtype=np.float32)
+
+    embedding = DaemonModel(socket_path).encode("open database")
+
+    np.testing.assert_array_equal(embedding, [0.5, 1.0])
+    assert embedding.dtype == np.float32
+    model.encode.assert_called_once_with("open database")
+
+
+def test_daemon_unknown_method(daemon):
+    """测试未知方法返回错误"""
+    socket_path, _, _ = daemon
+
+    with pytest.raises(DaemonError, match="unknown method"):
+        daemon_request("reindex", {}, socket_path)
+
+
+def test_daemon_request_without_daemon(tmp_path):
+    """测试没有守护进程时返回 None，由调用方在本进程内执行"""
+    assert daemon_request("ping", {}, tmp_path / "missing.sock") is None
+
+    stale = tmp_path / "stale.sock"
+    stale.touch()
+    assert daemon_request("ping", {}, stale) is None
+
+
+def test_daemon_refuses_other_configuration(daemon, mocker, monkeypatch):
+    """测试另一项目的配置使用另一个 socket；连接到配置不同的守护进程时返回 None，由调用方在本进程内执行"""
+    from codebase.config import CONFIG
+    from codebase.daemon import default_socket_path
+
+    socket_path, model, _ = daemon
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(socket_path.parent))
+    mocker.patch.dict(CONFIG["daemon"], {"socket": None})
+    default_path = default_socket_path()
+    # 只有数据库名不同时共用守护进程，请求中带有数据库名
+    mocker.patch.dict(CONFIG["pgvector"], {"dbname": "other_db"})
+    assert default_socket_path() == default_path
+
+    mocker.patch.dict(CONFIG, {"model": "/other/project/model"})
+
+    assert default_socket_path() != default_path
+    assert daemon_request("search", {"query_text": "open database"}, socket_path) is None
+    model.encode.assert_not_called()
@@ -0,0 +1,111 @@
+from unittest.mock import Mock
+
+import pytest
+
+from codebase.dedup import (
+    MAX_DISTANCE,
+    Deduplicator,
+    NearDuplicateIndex,
+    bands,
+    hamming_distance,
+    simhash,
+)
+
+
+def source(name: str) -> str:
+    return "".join(
+        f"def {name}_{i}(request, limit={i % 7}):\n"
+        f"    return request.get('key_{i}', {i * 31 % 97}) + limit\n"
+        for i in range(200)
+    )
+
+
+def test_simhash_near_copies_are_close_and_other_code_is_not():
+    """A copy with one changed constant stays within MAX_DISTANCE bits,
+    unrelated code does not; fingerprints are stable signed 64-bit ints"""
+    original = source("parse")
+    fingerprint = simhash(original)
+
+    assert simhash(original) == fingerprint
+    assert -(1 << 63) <= fingerprint < 1 << 63
+    edited = original.replace("limit=0", "limit=5", 1)
+    assert hamming_distance(fingerprint, simhash(edited)) <= MAX_DISTANCE
+    other = "".join(
+        f"class Model{i}(Base):\n    table = 'model_{i}'\n    size = {i * 13 % 41}\n"
+        for i in range(200)
+    )
+    assert hamming_distance(fingerprint, simhash(other)) > MAX_DISTANCE
+
+
+def test_simhash_skips_short_texts():
+    """Texts with fewer than min_tokens tokens get no fingerprint"""
+    assert simhash("x = 1", min_tokens=64) is None
+    assert simhash("x = 1") is not None
+
+
+def test_bands_match_sql_index_expressions():
+    """The bands of a negative fingerprint equal (simhash >> n) & 65535 in SQL"""
+    fingerprint = -0x0123456789ABCDEF
+    assert bands(fingerprint) == tuple(
+        (fingerprint >> shift) & 65535 for shift in (48, 32, 16, 0)
+    )
+
+
+def test_near_duplicate_index_finds_closest_representative():
+    """find() returns the closest representative within max_distance"""
+    index = NearDuplicateIndex(max_distance=2)
+    index.add("far.py", 0b111)
+    index.add("near.py", 0b1)
+
+    assert index.find(0b1) == "near.py"
+    assert index.find(0b1111000) is None
+    index.discard("near.py")
+    assert index.find(0b1) == "far.py"
+    with pytest.raises(ValueError):
+        NearDuplicateIndex(max_distance=MAX_DISTANCE + 1)
+
+
+def test_deduplicator_links_to_stored_and_earlier_representatives():
+    """Files link to a stored representative or to an earlier file of the
+    run; a re-indexed file is not its own representative"""
+    original = source("parse")
+    stored = simhash(original, 0)
+    updater = Mock()
+    updater.find_representatives.return_value = [("vendor/a.py", stored)]
+    deduplicator = Deduplicator(min_tokens=0)
+
+    fingerprints, duplicates = deduplicator.assign(
+        updater,
+        [
+            ("vendor/a.py", original),
+            ("copy/a.py", original),
+            ("other.py", source("render")),
+            ("copy/b.py", source("render")),
+        ],
+    )
+
+    assert fingerprints[0] == stored
+    assert duplicates == {1: "vendor/a.py", 3: "other.py"}
+    assert deduplicator.linked == 2
+    updater.find_representatives.assert_called_once()
+    assert updater.find_representatives.call_args.args[1] == [
+        "vendor/a.py", "copy/a.py", "other.py", "copy/b.py"
+    ]
+
+
+def test_deduplicator_prefers_fingerprints_of_this_run():
+    """A file re-indexed earlier in the run keeps its new fingerprint when
+    the database still returns its old one"""
+    original, rewritten = source("parse"), source("render")
+    updater = Mock()
+    updater.find_representatives.return_value = []
+    deduplicator = Deduplicator(min_tokens=0)
+    deduplicator.assign(updater, [("a.py", rewritten)])
+
+    # Not flushed yet: the stored row has the old content
+    updater.find_representatives.return_value = [("a.py", simhash(original))]
+    _, duplicates = deduplicator.assign(
+        updater, [("copy.py", original), ("other.py", rewritten)]
+    )
+
+    assert duplicates == {1: "a.py"}
@@ -0,0 +1,81 @@
+from unittest.mock import Mock
+
+import numpy as np
+
+from codebase.evaluation import mark_pareto_frontier, recall, run_eval
+
+
+def test_recall():
+    """测试 recall 为期望结果中被找到的比例"""
+    assert recall(["a", "b", "x"], ["a", "b", "c", "d"]) == 0.5
+    assert recall([], []) == 1.0
+
+
+def test_mark_pareto_frontier():
+    """测试被其它设置在召回率和延迟上同时支配的设置不在 Pareto 前沿上"""
+    results = [
+        {"recall@k": 1.0, "p50_ms": 10.0},
+        {"recall@k": 0.9, "p50_ms": 1.0},
+        # 召回率更低且更慢
+        {"recall@k": 0.8, "p50_ms": 2.0},
+        # 与第二个相同，互不支配
+        {"recall@k": 0.9, "p50_ms": 1.0},
+    ]
+
+    mark_pareto_frontier(results)
+
+    assert [r["pareto"] for r in results] == [True, True, False, True]
+
+
+def test_run_eval_compares_ann_with_exact_search():
+    """测试以关闭索引扫描的精确搜索为基准，逐个 ef_search 计算召回率"""
+    connector = Mock()
+    exact = [("a", 0.1), ("b", 0.2)]
+    ann = {10: [("a", 0.1), ("c", 0.3)], 40: exact}
+    state = {"ef_search": None}
+    connector.set_ef_search.side_effect = lambda ef: state.update(ef_search=ef)
+
+    def execute_select(sql, params, prepare=None):
+        if state["ef_search"] is None:
+            return ["file_path", "distance"], exact
+        return ["file_path", "distance"], ann[state["ef_search"]]
+
+    connector.execute_select.side_effect = execute_select
+    queries = [np.zeros(4, dtype=np.float32)] * 3
+
+    results = run_eval(connector, queries, 2, [10, 40], relevant=[["a"]] * 3)
+
+    assert [(r["mode"], r["ef_search"]) for r in results] == [
+        ("exact", None),
+        ("hnsw", 10),
+        ("hnsw", 40),
+    ]
+    assert [r["recall@k"] for r in results] == [1.0, 0.5, 1.0]
+    assert all(r["label_recall@k"] == 1.0 for r in results)
+    # 精确搜索在同一事务中关闭索引扫描，随后回滚
+    connector.cur.execute.assert_any_call("SET LOCAL enable_indexscan = off")
+    assert connector.conn.rollback.call_count == 3
+
+
+def test_run_eval_directories_sweep():
+    """测试由粗到细的目录检索按目录数逐个计算召回率"""
+    from codebase.search import DIRECTORY_SEARCH_SQL
+
+    connector = Mock()
+
+    def execute_select(sql, params, prepare=None):
+        if sql == DIRECTORY_SEARCH_SQL:
+            found = {1: [("a", 0.1)], 4: [("a", 0.1), ("b", 0.2)]}
+            return ["file_path", "distance"], found[params["directories"]]
+        return ["file_path", "distance"], [("a", 0.1), ("b", 0.2)]
+
+    connector.execute_select.side_effect = execute_select
+    queries = [np.zeros(4, dtype=np.float32)] * 2
+
+    results = run_eval(connector, queries, 2, [], directories=[1, 4])
+
+    assert [(r["mode"], r["candidates"], r["recall@k"]) for r in results] == [
+        ("exact", None, 1.0),
+        ("directories", 1, 0.5),
+        ("directories", 4, 1.0),
+    ]
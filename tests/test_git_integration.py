@@ -1,7 +1,10 @@
+import numpy as np
 import pytest
 import tempfile
 import subprocess
 import os
+import threading
+import time
 from typing import override
 from pathlib import Path
 from unittest.mock import Mock
@@ -17,13 +20,13 @@ class MockModelProvider(ModelProvider):
         self.embedding_dim = 1024
 
     @override
-    def encode(self, text: str) -> list[float]:
+    def encode(self, text: str) -> np.ndarray:
         # Simple mock embedding based on text length
-        return [float(len(text)) / 100.0] * self.embedding_dim
+        return np.full(self.embedding_dim, len(text) / 100.0, dtype=np.float32)
 
     @override
-    def encode_batch(self, texts: list[str]) -> list[list[float]]:
-        return [self.encode(text) for text in texts]
+    def encode_batch(self, texts: list[str]) -> np.ndarray:
+        return np.stack([self.encode(text) for text in texts])
 
 
 def create_test_git_repo():
@@ -326,6 +329,388 @@ def test_git_indexing_outside_repo(mock_model, mock_language_map):
             os.chdir(original_cwd)
 
 
+def test_work_queue_workers_index_blobs_and_reclaim_expired_leases(
+    test_git_repo, test_db_connector, mock_model, mock_language_map
+):
+    """Test the coordinator/worker mode: queued HEAD blobs are indexed by a
+    worker, including a job whose lease expired after its worker crashed"""
+    original_cwd = os.getcwd()
+    os.chdir(test_git_repo)
+    test_db_connector.cur.execute("DELETE FROM index_jobs")
+    test_db_connector.conn.commit()
+
+    try:
+        Indexer(None, mock_language_map).enqueue_git_changes(test_db_connector, "HEAD")
+        # Workers read the committed blob, not the working tree
+        Path("main.py").write_text("def uncommitted():\n    pass\n")
+
+        # A worker claims one job and crashes: its lease expires immediately
+        crashed = test_db_connector.claim_jobs("crashed", 1, 0, 3)
+        assert len(crashed) == 1
+
+        worker_connector = PGVectorConnector(get_test_db_config())
+        processed = Indexer(mock_model, mock_language_map, batch_size=2).process_jobs(
+            worker_connector, "worker", poll_interval=0.01
+        )
+
+        assert processed == 3
+        assert test_db_connector.count_jobs(3) == (0, 0)
+        test_db_connector.cur.execute(
+            "SELECT file_path, code_text FROM code_chunks ORDER BY file_path"
+        )
+        rows = dict(test_db_connector.cur.fetchall())
+        assert sorted(rows) == ["README.md", "main.py", "utils.py"]
+        assert "hello" in rows["main.py"]
+    finally:
+        os.chdir(original_cwd)
+        test_db_connector.cur.execute("DELETE FROM index_jobs")
+        test_db_connector.conn.commit()
+
+
+def test_work_queue_leaves_missing_blobs_to_other_workers(
+    test_git_repo, test_db_connector, mock_model, mock_language_map
+):
+    """Test that a job whose blob is not in the worker's clone is neither
+    completed nor recorded as failed, so another worker can still index it"""
+    original_cwd = os.getcwd()
+    os.chdir(test_git_repo)
+    test_db_connector.cur.execute("DELETE FROM index_jobs")
+    test_db_connector.cur.execute("DELETE FROM failed_files")
+    test_db_connector.conn.commit()
+
+    try:
+        test_db_connector.enqueue_jobs([("ghost.py", "0" * 40)])
+        worker_connector = PGVectorConnector(get_test_db_config())
+        processed = Indexer(mock_model, mock_language_map).process_jobs(
+            worker_connector, "worker", lease_seconds=0, poll_interval=0.01
+        )
+
+        assert processed == 0
+        # Still queued, until its attempts run out
+        assert test_db_connector.count_jobs(3) == (1, 1)
+        test_db_connector.cur.execute("SELECT count(*) FROM failed_files")
+        assert test_db_connector.cur.fetchone()[0] == 0
+    finally:
+        os.chdir(original_cwd)
+        test_db_connector.cur.execute("DELETE FROM index_jobs")
+        test_db_connector.conn.commit()
+
+
+def test_work_queue_leases_do_not_depend_on_worker_time_zone(test_db_connector):
+    """Test that a lease taken by a worker in one time zone still holds for
+    a worker in another one, and that one claim leases at most limit jobs"""
+    test_db_connector.cur.execute("DELETE FROM index_jobs")
+    test_db_connector.enqueue_jobs([(f"f{i}.py", None) for i in range(5)])
+    other = PGVectorConnector(get_test_db_config())
+    try:
+        test_db_connector.cur.execute("SET TimeZone = 'America/Adak'")
+        other.cur.execute("SET TimeZone = 'Pacific/Kiritimati'")
+
+        assert len(test_db_connector.claim_jobs("west", 1, 600, 3)) == 1
+        claimed = other.claim_jobs("east", 10, 600, 3)
+
+        assert [file_path for _, file_path, _ in claimed] == [
+            f"f{i}.py" for i in range(1, 5)
+        ]
+    finally:
+        other.conn.close()
+        test_db_connector.cur.execute("RESET TimeZone")
+        test_db_connector.cur.execute("DELETE FROM index_jobs")
+        test_db_connector.conn.commit()
+
+
+def test_search_like_uses_stored_embeddings(
+    test_git_repo, test_db_connector, mock_language_map
+):
+    """Test --like / find_similar: files and directories are looked up by
+    their stored embeddings, the sources are not in the results and the
+    model is never called"""
+    from codebase.search import search_like
+
+    original_cwd = os.getcwd()
+    os.chdir(test_git_repo)
+    try:
+        Indexer(MockModelProvider(), mock_language_map).process_git_changes(
+            test_db_connector, "HEAD"
+        )
+
+        sources, similar = search_like(test_db_connector, "main.py:2", top_k=5)
+        assert sources == ["main.py"]
+        assert sorted(file_path for file_path, _ in similar) == [
+            "README.md",
+            "utils.py",
+        ]
+
+        # The mean of every file under the directory, all of them excluded
+        sources, similar = search_like(
+            test_db_connector, os.path.join(test_git_repo, "")
+        )
+        assert sorted(sources) == ["README.md", "main.py", "utils.py"]
+        assert similar == []
+
+        assert search_like(test_db_connector, "missing.py") == (None, None)
+    finally:
+        os.chdir(original_cwd)
+
+
+def test_near_duplicates_share_the_representative_embedding(
+    tmp_path, test_db_connector
+):
+    """Test dedup end to end: a near-duplicate is stored without embedding
+    and linked to its representative, --like on it uses the representative's
+    embedding, and deleting the representative hands its row to the copy"""
+    from codebase.dedup import Deduplicator
+    from codebase.search import search_like
+
+    code = "".join(
+        f"def f{i}(request, limit={i % 7}):\n    return request.get('k{i}', {i * 31 % 97})\n"
+        for i in range(200)
+    )
+    original_cwd = os.getcwd()
+    os.chdir(tmp_path)
+    try:
+        original, copy = Path("original.py"), Path("copy.py")
+        original.write_text(code)
+        copy.write_text(code.replace("limit=0", "limit=5", 1))
+        test_db_connector.dedup = True
+        indexer = Indexer(MockModelProvider(), {}, deduplicator=Deduplicator())
+        indexer._index_files(test_db_connector, [original])
+        test_db_connector.flush()
+        # A later run finds the stored representative
+        indexer = Indexer(MockModelProvider(), {}, deduplicator=Deduplicator())
+        indexer._index_files(test_db_connector, [copy])
+        test_db_connector.flush()
+
+        test_db_connector.cur.execute(
+            "SELECT file_path, embedding IS NULL, duplicate_of FROM code_chunks "
+            "ORDER BY file_path"
+        )
+        assert test_db_connector.cur.fetchall() == [
+            ("copy.py", True, "original.py"),
+            ("original.py", False, None),
+        ]
+        assert test_db_connector.fetch_duplicates(["original.py"]) == {
+            "original.py": ["copy.py"]
+        }
+        sources, similar = search_like(test_db_connector, "copy.py")
+        assert sources == ["copy.py"]
+        assert [file_path for file_path, _ in similar] == ["original.py"]
+
+        test_db_connector.append_files_to_remove("original.py")
+        test_db_connector.flush()
+        test_db_connector.cur.execute(
+            "SELECT file_path, embedding IS NULL, duplicate_of, code_text "
+            "FROM code_chunks"
+        )
+        assert test_db_connector.cur.fetchall() == [
+            ("copy.py", False, None, copy.read_text())
+        ]
+    finally:
+        os.chdir(original_cwd)
+
+
+def test_rewritten_representative_releases_its_near_duplicates(
+    tmp_path, test_db_connector
+):
+    """Test that when a representative is re-indexed with other content, its
+    near-duplicates that no longer match are embedded on their own, and
+    copies of the new content link to it"""
+    from codebase.dedup import Deduplicator
+
+    def code(name):
+        return "".join(
+            f"def {name}{i}(request, limit={i % 7}):\n"
+            f"    return request.get('k{i}', {i * 31 % 97})\n"
+            for i in range(200)
+        )
+
+    original_cwd = os.getcwd()
+    os.chdir(tmp_path)
+    try:
+        test_db_connector.dedup = True
+        files = {
+            "original.py": code("f"),
+            "copy.py": code("f").replace("limit=0", "limit=5", 1),
+            "next.py": code("g").replace("limit=0", "limit=5", 1),
+        }
+        for file_path, text in files.items():
+            Path(file_path).write_text(text)
+        Indexer(MockModelProvider(), {}, deduplicator=Deduplicator())._index_files(
+            test_db_connector, [Path("original.py"), Path("copy.py")]
+        )
+        test_db_connector.flush()
+        # next.py links to original.py only once it has the new content
+        Path("original.py").write_text(code("g"))
+        Indexer(MockModelProvider(), {}, deduplicator=Deduplicator())._index_files(
+            test_db_connector, [Path("original.py"), Path("next.py")]
+        )
+        test_db_connector.flush()
+
+        test_db_connector.cur.execute(
+            "SELECT file_path, embedding IS NULL, duplicate_of FROM code_chunks "
+            "ORDER BY file_path"
+        )
+        assert test_db_connector.cur.fetchall() == [
+            ("copy.py", False, None),
+            ("next.py", True, "original.py"),
+            ("original.py", False, None),
+        ]
+    finally:
+        os.chdir(original_cwd)
+
+
+def test_directory_centroids_and_coarse_to_fine_search(test_db_connector):
+    """Test the directory index: the running file counts and embedding sums
+    follow inserts, updates and deletes of their files, and the search looks
+    at the files of the nearest directories only"""
+    from codebase.search import directory_groups, search_top_k
+
+    test_db_connector.cur.execute(
+        "SELECT to_regclass('directory_centroids') IS NOT NULL"
+    )
+    if not test_db_connector.cur.fetchone()[0]:
+        pytest.skip("test database created without -v directory_depth=2")
+    test_db_connector.cur.execute("DELETE FROM directory_centroids")
+    test_db_connector.directory_index = True
+
+    def unit(*values):
+        vector = np.zeros(1024, dtype=np.float32)
+        vector[: len(values)] = values
+        return vector
+
+    try:
+        for file_path, embedding in [
+            ("api/handlers/users.py", unit(1, 0, 0)),
+            ("api/handlers/orders.py", unit(1, 1, 0)),
+            ("api/handlers/v2/items.py", unit(1, 0.5, 0)),
+            ("db/models.py", unit(0, 0, 1)),
+            ("setup.py", unit(0, 1, 0)),
+        ]:
+            test_db_connector.append_file_chunk(file_path, "", embedding)
+        test_db_connector.flush()
+
+        test_db_connector.cur.execute(
+            "SELECT directory, files, (embedding_sum::real[])[1:3] "
+            "FROM directory_centroids ORDER BY directory"
+        )
+        rows = test_db_connector.cur.fetchall()
+        # Files deeper than directory_depth count for their ancestor
+        assert [(directory, files) for directory, files, _ in rows] == [
+            ("", 1),
+            ("api/handlers/", 3),
+            ("db/", 1),
+        ]
+        np.testing.assert_allclose(rows[1][2], [3, 1.5, 0])
+
+        _, records = search_top_k(test_db_connector, unit(1, 0.2, 0), 10, directories=1)
+        assert sorted(file_path for file_path, _ in records) == [
+            "api/handlers/orders.py",
+            "api/handlers/users.py",
+            "api/handlers/v2/items.py",
+        ]
+        assert list(directory_groups(records)) in (
+            ["api/handlers/", "api/handlers/v2/"],
+            ["api/handlers/v2/", "api/handlers/"],
+        )
+        _, records = search_top_k(
+            test_db_connector, unit(0, 0.1, 1), 1, directories=2, offset=1
+        )
+        assert records[0][0] == "setup.py"
+
+        test_db_connector.append_file_chunk("db/models.py", "", unit(0, 1, 1))
+        test_db_connector.append_files_to_remove("setup.py")
+        test_db_connector.flush()
+        test_db_connector.cur.execute(
+            "SELECT directory, files, (embedding_sum::real[])[1:3] "
+            "FROM directory_centroids ORDER BY directory"
+        )
+        rows = test_db_connector.cur.fetchall()
+        assert [(directory, files) for directory, files, _ in rows] == [
+            ("api/handlers/", 3),
+            ("db/", 1),
+        ]
+        np.testing.assert_allclose(rows[1][2], [0, 1, 1])
+    finally:
+        test_db_connector.cur.execute("DELETE FROM directory_centroids")
+        test_db_connector.conn.commit()
+
+
+def test_directory_centroids_of_concurrent_workers(test_db_connector):
+    """Test that a worker writing a file another worker is writing waits for
+    it and applies its delta on top, so the directory counts the file once"""
+    test_db_connector.cur.execute(
+        "SELECT to_regclass('directory_centroids') IS NOT NULL"
+    )
+    if not test_db_connector.cur.fetchone()[0]:
+        pytest.skip("test database created without -v directory_depth=2")
+    test_db_connector.cur.execute("DELETE FROM directory_centroids")
+    test_db_connector.conn.commit()
+    test_db_connector.directory_index = True
+    other = PGVectorConnector(get_test_db_config())
+    other.directory_index = True
+
+    def unit(*values):
+        vector = np.zeros(1024, dtype=np.float32)
+        vector[: len(values)] = values
+        return vector
+
+    try:
+        # The other worker is in the middle of writing api/new.py
+        other._lock_files(["api/new.py"])
+        test_db_connector.append_file_chunk("api/new.py", "", unit(1, 0, 0))
+        worker = threading.Thread(target=test_db_connector.flush)
+        worker.start()
+        for _ in range(100):
+            other.cur.execute("SELECT count(*) FROM pg_locks WHERE NOT granted")
+            if other.cur.fetchone()[0]:
+                break
+            time.sleep(0.05)
+        other.append_file_chunk("api/new.py", "", unit(0, 1, 0))
+        other.flush()
+        worker.join(timeout=10)
+
+        test_db_connector.cur.execute(
+            "SELECT directory, files, (embedding_sum::real[])[1:3] "
+            "FROM directory_centroids"
+        )
+        rows = test_db_connector.cur.fetchall()
+        assert [(directory, files) for directory, files, _ in rows] == [("api/", 1)]
+        np.testing.assert_allclose(rows[0][2], [1, 0, 0])
+    finally:
+        other.conn.close()
+        test_db_connector.cur.execute("DELETE FROM directory_centroids")
+        test_db_connector.conn.commit()
+
+
+def test_execute_select_ef_search_applies_to_one_query(test_db_connector):
+    """Test that ef_search raised for one query, also one that fails, is
+    restored afterwards on the reused connection"""
+    query = "SELECT current_setting('hnsw.ef_search')"
+
+    test_db_connector.set_ef_search(40)
+    _, rows = test_db_connector.execute_select(query, {}, ef_search=200)
+    assert rows == [("200",)]
+    assert test_db_connector.execute_select(query, {}) == (
+        ["current_setting"],
+        [("40",)],
+    )
+    assert test_db_connector.execute_select("SELECT 1/0", {}, ef_search=200) == []
+    assert test_db_connector.execute_select(query, {})[1] == [("40",)]
+
+
+def test_prewarm_relations(test_db_connector):
+    """Test the relations read by pg_prewarm: indexes (the HNSW index first
+    in line with the others), then the table and its TOAST table"""
+    relations = test_db_connector.prewarm_relations()
+
+    assert "code_chunks" in relations
+    assert relations.index("code_chunks") >= 2
+    assert any(relation.startswith("pg_toast.") for relation in relations)
+    blocks = test_db_connector.prewarm()
+    # None when the pg_prewarm extension is not installed
+    assert blocks is None or set(blocks) == set(relations)
+
+
 # Test database connectivity
 @pytest.mark.skipif(
     not os.environ.get("TEST_WITH_DB"),
@@ -154,3 +154,177 @@ def test_filter_ignored_files():
 
     filtered = indexer._filter_ignored_files(files, ignore_patterns)
     assert filtered == ["utils.cpp"]
+
+
+def test_index_file_with_coarse_embedding(tmp_path):
+    """测试开启 Matryoshka 时同时写入截断后的低维向量"""
+    import numpy as np
+    from codebase.indexing import Indexer
+
+    mock_model = Mock()
+    mock_model.encode_batch.return_value = np.array(
+        [[3.0, 4.0, 12.0]], dtype=np.float32
+    )
+    updater = Mock()
+    source = tmp_path / "a.txt"
+    source.write_text("hello")
+
+    Indexer(mock_model, {}, coarse_dim=2)._index_file(updater, source)
+
+    file_path, code_text, embedding, start_line, coarse = (
+        updater.append_file_chunk.call_args.args
+    )
+    assert (file_path, code_text, start_line) == (str(source), "hello", 1)
+    np.testing.assert_allclose(coarse, [0.6, 0.8], rtol=1e-6)
+
+
+def test_index_file_embedding_error_goes_to_failed_files(tmp_path):
+    """测试生成 embedding 失败时不写入空向量，而是记入 failed_files"""
+    from codebase.indexing import Indexer
+    from codebase.model_provider import EmbeddingError
+
+    mock_model = Mock()
+    mock_model.encode_batch.side_effect = EmbeddingError("HTTP 503", {0: "HTTP 503"})
+    updater = Mock()
+    source = tmp_path / "a.txt"
+    source.write_text("hello")
+
+    Indexer(mock_model, {})._index_file(updater, source)
+
+    updater.append_file_chunk.assert_not_called()
+    updater.append_failed_file.assert_called_once_with(str(source), "HTTP 503")
+
+
+def test_index_files_batches_and_keeps_successful_files(tmp_path):
+    """测试多个文件一次 encode_batch，部分失败时只把失败的文件记入 failed_files"""
+    import numpy as np
+    from codebase.indexing import Indexer
+    from codebase.model_provider import EmbeddingError
+
+    paths = []
+    for name in ["a.txt", "b.txt", "c.txt"]:
+        path = tmp_path / name
+        path.write_text(name)
+        paths.append(path)
+    embeddings = np.array([[1.0, 0.0], [np.nan, np.nan], [0.0, 1.0]], dtype=np.float32)
+    mock_model = Mock()
+    mock_model.encode_batch.side_effect = EmbeddingError(
+        "1 of 3 texts failed", {1: "HTTP 400"}, embeddings
+    )
+    updater = Mock()
+
+    Indexer(mock_model, {}, batch_size=8)._index_files(updater, paths)
+
+    mock_model.encode_batch.assert_called_once_with(["a.txt", "b.txt", "c.txt"])
+    assert [c.args[0] for c in updater.append_file_chunk.call_args_list] == [
+        str(paths[0]),
+        str(paths[2]),
+    ]
+    updater.append_failed_file.assert_called_once_with(str(paths[1]), "HTTP 400")
+
+
+def test_index_files_records_stage_metrics(tmp_path):
+    """测试索引时记录 read/embed 各阶段的调用次数、文件数和字节数"""
+    import numpy as np
+    from codebase.indexing import Indexer
+    from codebase.profiling import Profiler
+
+    paths = []
+    for name in ["a.txt", "b.txt", "c.txt"]:
+        path = tmp_path / name
+        path.write_text("代码")
+        paths.append(path)
+    mock_model = Mock()
+    mock_model.encode_batch.side_effect = lambda texts: np.ones(
+        (len(texts), 2), dtype=np.float32
+    )
+    profiler = Profiler()
+
+    Indexer(mock_model, {}, batch_size=2, profiler=profiler)._index_files(
+        Mock(), paths
+    )
+
+    stages = profiler.to_dict()["stages"]
+    assert stages["read"]["items"] == 3
+    assert stages["read"]["bytes"] == 3 * len("代码".encode("utf8"))
+    assert (stages["embed"]["calls"], stages["embed"]["items"]) == (2, 3)
+    assert stages["embed"]["bytes"] == stages["read"]["bytes"]
+    assert profiler.max_depths == {"encode_batch": 2}
+
+
+def test_index_files_links_near_duplicates_without_embedding(tmp_path):
+    """测试开启近重复检测时近重复文件不生成 embedding，只链接到代表文件；代表文件编码失败时近重复文件一起记入 failed_files"""
+    import numpy as np
+    from codebase.dedup import Deduplicator
+    from codebase.indexing import Indexer
+    from codebase.model_provider import EmbeddingError
+
+    code = "".join(
+        f"def f{i}(request, limit={i % 7}):\n    return request.get('k{i}', {i * 31 % 97})\n"
+        for i in range(200)
+    )
+    other = "".join(f"class C{i}:\n    name = 'c{i}'\n" for i in range(200))
+    paths = []
+    for name, text in [("a.py", code), ("b.py", code), ("c.py", other), ("d.py", other)]:
+        path = tmp_path / name
+        path.write_text(text)
+        paths.append(path)
+    mock_model = Mock()
+    mock_model.encode_batch.side_effect = EmbeddingError(
+        "1 of 2 texts failed",
+        {1: "HTTP 400"},
+        np.array([[1.0, 0.0], [np.nan, np.nan]], dtype=np.float32),
+    )
+    updater = Mock()
+    updater.find_representatives.return_value = []
+    updater.fetch_duplicate_rows.return_value = []
+
+    Indexer(mock_model, {}, deduplicator=Deduplicator())._index_files(updater, paths)
+
+    # 只编码 a.py 和 c.py
+    mock_model.encode_batch.assert_called_once_with([code, other])
+    assert updater.append_file_chunk.call_args.args[0] == str(paths[0])
+    file_path, _, _, _, duplicate_of = updater.append_duplicate.call_args.args
+    assert (file_path, duplicate_of) == (str(paths[1]), str(paths[0]))
+    assert [c.args[0] for c in updater.append_failed_file.call_args_list] == [
+        str(paths[2]),
+        str(paths[3]),
+    ]
+
+
+def test_index_files_rechecks_near_duplicates_of_changed_representative(tmp_path):
+    """测试代表文件内容改变后，与新内容仍然相近的近重复文件保持链接，不再相近的重新生成 embedding"""
+    import numpy as np
+    from codebase.dedup import Deduplicator, simhash
+    from codebase.indexing import Indexer
+
+    def code(name):
+        return "".join(
+            f"def {name}{i}(request, limit={i % 7}):\n    return request.get('k{i}', {i * 31 % 97})\n"
+            for i in range(200)
+        )
+
+    path = tmp_path / "a.py"
+    path.write_text(code("f").replace("limit=0", "limit=6", 1))
+    near, far = code("f"), code("g")
+    mock_model = Mock()
+    mock_model.encode_batch.side_effect = lambda texts: np.ones(
+        (len(texts), 2), dtype=np.float32
+    )
+    updater = Mock()
+    updater.find_representatives.return_value = []
+    updater.fetch_duplicate_rows.return_value = [
+        ("far.py", far, 3, simhash(far), str(path)),
+        ("near.py", near, 1, simhash(near), str(path)),
+    ]
+
+    Indexer(mock_model, {}, deduplicator=Deduplicator())._index_files(updater, [path])
+
+    assert mock_model.encode_batch.call_args_list[1].args[0] == [far]
+    assert [c.args[0] for c in updater.append_file_chunk.call_args_list] == [
+        str(path),
+        "far.py",
+    ]
+    # 保留数据库中去掉文件头后的起始行号
+    assert updater.append_file_chunk.call_args.args[3] == 3
+    updater.append_duplicate.assert_not_called()
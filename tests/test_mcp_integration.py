@@ -42,17 +42,20 @@ async def test_mcp_server_startup():
     
     # Mock dependencies
     with (
-        patch("codebase.mcp_server.EMBEDDING_MODEL") as mock_embedding,
+        patch("codebase.mcp_server.get_embedding_model") as mock_get_embedding_model,
         patch("codebase.mcp_server.PGVectorConnector") as mock_connector_class,
+        patch("codebase.mcp_server._pgvector_connector", None),
         patch("codebase.mcp_server.CONFIG") as mock_config
     ):
         # Setup mocks
+        mock_embedding = mock_get_embedding_model.return_value
         mock_embedding.encode.return_value = [0.1, 0.2, 0.3, 0.4]
         mock_connector = Mock()
         mock_connector.execute_select.return_value = (
             ["file_path", "distance"],
             [("test.py", 0.1234)]
         )
+        mock_connector.fetch_snippets.return_value = {}
         mock_connector_class.return_value = mock_connector
         mock_config.return_value = {
             "pgvector": {
@@ -75,17 +78,20 @@ async def test_fastmcp_server_initialization():
     
     # Mock dependencies
     with (
-        patch("codebase.mcp_server.EMBEDDING_MODEL") as mock_embedding,
+        patch("codebase.mcp_server.get_embedding_model") as mock_get_embedding_model,
         patch("codebase.mcp_server.PGVectorConnector") as mock_connector_class,
+        patch("codebase.mcp_server._pgvector_connector", None),
         patch("codebase.mcp_server.CONFIG") as mock_config
     ):
         # Setup mocks
+        mock_embedding = mock_get_embedding_model.return_value
         mock_embedding.encode.return_value = [0.1, 0.2, 0.3, 0.4]
         mock_connector = Mock()
         mock_connector.execute_select.return_value = (
             ["file_path", "distance"],
             [("test.py", 0.1234)]
         )
+        mock_connector.fetch_snippets.return_value = {}
         mock_connector_class.return_value = mock_connector
         mock_config.return_value = {
             "pgvector": {
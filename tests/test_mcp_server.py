@@ -2,6 +2,8 @@ import pytest
 import asyncio
 from unittest.mock import Mock, patch
 
+from codebase.mcp_server import QueryEmbeddingCache
+
 
 @pytest.fixture
 def mock_embedding_model():
@@ -23,6 +25,7 @@ def mock_pgvector_connector():
             ("src/codebase/config.py", 0.3456),
         ],
     )
+    mock_connector.fetch_snippets.return_value = {}
     return mock_connector
 
 
@@ -40,9 +43,14 @@ def mock_config():
 def mcp_server_instance(mock_embedding_model, mock_pgvector_connector, mock_config):
     """Create MCP server instance with mocked dependencies"""
     with (
-        patch("codebase.mcp_server.EMBEDDING_MODEL", mock_embedding_model),
+        patch(
+            "codebase.mcp_server.get_embedding_model",
+            return_value=mock_embedding_model,
+        ),
         patch("codebase.mcp_server.PGVectorConnector") as mock_connector_class,
+        patch("codebase.mcp_server._pgvector_connector", None),
         patch("codebase.mcp_server.CONFIG", mock_config),
+        patch("codebase.mcp_server.QUERY_EMBEDDINGS", QueryEmbeddingCache(8)),
     ):
 
         mock_connector_class.return_value = mock_pgvector_connector
@@ -52,6 +60,33 @@ def mcp_server_instance(mock_embedding_model, mock_pgvector_connector, mock_conf
         yield semantic_search
 
 
+@pytest.fixture
+def batch_search_instance(mock_embedding_model, mock_pgvector_connector):
+    """batch_semantic_search with mocked dependencies"""
+    import numpy as np
+
+    mock_embedding_model.encode_batch.return_value = np.zeros(
+        (2, 4), dtype=np.float32
+    )
+    mock_pgvector_connector.execute_select.return_value = (
+        ["ord", "file_path", "distance"],
+        [(1, "src/codebase/cli.py", 0.1), (2, "src/codebase/search.py", 0.2)],
+    )
+    with (
+        patch(
+            "codebase.mcp_server.get_embedding_model",
+            return_value=mock_embedding_model,
+        ),
+        patch("codebase.mcp_server.PGVectorConnector") as mock_connector_class,
+        patch("codebase.mcp_server._pgvector_connector", None),
+    ):
+        mock_connector_class.return_value = mock_pgvector_connector
+
+        from codebase.mcp_server import batch_semantic_search
+
+        yield batch_semantic_search
+
+
 @pytest.mark.asyncio
 async def test_semantic_search_success(
     mcp_server_instance, mock_embedding_model, mock_pgvector_connector
@@ -75,6 +110,146 @@ async def test_semantic_search_success(
     assert "src/codebase/search.py" in result
 
 
+@pytest.mark.asyncio
+async def test_semantic_search_snippets(mcp_server_instance, mock_pgvector_connector):
+    """Test that results carry bounded snippets fetched in one extra query"""
+    mock_pgvector_connector.fetch_snippets.return_value = {
+        "src/codebase/cli.py": (3, "def main():\n    pass"),
+        "src/codebase/search.py": (1, "x" * 100_000),
+    }
+
+    result = await mcp_server_instance("test query")
+
+    mock_pgvector_connector.fetch_snippets.assert_called_once()
+    assert "==> src/codebase/cli.py:3-4\ndef main():\n    pass" in result
+    assert "x" * 2048 in result
+    assert "x" * 2049 not in result
+
+
+@pytest.mark.asyncio
+async def test_semantic_search_without_snippets(
+    mcp_server_instance, mock_pgvector_connector
+):
+    """Test that snippets can be turned off"""
+    result = await mcp_server_instance("test query", include_snippets=False)
+
+    mock_pgvector_connector.fetch_snippets.assert_not_called()
+    assert "==>" not in result
+
+
+@pytest.mark.asyncio
+async def test_semantic_search_keeps_customized_default_sql(
+    mcp_server_instance, mock_pgvector_connector
+):
+    """Test that a customized pgvector.default_sql is still run, with pages
+    and max_distance cut from its rows"""
+    from codebase.config import CONFIG
+
+    custom_sql = (
+        "SELECT file_path, embedding <=> %(embedding)s::vector AS distance "
+        "FROM code_chunks WHERE file_path LIKE '%%.py' "
+        "ORDER BY embedding <=> %(embedding)s::vector LIMIT 10;"
+    )
+    with patch.dict(CONFIG["pgvector"], {"default_sql": custom_sql}):
+        result = await mcp_server_instance(
+            "test query", include_snippets=False, top_k=1, max_distance=0.3
+        )
+
+    assert mock_pgvector_connector.execute_select.call_args.args[0] == custom_sql
+    assert "1. src/codebase/cli.py" in result
+    assert "src/codebase/config.py" not in result
+    assert "next_cursor" in result
+
+
+@pytest.mark.asyncio
+async def test_semantic_search_group_by_directory(
+    mcp_server_instance, mock_pgvector_connector
+):
+    """Test that grouped results are listed under their directory, keeping
+    their rank, directories in order of their best result"""
+    mock_pgvector_connector.execute_select.return_value = (
+        ["file_path", "distance"],
+        [("src/a.py", 0.1), ("tests/b.py", 0.2), ("src/c.py", 0.3), ("d.py", 0.4)],
+    )
+
+    result = await mcp_server_instance(
+        "test query", include_snippets=False, group_by_directory=True
+    )
+
+    assert result == (
+        "Semantic search results:\n\n"
+        "src/\n1. src/a.py (distance: 0.1000)\n3. src/c.py (distance: 0.3000)\n"
+        "tests/\n2. tests/b.py (distance: 0.2000)\n"
+        "./\n4. d.py (distance: 0.4000)\n"
+    )
+
+
+@pytest.mark.asyncio
+async def test_semantic_search_pages_with_cursor(
+    mcp_server_instance, mock_embedding_model, mock_pgvector_connector
+):
+    """Test top_k pages: one extra row tells there is a next page, and the
+    next_cursor continues at the offset without encoding the query again"""
+    import re
+    from codebase.search import PAGED_SEARCH_SQL
+
+    first = await mcp_server_instance("test query", include_snippets=False, top_k=2)
+
+    assert "1. src/codebase/cli.py" in first
+    assert "2. src/codebase/search.py" in first
+    assert "config.py" not in first
+    sql, params = mock_pgvector_connector.execute_select.call_args.args
+    assert params["top_k"] == 3
+    cursor = re.search(r"next_cursor: (\S+)", first).group(1)
+
+    second = await mcp_server_instance(cursor=cursor, include_snippets=False)
+
+    sql, params = mock_pgvector_connector.execute_select.call_args.args
+    assert sql == PAGED_SEARCH_SQL
+    assert (params["offset"], params["top_k"], params["max_distance"]) == (2, 5, None)
+    assert "3. src/codebase/cli.py" in second
+    mock_embedding_model.encode.assert_called_once_with("test query")
+
+
+@pytest.mark.asyncio
+async def test_semantic_search_max_distance_and_bad_arguments(
+    mcp_server_instance, mock_pgvector_connector
+):
+    """Test that max_distance is filtered in SQL and that a bad top_k or
+    cursor is rejected"""
+    from codebase.mcp_server import encode_cursor
+    from codebase.search import MAX_EF_SEARCH
+
+    mock_pgvector_connector.execute_select.return_value = (
+        ["file_path", "distance"],
+        [("src/codebase/cli.py", 0.1234)],
+    )
+
+    result = await mcp_server_instance("test query", top_k=5, max_distance=0.2)
+
+    params = mock_pgvector_connector.execute_select.call_args.args[1]
+    assert (params["offset"], params["max_distance"]) == (0, 0.2)
+    assert "next_cursor" not in result
+    assert "Error" in await mcp_server_instance("test query", top_k=0)
+    assert "invalid cursor" in await mcp_server_instance(cursor="not-a-cursor")
+    for offset, top_k in [(MAX_EF_SEARCH, 5), (-1, 5), (0, 0), (0, 1000)]:
+        cursor = encode_cursor("test query", offset, top_k, None, False)
+        assert "invalid cursor" in await mcp_server_instance(cursor=cursor)
+
+
+@pytest.mark.asyncio
+async def test_semantic_search_survives_failed_query(
+    mcp_server_instance, mock_pgvector_connector
+):
+    """Test that a failed search statement reports no results instead of
+    failing to unpack"""
+    mock_pgvector_connector.execute_select.return_value = None
+
+    result = await mcp_server_instance("test query", include_snippets=False)
+
+    assert result == "No results found"
+
+
 @pytest.mark.asyncio
 async def test_semantic_search_empty_query(mcp_server_instance):
     """Test semantic search with empty query"""
@@ -117,6 +292,200 @@ async def test_semantic_search_database_error(
     assert "Database connection failed" in result
 
 
+@pytest.mark.asyncio
+async def test_batch_semantic_search(
+    batch_search_instance, mock_embedding_model, mock_pgvector_connector
+):
+    """Test that a batch is embedded and searched with one call each"""
+    result = await batch_search_instance(["cli entry", "search main"], top_k=3)
+
+    mock_embedding_model.encode_batch.assert_called_once_with(
+        ["cli entry", "search main"]
+    )
+    mock_pgvector_connector.execute_select.assert_called_once()
+    assert result.index("## cli entry") < result.index("src/codebase/cli.py")
+    assert result.index("## search main") < result.index("src/codebase/search.py")
+
+
+@pytest.mark.asyncio
+async def test_batch_semantic_search_reports_failed_query(
+    batch_search_instance, mock_pgvector_connector
+):
+    """Test that a failed batch statement is an error, not "No results found"
+    for every query"""
+    mock_pgvector_connector.execute_select.return_value = []
+
+    result = await batch_search_instance(["cli entry", "search main"])
+
+    assert "Error during batch semantic search" in result
+    assert "No results found" not in result
+
+
+@pytest.mark.asyncio
+async def test_batch_semantic_search_empty(batch_search_instance):
+    """Test batch search rejects an empty query list"""
+    result = await batch_search_instance([])
+
+    assert "Error" in result
+
+
+@pytest.mark.asyncio
+async def test_server_stats_counts_phases_errors_and_empty_results(
+    mcp_server_instance, mock_pgvector_connector
+):
+    """Test that every call is timed per phase and its outcome counted"""
+    import json
+    from codebase.mcp_server import server_stats
+    from codebase.profiling import RequestMetrics
+
+    with patch("codebase.mcp_server.METRICS", RequestMetrics()):
+        await mcp_server_instance("found")
+        mock_pgvector_connector.execute_select.return_value = ([], [])
+        await mcp_server_instance("nothing")
+        await mcp_server_instance("")
+        stats = json.loads(await server_stats())
+
+    requests = stats["requests"]["semantic_search"]
+    assert (requests["count"], requests["errors"], requests["empty"]) == (3, 1, 1)
+    assert stats["phases"]["encode"]["count"] == 2
+    assert stats["phases"]["sql"]["count"] == 2
+    assert stats["phases"]["format"]["count"] == 1
+    assert stats["caches"]["query_embedding"]["misses"] == 2
+
+
+@pytest.mark.asyncio
+async def test_find_similar_reuses_stored_embedding(
+    mock_embedding_model, mock_pgvector_connector
+):
+    """Test find_similar searches around the stored vector of the file,
+    leaves the file itself out and never calls the embedding model"""
+    import numpy as np
+
+    mock_pgvector_connector.execute_select.side_effect = [
+        (["file_path", "embedding"], [("src/codebase/cli.py", np.ones(4))]),
+        (
+            ["file_path", "distance"],
+            [("src/codebase/cli.py", 0.0), ("src/codebase/search.py", 0.2)],
+        ),
+    ]
+    with (
+        patch(
+            "codebase.mcp_server.get_embedding_model",
+            return_value=mock_embedding_model,
+        ),
+        patch("codebase.mcp_server.PGVectorConnector") as mock_connector_class,
+        patch("codebase.mcp_server._pgvector_connector", None),
+    ):
+        mock_connector_class.return_value = mock_pgvector_connector
+        from codebase.mcp_server import find_similar
+
+        result = await find_similar("src/codebase/cli.py", include_snippets=False)
+
+    assert result.startswith("Code similar to src/codebase/cli.py:")
+    assert "1. src/codebase/search.py (distance: 0.2000)" in result
+    assert "cli.py (distance" not in result
+    mock_embedding_model.encode.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_find_similar_not_indexed(mock_pgvector_connector):
+    """Test find_similar on a path that is not in the index"""
+    mock_pgvector_connector.execute_select.return_value = (["array_agg", "avg"], [])
+    with (
+        patch("codebase.mcp_server.PGVectorConnector") as mock_connector_class,
+        patch("codebase.mcp_server._pgvector_connector", None),
+    ):
+        mock_connector_class.return_value = mock_pgvector_connector
+        from codebase.mcp_server import find_similar
+
+        result = await find_similar("missing.py")
+
+    assert result == "missing.py is not indexed"
+
+
+def test_warm_up_prepares_model_connection_and_prewarms(
+    mock_embedding_model, mock_pgvector_connector
+):
+    """Test the start-up warm-up: the model is exercised, the probe queries
+    run on the shared connection and pg_prewarm runs on a second one"""
+    from codebase.mcp_server import Warmup, warm_up
+
+    prewarm_connector = Mock()
+    prewarm_connector.prewarm.return_value = {"code_chunks_embedding_idx": 120}
+    warmup = Warmup()
+    warmup.ready.clear()
+    with (
+        patch(
+            "codebase.mcp_server.get_embedding_model",
+            return_value=mock_embedding_model,
+        ),
+        patch("codebase.mcp_server.rerank_enabled", return_value=False),
+        patch(
+            "codebase.mcp_server.get_pgvector_connector",
+            return_value=mock_pgvector_connector,
+        ),
+        patch(
+            "codebase.mcp_server.PGVectorConnector", return_value=prewarm_connector
+        ),
+    ):
+        warm_up(warmup, queries=2)
+
+    assert warmup.ready.is_set()
+    state = warmup.to_dict()
+    assert state["state"] == "ready"
+    assert state["error"] is None
+    assert state["prewarmed_blocks"] == {"code_chunks_embedding_idx": 120}
+    assert set(state["seconds"]) == {"model", "connect", "queries", "prewarm"}
+    assert mock_embedding_model.encode.call_count == 2
+    # The statements of semantic_search are prepared
+    assert mock_pgvector_connector.execute_select.call_count == 2
+    assert mock_pgvector_connector.execute_select.call_args.kwargs["prepare"]
+
+
+def test_warm_up_failure_still_lets_tools_run():
+    """Test that a failed warm-up is reported and does not block tool calls"""
+    from codebase.mcp_server import Warmup, warm_up
+
+    model = Mock()
+    model.encode.side_effect = RuntimeError("embedding server down")
+    warmup = Warmup()
+    warmup.ready.clear()
+    with patch("codebase.mcp_server.get_embedding_model", return_value=model):
+        warm_up(warmup)
+
+    assert warmup.ready.is_set()
+    assert warmup.state == "failed"
+    assert "embedding server down" in warmup.error
+
+
+def test_metrics_endpoint():
+    """Test the local /metrics and /stats endpoints"""
+    import requests
+    from codebase.mcp_server import start_metrics_server
+    from codebase.profiling import RequestMetrics
+
+    metrics = RequestMetrics()
+    with metrics.request("semantic_search"):
+        with metrics.phase("encode"):
+            pass
+    with patch("codebase.mcp_server.METRICS", metrics):
+        server = start_metrics_server(0)
+        try:
+            url = f"http://127.0.0.1:{server.server_port}"
+            text = requests.get(url + "/metrics").text
+            stats = requests.get(url + "/stats").json()
+            missing = requests.get(url + "/other")
+            ready = requests.get(url + "/ready")
+        finally:
+            server.shutdown()
+
+    assert 'codebase_mcp_phase_seconds_count{phase="encode"} 1' in text
+    assert 'codebase_mcp_errors_total{tool="semantic_search"} 0' in text
+    assert stats["requests"]["semantic_search"]["count"] == 1
+    assert missing.status_code == 404
+    assert ready.status_code == 200
+    assert stats["warmup"]["state"] == "disabled"
+
 # Note: Full MCP server integration testing requires complex setup
 # with stdio streams and proper MCP protocol handling. The unit tests
 # above cover the core semantic_search functionality which is the most
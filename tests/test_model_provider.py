@@ -0,0 +1,390 @@
+import numpy as np
+import pytest
+import requests
+from unittest.mock import Mock
+
+from codebase.model_provider import ModelProvider
+
+
+@pytest.fixture
+def openai_provider(mocker):
+    from codebase.model_provider import OpenAICompatibleProvider
+
+    # No real waiting between retries
+    mocker.patch("codebase.model_provider.time.sleep")
+    return OpenAICompatibleProvider(
+        "test-model", "http://localhost:8000", max_retries=2, batch_size=4
+    )
+
+
+def _mock_response(data: list[dict], status_code: int = 200) -> Mock:
+    response = Mock()
+    response.status_code = status_code
+    response.headers = {}
+    response.json.return_value = {"data": data}
+    return response
+
+
+def _echo_post(*args, **kwargs) -> Mock:
+    """Embed every input text as [len(text), index]"""
+    texts = kwargs["json"]["input"]
+    return _mock_response(
+        [{"index": i, "embedding": [len(text), i]} for i, text in enumerate(texts)]
+    )
+
+
+def test_openai_encode_returns_float32_vector(mocker, openai_provider):
+    """encode returns a contiguous float32 vector"""
+    mocker.patch(
+        "requests.post",
+        return_value=_mock_response([{"index": 0, "embedding": [0.1, 0.2, 0.3]}]),
+    )
+
+    embedding = openai_provider.encode("hello")
+
+    assert isinstance(embedding, np.ndarray)
+    assert embedding.dtype == np.float32
+    assert embedding.flags["C_CONTIGUOUS"]
+    np.testing.assert_allclose(embedding, [0.1, 0.2, 0.3], rtol=1e-6)
+
+
+def test_openai_encode_batch_orders_by_index(mocker, openai_provider):
+    """encode_batch sends one request and restores input order"""
+    mock_post = mocker.patch(
+        "requests.post",
+        return_value=_mock_response(
+            [
+                {"index": 1, "embedding": [2.0, 2.0]},
+                {"index": 0, "embedding": [1.0, 1.0]},
+            ]
+        ),
+    )
+
+    embeddings = openai_provider.encode_batch(["a", "b"])
+
+    mock_post.assert_called_once()
+    assert mock_post.call_args.kwargs["json"]["input"] == ["a", "b"]
+    assert embeddings.shape == (2, 2)
+    assert embeddings.dtype == np.float32
+    np.testing.assert_array_equal(embeddings[:, 0], [1.0, 2.0])
+
+
+def test_openai_encode_request_error(mocker, openai_provider):
+    """encode raises EmbeddingError after the retries instead of returning an empty vector"""
+    from codebase.model_provider import EmbeddingError
+
+    mock_post = mocker.patch(
+        "requests.post", side_effect=requests.exceptions.ConnectionError("down")
+    )
+
+    with pytest.raises(EmbeddingError) as excinfo:
+        openai_provider.encode("hello")
+
+    assert mock_post.call_count == 3
+    assert list(excinfo.value.errors) == [0]
+    assert excinfo.value.embeddings is None
+
+
+def test_openai_retries_transient_errors(mocker, openai_provider):
+    """429 and 5xx are retried, honouring Retry-After"""
+    throttled = _mock_response([], status_code=429)
+    throttled.headers = {"Retry-After": "2"}
+    mocker.patch(
+        "requests.post",
+        side_effect=[
+            throttled,
+            _mock_response([], status_code=503),
+            _mock_response([{"index": 0, "embedding": [1.0, 0.0]}]),
+        ],
+    )
+
+    embedding = openai_provider.encode("hello")
+
+    np.testing.assert_array_equal(embedding, [1.0, 0.0])
+    from codebase.model_provider import time
+
+    assert time.sleep.call_args_list[0].args[0] == 2.0
+
+
+def test_openai_shrinks_batch_on_413(mocker, openai_provider):
+    """A 413 splits the batch in halves, the batch size then grows back on success"""
+
+    def post(*args, **kwargs):
+        if len(kwargs["json"]["input"]) > 2:
+            return _mock_response([], status_code=413)
+        return _echo_post(*args, **kwargs)
+
+    mock_post = mocker.patch("requests.post", side_effect=post)
+
+    embeddings = openai_provider.encode_batch(["a", "bb", "ccc", "dddd", "eeeee"])
+
+    np.testing.assert_array_equal(embeddings[:, 0], [1, 2, 3, 4, 5])
+    sizes = [len(c.kwargs["json"]["input"]) for c in mock_post.call_args_list]
+    assert sizes == [4, 2, 2, 1]
+    assert openai_provider.batch_size == 4
+
+
+def test_openai_isolates_rejected_text(mocker, openai_provider):
+    """A 400 is not retried as a whole; the batch is split to find the bad text"""
+    from codebase.model_provider import EmbeddingError
+
+    def post(*args, **kwargs):
+        if "bad" in kwargs["json"]["input"]:
+            response = _mock_response([], status_code=400)
+            response.raise_for_status.side_effect = requests.exceptions.HTTPError(
+                "400 Bad Request"
+            )
+            return response
+        return _echo_post(*args, **kwargs)
+
+    mocker.patch("requests.post", side_effect=post)
+
+    with pytest.raises(EmbeddingError) as excinfo:
+        openai_provider.encode_batch(["a", "bad", "ccc"])
+
+    assert list(excinfo.value.errors) == [1]
+    embeddings = excinfo.value.embeddings
+    np.testing.assert_array_equal(embeddings[[0, 2], 0], [1, 3])
+    assert np.isnan(embeddings[1]).all()
+
+
+def test_openai_does_not_split_on_auth_errors(mocker, openai_provider):
+    """A 401 fails the whole batch after one request instead of bisecting it"""
+    from codebase.model_provider import EmbeddingError
+
+    response = _mock_response([], status_code=401)
+    response.raise_for_status.side_effect = requests.exceptions.HTTPError(
+        "401 Unauthorized"
+    )
+    mock_post = mocker.patch("requests.post", return_value=response)
+
+    with pytest.raises(EmbeddingError) as excinfo:
+        openai_provider.encode_batch(["a", "b", "c", "d"])
+
+    assert mock_post.call_count == 1
+    assert sorted(excinfo.value.errors) == [0, 1, 2, 3]
+
+
+def test_rate_limiter_waits_for_tokens(mocker):
+    """The token bucket sleeps once it is empty"""
+    from codebase.model_provider import RateLimiter
+
+    sleep = mocker.patch("codebase.model_provider.time.sleep")
+    limiter = RateLimiter(max_concurrency=1, tokens_per_minute=600)
+    clock = mocker.patch("codebase.model_provider.time.monotonic")
+    clock.return_value = limiter.updated
+
+    limiter.acquire_tokens(600)
+    sleep.assert_not_called()
+
+    # Refill 10 tokens per second: 60 tokens need 6 seconds
+    sleep.side_effect = lambda seconds: setattr(
+        clock, "return_value", clock.return_value + seconds
+    )
+    limiter.acquire_tokens(60)
+    assert sleep.call_args.args[0] == pytest.approx(6.0)
+
+
+def test_truncate_embedding_renormalizes():
+    """Matryoshka truncation keeps the prefix and re-normalizes it"""
+    from codebase.model_provider import truncate_embedding
+
+    embeddings = np.array([[3.0, 4.0, 12.0], [1.0, 0.0, 0.0]], dtype=np.float32)
+
+    truncated = truncate_embedding(embeddings, 2)
+
+    assert truncated.shape == (2, 2)
+    assert truncated.dtype == np.float32
+    np.testing.assert_allclose(truncated, [[0.6, 0.8], [1.0, 0.0]], rtol=1e-6)
+    np.testing.assert_allclose(truncate_embedding(embeddings[0], 2), [0.6, 0.8])
+
+
+def test_matryoshka_provider_truncates(mocker):
+    """MatryoshkaProvider truncates single and batched embeddings"""
+    from codebase.model_provider import MatryoshkaProvider
+
+    base = Mock()
+    base.encode.return_value = np.ones(8, dtype=np.float32)
+    base.encode_batch.return_value = np.ones((3, 8), dtype=np.float32)
+    provider = MatryoshkaProvider(base, 4)
+
+    assert provider.encode("a").shape == (4,)
+    assert provider.encode_batch(["a", "b", "c"]).shape == (3, 4)
+
+
+@pytest.mark.parametrize(
+    "pooling, expected",
+    [
+        ("cls", [1.0, 0.0]),
+        ("mean", [0.6, 0.8]),
+        ("last_token", [0.0, 1.0]),
+    ],
+)
+def test_pool_hidden_states(pooling, expected):
+    """Pooling ignores right padding and normalizes the result"""
+    from codebase.model_provider import pool_hidden_states
+
+    hidden_states = np.array(
+        [[[3.0, 0.0], [0.0, 4.0], [9.0, 9.0]]], dtype=np.float32
+    )
+    attention_mask = np.array([[1, 1, 0]])
+
+    pooled = pool_hidden_states(hidden_states, attention_mask, pooling)
+
+    np.testing.assert_allclose(pooled, [expected], rtol=1e-6)
+
+
+def test_pool_hidden_states_last_token_left_padding():
+    """Last-token pooling picks the final position with left padding"""
+    from codebase.model_provider import pool_hidden_states
+
+    hidden_states = np.array(
+        [[[9.0, 9.0], [3.0, 0.0], [0.0, 4.0]]], dtype=np.float32
+    )
+    attention_mask = np.array([[0, 1, 1]])
+
+    pooled = pool_hidden_states(hidden_states, attention_mask, "last_token")
+
+    np.testing.assert_allclose(pooled, [[0.0, 1.0]], rtol=1e-6)
+
+
+def test_token_budget_batches():
+    """Inputs are grouped by length under the padded token budget"""
+    from codebase.model_provider import token_budget_batches
+
+    lengths = [500, 10, 12, 480, 11, 2000]
+
+    batches = token_budget_batches(lengths, max_batch_tokens=1000, max_batch_size=2)
+
+    assert batches == [[1, 4], [2, 3], [0], [5]]
+    assert sorted(i for batch in batches for i in batch) == list(range(6))
+
+
+class _LengthProvider(ModelProvider):
+    """Embeds a text as [len(text), pid], built inside pool workers"""
+
+    def encode(self, text: str) -> np.ndarray:
+        return self.encode_batch([text])[0]
+
+    def encode_batch(self, texts: list[str]) -> np.ndarray:
+        import os
+
+        return np.array([[len(text), os.getpid()] for text in texts], np.float32)
+
+
+def _create_length_provider(threads: int) -> ModelProvider:
+    return _LengthProvider()
+
+
+def test_encode_pool_keeps_input_order():
+    """Chunks are spread over the worker processes and reassembled in input order"""
+    import os
+    from codebase.model_provider import EncodePoolProvider
+
+    pool = EncodePoolProvider(
+        _create_length_provider, processes=2, threads=1, chunk_size=2
+    )
+    try:
+        texts = ["x" * n for n in [3, 9, 1, 7, 5, 2, 8]]
+        embeddings = pool.encode_batch(texts)
+    finally:
+        pool.close()
+
+    np.testing.assert_array_equal(embeddings[:, 0], [3, 9, 1, 7, 5, 2, 8])
+    assert os.getpid() not in embeddings[:, 1]
+    assert pool.pool is None
+
+
+def _create_broken_provider(threads: int) -> ModelProvider:
+    raise RuntimeError("model not found")
+
+
+def test_encode_pool_reports_worker_errors():
+    """A worker that cannot load its model fails the call instead of hanging"""
+    from codebase.model_provider import EncodePoolProvider
+
+    pool = EncodePoolProvider(_create_broken_provider, processes=1, threads=1)
+    try:
+        with pytest.raises(RuntimeError, match="model not found"):
+            pool.encode_batch(["a"])
+    finally:
+        pool.close()
+
+
+def _base64(vector: list[float]) -> str:
+    import base64
+
+    return base64.b64encode(np.array(vector, dtype="<f4").tobytes()).decode()
+
+
+def test_openai_decodes_base64_embeddings(mocker, openai_provider):
+    """base64 embeddings are requested and decoded into a writable float32 matrix"""
+    mock_post = mocker.patch(
+        "requests.post",
+        return_value=_mock_response(
+            [
+                {"index": 1, "embedding": _base64([3.0, 4.0])},
+                {"index": 0, "embedding": _base64([1.0, 2.0])},
+            ]
+        ),
+    )
+
+    embeddings = openai_provider.encode_batch(["a", "b"])
+
+    assert mock_post.call_args.kwargs["json"]["encoding_format"] == "base64"
+    assert mock_post.call_args.kwargs["headers"]["Accept-Encoding"] == "identity"
+    np.testing.assert_array_equal(embeddings, [[1.0, 2.0], [3.0, 4.0]])
+    assert embeddings.dtype == np.float32
+    assert embeddings.flags.writeable
+
+
+def test_openai_falls_back_to_float(mocker, openai_provider):
+    """A server rejecting base64 is asked for floats from then on"""
+
+    def post(*args, **kwargs):
+        if kwargs["json"]["encoding_format"] == "base64":
+            response = _mock_response([], status_code=400)
+            response.raise_for_status.side_effect = requests.exceptions.HTTPError(
+                "400 Bad Request"
+            )
+            return response
+        return _echo_post(*args, **kwargs)
+
+    mock_post = mocker.patch("requests.post", side_effect=post)
+
+    openai_provider.encode("abc")
+    np.testing.assert_array_equal(openai_provider.encode("abcd"), [4.0, 0.0])
+
+    formats = [c.kwargs["json"]["encoding_format"] for c in mock_post.call_args_list]
+    assert formats == ["base64", "float", "float"]
+
+
+def test_openai_float_fallback_is_tried_once(mocker, openai_provider):
+    """A batch rejected in both formats tries floats once, not on every split,
+    and a float retry that times out keeps base64"""
+    from codebase.model_provider import EmbeddingError
+
+    def rejected(*args, **kwargs):
+        response = _mock_response([], status_code=400)
+        response.raise_for_status.side_effect = requests.exceptions.HTTPError(
+            "400 Bad Request"
+        )
+        return response
+
+    mock_post = mocker.patch("requests.post", side_effect=rejected)
+    with pytest.raises(EmbeddingError):
+        openai_provider.encode_batch(["a", "b", "c", "d"])
+
+    formats = [c.kwargs["json"]["encoding_format"] for c in mock_post.call_args_list]
+    assert formats.count("float") == 1
+    assert openai_provider.encoding_format == "base64"
+
+    openai_provider.float_fallback_tried = False
+    mock_post.side_effect = [
+        rejected(),
+        requests.exceptions.ReadTimeout("slow"),
+        *[_echo_post(json={"input": ["x"]}) for _ in range(2)],
+    ]
+    openai_provider.encode_batch(["a", "b"])
+
+    assert openai_provider.encoding_format == "base64"
@@ -0,0 +1,99 @@
+import json
+import time
+
+
+def test_stage_accumulates_calls_items_and_time():
+    """Each `with stage()` is one call; counts and wall time accumulate"""
+    from codebase.profiling import Profiler
+
+    profiler = Profiler()
+    for _ in range(2):
+        with profiler.stage("embed") as stage:
+            stage.count(4, 100)
+            time.sleep(0.01)
+
+    stats = profiler.to_dict()["stages"]["embed"]
+    assert (stats["calls"], stats["items"], stats["bytes"]) == (2, 8, 200)
+    assert stats["wall_seconds"] >= 0.02
+    assert stats["items_per_second"] > 0
+
+
+def test_stage_is_recorded_when_the_block_raises():
+    from codebase.profiling import Profiler
+
+    profiler = Profiler()
+    try:
+        with profiler.stage("db_write"):
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert profiler.stages["db_write"].calls == 1
+
+
+def test_observe_depth_keeps_the_peak():
+    from codebase.profiling import Profiler
+
+    profiler = Profiler()
+    for depth in [3, 7, 2]:
+        profiler.observe_depth("pending_rows", depth)
+    assert profiler.max_depths == {"pending_rows": 7}
+
+
+def test_write_json_and_prometheus(tmp_path):
+    """.prom files get Prometheus text, anything else JSON"""
+    from codebase.profiling import Profiler
+
+    profiler = Profiler()
+    with profiler.stage("read") as stage:
+        stage.count(1, 10)
+    profiler.observe_depth("pending_rows", 5)
+
+    profiler.write(str(tmp_path / "metrics.json"))
+    data = json.loads((tmp_path / "metrics.json").read_text())
+    assert data["stages"]["read"]["bytes"] == 10
+
+    profiler.write(str(tmp_path / "metrics.prom"))
+    text = (tmp_path / "metrics.prom").read_text()
+    assert '# TYPE codebase_index_stage_wall_seconds counter' in text
+    assert 'codebase_index_stage_items_total{stage="read"} 1' in text
+    assert 'codebase_index_max_queue_depth{queue="pending_rows"} 5' in text
+
+
+def test_latency_histogram_quantiles():
+    """Quantiles are interpolated inside the bucket holding the rank"""
+    from codebase.profiling import LatencyHistogram
+
+    histogram = LatencyHistogram()
+    for _ in range(90):
+        histogram.observe(0.003)  # (0.0025, 0.005]
+    for _ in range(10):
+        histogram.observe(0.2)  # (0.1, 0.25]
+
+    assert 0.0025 < histogram.quantile(0.5) <= 0.005
+    assert 0.1 < histogram.quantile(0.95) <= 0.25
+    histogram.observe(60)
+    assert histogram.quantile(1.0) == LatencyHistogram.BOUNDS[-1]
+    assert LatencyHistogram().quantile(0.5) == 0.0
+
+
+def test_request_metrics_counts_outcomes_and_caches():
+    from codebase.profiling import RequestMetrics
+
+    metrics = RequestMetrics()
+    with metrics.request("search"):
+        pass
+    with metrics.request("search") as request:
+        request.empty = True
+    try:
+        with metrics.request("search"):
+            raise ValueError
+    except ValueError:
+        pass
+
+    data = metrics.to_dict({"rerank": (3, 1)})
+    search = data["requests"]["search"]
+    assert (search["count"], search["errors"], search["empty"]) == (3, 1, 1)
+    assert data["caches"]["rerank"]["hit_ratio"] == 0.75
+    text = metrics.to_prometheus(caches={"rerank": (3, 1)})
+    assert 'codebase_mcp_request_seconds_bucket{tool="search",le="+Inf"} 3' in text
+    assert 'codebase_mcp_cache_hits_total{cache="rerank"} 3' in text
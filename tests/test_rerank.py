@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from unittest.mock import Mock
+from codebase.rerank import Reranker, rerank_records
+
+
+@pytest.fixture
+def mock_cross_encoder():
+    """Cross-encoder whose score is the length of the chunk text"""
+    model = Mock()
+    model.predict.side_effect = lambda pairs, **kwargs: np.array(
+        [float(len(text)) for _, text in pairs]
+    )
+    return model
+
+
+def test_scores_in_batches(mock_cross_encoder):
+    """Test candidates are scored in batches of batch_size"""
+    reranker = Reranker(mock_cross_encoder, batch_size=2)
+    candidates = [("h1", "a"), ("h2", "bbb"), ("h3", "cc")]
+
+    scores = reranker.scores("query", candidates, budget_ms=10_000)
+
+    assert mock_cross_encoder.predict.call_count == 2
+    np.testing.assert_array_equal(scores, [1.0, 3.0, 2.0])
+
+
+def test_scores_cached_per_query_and_content_hash(mock_cross_encoder):
+    """Test a repeated (query, content hash) pair is not scored again"""
+    reranker = Reranker(mock_cross_encoder, batch_size=8)
+    candidates = [("h1", "a"), ("h2", "bbb")]
+
+    reranker.scores("query", candidates, budget_ms=10_000)
+    reranker.scores("query", candidates, budget_ms=10_000)
+    reranker.scores("other query", candidates[:1], budget_ms=10_000)
+
+    assert mock_cross_encoder.predict.call_count == 2
+    assert (reranker.cache_hits, reranker.cache_misses) == (2, 3)
+
+
+def test_scores_budget_exhausted(mock_cross_encoder):
+    """Test None is returned when the latency budget runs out"""
+    reranker = Reranker(mock_cross_encoder, batch_size=1)
+
+    assert reranker.scores("query", [("h1", "a")], budget_ms=0) is None
+    mock_cross_encoder.predict.assert_not_called()
+
+
+def test_rerank_records_orders_by_score(mock_cross_encoder):
+    """Test records are re-ordered by score and the score is appended"""
+    connector = Mock()
+    connector.execute_select.return_value = (
+        ["file_path", "md5", "left"],
+        [("a.py", "h1", "a"), ("b.py", "h2", "bbb"), ("c.py", "h3", "cc")],
+    )
+    records = [("a.py", 0.1), ("b.py", 0.2), ("c.py", 0.3)]
+
+    reranked = rerank_records(
+        connector, Reranker(mock_cross_encoder), "query", records, top_k=2
+    )
+
+    assert reranked == [("b.py", 0.2, 3.0), ("c.py", 0.3, 2.0)]
+
+
+def test_rerank_records_falls_back_to_vector_order(mocker, mock_cross_encoder):
+    """Test the vector order is kept when the budget runs out"""
+    connector = Mock()
+    connector.execute_select.return_value = ([], [])
+    reranker = Reranker(mock_cross_encoder)
+    mocker.patch.object(reranker, "scores", return_value=None)
+    records = [("a.py", 0.1), ("b.py", 0.2)]
+
+    reranked = rerank_records(connector, reranker, "query", records, top_k=5)
+
+    assert reranked == [("a.py", 0.1, None), ("b.py", 0.2, None)]
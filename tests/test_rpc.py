@@ -0,0 +1,136 @@
+import io
+import json
+import threading
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from codebase.daemon import DaemonState
+from codebase.rpc import (
+    INVALID_PARAMS,
+    METHOD_NOT_FOUND,
+    PARSE_ERROR,
+    REQUEST_CANCELLED,
+    RpcServer,
+)
+
+
+def request(request_id, method, **params) -> str:
+    return json.dumps(
+        {"jsonrpc": "2.0", "id": request_id, "method": method, "params": params}
+    )
+
+
+def messages(output: io.StringIO) -> list[dict]:
+    return [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+@pytest.fixture
+def server(mocker):
+    """模型与数据库均为 mock 的 RpcServer，输出写入 StringIO"""
+    model = Mock()
+    model.encode.return_value = np.zeros(4, dtype=np.float32)
+    connector = Mock()
+
+    def iter_select(sql, sql_params, batch_size):
+        yield ["file_path", "distance"]
+        yield [("a.py", 0.1), ("b.py", 0.2)]
+        yield [("c.py", 0.3)]
+
+    connector.iter_select.side_effect = iter_select
+    state = DaemonState(model)
+    mocker.patch.object(state, "connector", return_value=connector)
+    output = io.StringIO()
+    return RpcServer(state, output), output, model, connector
+
+
+def test_rpc_search_streams_rows(server):
+    """测试搜索结果按批以通知发送，最后返回行数；重复的查询文本不再生成向量"""
+    rpc, output, model, _ = server
+
+    rpc.serve(
+        [
+            request(1, "search", query_text="open database"),
+            request(2, "search", query_text="open database", limit=2),
+        ]
+    )
+
+    sent = messages(output)
+    assert [m.get("method") for m in sent] == [
+        "search/rows", "search/rows", None, "search/rows", None
+    ]
+    assert sent[0]["params"] == {
+        "id": 1,
+        "columns": ["file_path", "distance"],
+        "rows": [["a.py", 0.1], ["b.py", 0.2]],
+    }
+    assert sent[2] == {
+        "jsonrpc": "2.0",
+        "id": 1,
+        "result": {"columns": ["file_path", "distance"], "rows": 3},
+    }
+    assert sent[4]["result"]["rows"] == 2
+    model.encode.assert_called_once_with("open database")
+
+
+def test_rpc_cancel_running_search(server):
+    """测试取消正在执行的搜索：取消数据库上的语句，不再发送后续结果"""
+    rpc, _, _, connector = server
+    first_rows = threading.Event()
+    cancelled = threading.Event()
+    connector.conn.cancel.side_effect = cancelled.set
+
+    def iter_select(sql, sql_params, batch_size):
+        yield ["file_path", "distance"]
+        yield [("a.py", 0.1)]
+        # 模拟执行中的查询，直到被取消
+        cancelled.wait(5)
+        yield [("b.py", 0.2)]
+
+    connector.iter_select.side_effect = iter_select
+
+    class Output(io.StringIO):
+        def write(self, text):
+            if '"search/rows"' in text:
+                first_rows.set()
+            return super().write(text)
+
+    output = Output()
+    rpc.output = output
+
+    def lines():
+        yield request(1, "search", query_text="open database")
+        first_rows.wait(5)
+        yield json.dumps(
+            {"jsonrpc": "2.0", "method": "$/cancelRequest", "params": {"id": 1}}
+        )
+
+    rpc.serve(lines())
+
+    sent = messages(output)
+    assert len(sent) == 2
+    assert sent[0]["params"]["rows"] == [["a.py", 0.1]]
+    assert sent[1]["id"] == 1
+    assert sent[1]["error"]["code"] == REQUEST_CANCELLED
+    connector.conn.cancel.assert_called_once()
+
+
+def test_rpc_errors(server):
+    """测试无法解析的消息、未知方法和缺少查询文本时返回 JSON-RPC 错误"""
+    rpc, output, _, _ = server
+
+    rpc.serve(
+        [
+            "{not json",
+            request(1, "reindex"),
+            request(2, "search", query_text=""),
+            request(3, "ping"),
+        ]
+    )
+
+    sent = messages(output)
+    assert sent[0]["error"]["code"] == PARSE_ERROR
+    assert sent[1]["error"]["code"] == METHOD_NOT_FOUND
+    assert sent[2]["error"]["code"] == INVALID_PARAMS
+    assert sent[3]["result"] == "pong"
@@ -0,0 +1,335 @@
+from codebase.search import bound_snippets, format_snippet, truncate_utf8
+
+
+def test_truncate_utf8_keeps_whole_characters():
+    """测试按字节截断时不会切断多字节字符"""
+    assert truncate_utf8("abc", 10) == "abc"
+    assert truncate_utf8("中文代码", 7) == "中文"
+    assert len(truncate_utf8("中文代码", 7).encode("utf8")) <= 7
+
+
+def test_bound_snippets_response_budget():
+    """测试单条与整体响应的字节预算"""
+    snippets = ["a" * 10, "b" * 10, "c" * 10]
+
+    assert bound_snippets(snippets, 6, 100) == ["a" * 6, "b" * 6, "c" * 6]
+    assert bound_snippets(snippets, 10, 15) == ["a" * 10, "b" * 5, ""]
+
+
+def test_format_snippet_line_range():
+    """测试片段标题中的行号范围"""
+    assert format_snippet("a.py", 5, "x\ny\nz") == "==> a.py:5-7\nx\ny\nz\n"
+    assert format_snippet("a.py", 5, "") == ""
+
+
+def test_batch_search_groups_results_in_input_order():
+    """测试批量搜索按输入顺序分组结果，且只执行一次 SQL"""
+    import numpy as np
+    import pytest
+    from unittest.mock import Mock
+    from codebase.search import SearchError, batch_search
+
+    connector = Mock()
+    connector.execute_select.return_value = (
+        ["ord", "file_path", "distance"],
+        [(1, "a.py", 0.1), (1, "b.py", 0.2), (3, "c.py", 0.3)],
+    )
+    embeddings = np.zeros((3, 4), dtype=np.float32)
+
+    results = batch_search(connector, embeddings, top_k=2)
+
+    connector.execute_select.assert_called_once()
+    params = connector.execute_select.call_args.args[1]
+    assert len(params["embeddings"]) == 3
+    assert params["top_k"] == 2
+    assert results == [[("a.py", 0.1), ("b.py", 0.2)], [], [("c.py", 0.3)]]
+    assert connector.execute_select.call_args.kwargs["ef_search"] is None
+
+    # top_k 超过默认的 ef_search 时只在这次查询中调大；查询出错时报错，而不是每个查询都没有结果
+    connector.execute_select.return_value = []
+    with pytest.raises(SearchError):
+        batch_search(connector, embeddings, top_k=100)
+    assert connector.execute_select.call_args.kwargs["ef_search"] == 100
+
+
+def test_read_queries_file(tmp_path):
+    """测试读取 JSONL 查询文件"""
+    from codebase.search import read_queries_file
+
+    queries_file = tmp_path / "queries.jsonl"
+    queries_file.write_text('{"id": 1, "query": "parse config"}\n\n"open db"\n')
+
+    assert read_queries_file(str(queries_file)) == [
+        {"id": 1, "query": "parse config"},
+        {"query": "open db"},
+    ]
+
+
+def test_search_top_k_two_stage(mocker):
+    """测试 Matryoshka 两阶段检索的参数与 ef_search"""
+    import numpy as np
+    from unittest.mock import Mock
+    from codebase.search import TWO_STAGE_SEARCH_SQL, search_top_k
+
+    mocker.patch.dict(
+        "codebase.config.CONFIG",
+        {"matryoshka": {"enabled": True, "coarse_dim": 2, "candidates": 100}},
+    )
+    connector = Mock()
+    connector.execute_select.return_value = (["file_path", "distance"], [])
+
+    search_top_k(connector, np.array([3.0, 4.0, 1.0], dtype=np.float32), 10)
+
+    sql, params = connector.execute_select.call_args.args
+    assert connector.execute_select.call_args.kwargs["ef_search"] == 100
+    assert sql == TWO_STAGE_SEARCH_SQL
+    assert params["candidates"] == 100
+    assert params["top_k"] == 10
+    np.testing.assert_allclose(params["embedding_coarse"], [0.6, 0.8], rtol=1e-6)
+
+
+def test_write_rows_formats():
+    """测试 jsonl/json/tsv 三种流式输出格式"""
+    import io
+    import json
+    from codebase.search import write_rows
+
+    columns = ["file_path", "distance"]
+    batches = [[("a.py", 0.5)], [("b\tc.py", None)]]
+
+    out = io.StringIO()
+    write_rows(out, "jsonl", columns, iter(batches))
+    assert [json.loads(line) for line in out.getvalue().splitlines()] == [
+        {"file_path": "a.py", "distance": 0.5},
+        {"file_path": "b\tc.py", "distance": None},
+    ]
+
+    out = io.StringIO()
+    write_rows(out, "json", columns, iter(batches))
+    assert len(json.loads(out.getvalue())) == 2
+    out = io.StringIO()
+    write_rows(out, "json", columns, iter([]))
+    assert json.loads(out.getvalue()) == []
+
+    out = io.StringIO()
+    write_rows(out, "tsv", columns, iter(batches))
+    assert out.getvalue() == "file_path\tdistance\na.py\t0.5\nb\\tc.py\t\\N\n"
+
+
+def test_limit_batches_stops_and_closes_cursor():
+    """测试达到行数上限后不再读取，并关闭服务端游标"""
+    from codebase.search import limit_batches
+
+    closed = []
+
+    def batches():
+        try:
+            for i in range(100):
+                yield [i, i]
+        finally:
+            closed.append(True)
+
+    assert list(limit_batches(batches(), 3)) == [[0, 0], [1]]
+    assert closed == [True]
+    assert list(limit_batches(iter([[1, 2], [3]]), None)) == [[1, 2], [3]]
+
+
+def test_stream_search_uses_server_side_cursor():
+    """测试自定义 SQL 通过 iter_select 流式执行，第一批为列名"""
+    from unittest.mock import Mock
+    from codebase.search import stream_search
+
+    connector = Mock()
+    connector.iter_select.return_value = iter([["file_path"], [("a.py",)], [("b.py",)]])
+    model = Mock()
+    options = {
+        "query_text": "",
+        "sql": "SELECT file_path FROM code_chunks",
+        "rerank": False,
+    }
+
+    column_names, batches = stream_search(connector, lambda: model, options)
+
+    assert column_names == ["file_path"]
+    assert list(batches) == [[("a.py",)], [("b.py",)]]
+    connector.execute_select.assert_not_called()
+    model.encode.assert_not_called()
+
+
+def test_run_search_limit_applies_before_snippets(mocker):
+    """测试 --limit 在获取代码片段之前截断结果，只为输出的行获取片段；查询出错时没有结果"""
+    from unittest.mock import Mock
+    from codebase.search import run_search
+
+    mocker.patch.dict(
+        "codebase.config.CONFIG",
+        {"matryoshka": {"enabled": False}, "directory_index": {"enabled": False}},
+    )
+    connector = Mock()
+    connector.execute_select.return_value = (
+        ["file_path"],
+        [(f"{i}.py",) for i in range(10)],
+    )
+    connector.fetch_snippets.side_effect = lambda paths, *_: {
+        path: (1, "pass") for path in paths
+    }
+    options = {
+        "query_text": "",
+        "sql": "SELECT file_path FROM code_chunks",
+        "rerank": False,
+        "top_k": 10,
+        "snippets": True,
+        "snippet_lines": None,
+        "limit": 3,
+    }
+
+    _, records, snippet_blocks = run_search(connector, Mock(), options)
+
+    assert records == [("0.py",), ("1.py",), ("2.py",)]
+    assert len(snippet_blocks) == 3
+    assert connector.fetch_snippets.call_args.args[0] == ["0.py", "1.py", "2.py"]
+
+    connector.execute_select.return_value = []
+    assert run_search(connector, Mock(), options) == (None, [], [])
+
+
+def test_stream_main_reports_sql_errors(mocker, capsys):
+    """测试流式输出时错误的 --sql 打印错误信息并退出，而不是抛出异常"""
+    from argparse import Namespace
+    import psycopg
+    import pytest
+    from codebase.search import stream_main
+
+    def iter_select(sql, sql_params, batch_size):
+        raise psycopg.errors.SyntaxError('syntax error at or near "SELEC"')
+        yield
+
+    connector = mocker.patch("codebase.pgvector.PGVectorConnector").return_value
+    connector.iter_select.side_effect = iter_select
+    args = Namespace(dbname="", format="jsonl", limit=None, no_daemon=True)
+    options = {"query_text": "", "sql": "SELEC 1", "rerank": False, "snippets": False}
+
+    with pytest.raises(SystemExit):
+        stream_main(args, options)
+
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert 'ERROR: syntax error at or near "SELEC"' in captured.err
+
+
+def test_parse_like(tmp_path, monkeypatch):
+    """测试解析 path[:line]，绝对路径转换为相对于当前目录的路径"""
+    from codebase.search import parse_like
+
+    monkeypatch.chdir(tmp_path)
+    assert parse_like("src/a.py") == ("src/a.py", None)
+    assert parse_like("./src/a.py:42") == ("src/a.py", 42)
+    assert parse_like(str(tmp_path / "src" / "a.py") + ":7") == ("src/a.py", 7)
+    assert parse_like("src/") == ("src", None)
+
+
+def test_search_like_excludes_source_without_model():
+    """测试 --like 使用已存储的向量搜索，结果中不包含源文件本身"""
+    from unittest.mock import Mock
+
+    import numpy as np
+    from codebase.search import LIKE_FILE_SQL, search_like
+
+    embedding = np.ones(4, dtype=np.float32)
+    connector = Mock()
+    connector.execute_select.side_effect = [
+        (["file_path", "embedding"], [("src/a.py", embedding)]),
+        (
+            ["file_path", "distance"],
+            [("src/a.py", 0.0), ("src/b.py", 0.1), ("src/c.py", 0.2)],
+        ),
+    ]
+
+    sources, similar = search_like(connector, "src/a.py:3", top_k=1)
+
+    assert sources == ["src/a.py"]
+    assert similar == [("src/b.py", 0.1)]
+    lookup, ann = connector.execute_select.call_args_list
+    assert lookup.args == (LIKE_FILE_SQL, {"path": "src/a.py", "line": 3})
+    # 多取一行，以便排除源文件后仍有 top_k 个结果
+    assert ann.args[1]["top_k"] == 2
+    assert ann.args[1]["embedding"] is embedding
+
+    # ANN 查询出错时没有结果，而不是在解包时抛出 ValueError
+    connector.execute_select.side_effect = [
+        (["file_path", "embedding"], [("src/a.py", embedding)]),
+        [],
+    ]
+    assert search_like(connector, "src/a.py") == (["src/a.py"], [])
+
+
+def test_search_top_k_page_and_max_distance():
+    """测试分页与距离阈值：内层 LIMIT 为 offset + top_k，阈值和 OFFSET 只作用于这些行"""
+    import numpy as np
+    from unittest.mock import Mock
+    from codebase.search import PAGED_SEARCH_SQL, search_top_k
+
+    connector = Mock()
+    connector.execute_select.return_value = (["file_path", "distance"], [])
+
+    search_top_k(
+        connector, np.zeros(3), 10, two_stage=False, offset=40, max_distance=0.5
+    )
+
+    sql, params = connector.execute_select.call_args.args
+    assert sql == PAGED_SEARCH_SQL
+    assert (params["top_k"], params["offset"], params["max_distance"]) == (50, 40, 0.5)
+    # 只在这次查询中调大 ef_search
+    assert connector.execute_select.call_args.kwargs["ef_search"] == 50
+    connector.set_ef_search.assert_not_called()
+
+
+def test_search_top_k_directories(mocker):
+    """测试由粗到细的目录检索：配置开启后优先于两阶段检索，directories=0 时检索整个索引"""
+    import numpy as np
+    from unittest.mock import Mock
+    from codebase.search import (
+        DIRECTORY_SEARCH_SQL,
+        PAGED_DIRECTORY_SEARCH_SQL,
+        SEARCH_SQL,
+        search_top_k,
+    )
+
+    mocker.patch.dict(
+        "codebase.config.CONFIG",
+        {
+            "matryoshka": {"enabled": True, "coarse_dim": 2, "candidates": 100},
+            "directory_index": {"enabled": True, "directories": 8},
+        },
+    )
+    connector = Mock()
+    connector.execute_select.return_value = (["file_path", "distance"], [])
+    embedding = np.zeros(3)
+
+    search_top_k(connector, embedding, 10)
+    sql, params = connector.execute_select.call_args.args
+    assert sql == DIRECTORY_SEARCH_SQL
+    assert (params["directories"], params["top_k"]) == (8, 10)
+    # 不经过 HNSW 索引，不需要调大 ef_search
+    assert connector.execute_select.call_args.kwargs.get("ef_search") is None
+
+    search_top_k(connector, embedding, 10, offset=10, directories=2)
+    sql, params = connector.execute_select.call_args.args
+    assert sql == PAGED_DIRECTORY_SEARCH_SQL
+    assert (params["directories"], params["top_k"], params["offset"]) == (2, 20, 10)
+
+    search_top_k(connector, embedding, 10, two_stage=False, directories=0)
+    assert connector.execute_select.call_args.args[0] == SEARCH_SQL
+
+
+def test_directory_groups():
+    """测试按文件所在目录分组，目录按其最靠前的结果排序，根目录下的文件为 ''"""
+    from codebase.search import directory_groups
+
+    records = [("src/a.py", 0.1), ("b.py", 0.2), ("src/c.py", 0.3), ("src/x/d.py", 0.4)]
+
+    assert directory_groups(records) == {
+        "src/": [0, 2],
+        "": [1],
+        "src/x/": [3],
+    }
@@ -0,0 +1,119 @@
+"""
+启动时间回归测试：用 `python -X importtime` 检查每个子命令在真正需要模型或数据库之前
+导入的模块，确保重量级依赖被推迟到首次使用，并且总导入时间不超过预算。
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+# 子命令在开始工作前需要导入的模块
+SUBCOMMAND_IMPORTS = {
+    "config": ["codebase.cli", "codebase.config"],
+    "search": [
+        "codebase.cli",
+        "codebase.search",
+        "codebase.daemon",
+        "codebase.model_provider",
+        "codebase.pgvector",
+        "tabulate",
+    ],
+    "index": ["codebase.cli", "codebase.indexing"],
+    "serve": ["codebase.cli", "codebase.daemon", "codebase.model_provider"],
+}
+
+# 导入时间预算（毫秒），留有足够余量以免在较慢的机器上误报
+STARTUP_BUDGET_MS = {
+    "config": 150,
+    "search": 1500,
+    "index": 1500,
+    "serve": 800,
+}
+
+# 只有在首次编码时才应加载的模块
+MODEL_MODULES = {
+    "requests",
+    "torch",
+    "sentence_transformers",
+    "transformers",
+    "onnxruntime",
+    "optimum",
+}
+
+FORBIDDEN_MODULES = {
+    "config": MODEL_MODULES | {"numpy", "psycopg", "jsonc_parser"},
+    "search": MODEL_MODULES,
+    "index": MODEL_MODULES,
+    "serve": MODEL_MODULES | {"psycopg"},
+}
+
+
+def import_times(modules: list[str], env: dict) -> dict[str, tuple[int, int]]:
+    """在新进程中导入 modules，返回 {模块名: (累计导入时间(微秒), 缩进)}"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # 顶层导入的模块名前只有一个空格
+        indent = len(name) - len(name.lstrip())
+        times[name.strip()] = (int(cumulative), indent)
+    return times
+
+
+@pytest.fixture
+def startup_env(tmp_path):
+    """隔离的 XDG 目录，并写入一份用户配置"""
+    config_dir = tmp_path / "config" / "codebase"
+    config_dir.mkdir(parents=True)
+    (config_dir / "config.jsonc").write_text(
+        '{\n  // comment\n  "pgvector": {"dbname": "codebase_test"}\n}\n'
+    )
+    env = dict(os.environ)
+    env["XDG_CONFIG_HOME"] = str(tmp_path / "config")
+    env["XDG_CACHE_HOME"] = str(tmp_path / "cache")
+    return env
+
+
+@pytest.mark.parametrize("subcommand", list(SUBCOMMAND_IMPORTS))
+def test_subcommand_startup_budget(subcommand, startup_env, tmp_path):
+    """测试子命令启动时不导入模型相关的重量级模块，且导入时间在预算内"""
+    modules = SUBCOMMAND_IMPORTS[subcommand]
+    # 第一次运行生成配置缓存，第二次运行才是常见的启动路径
+    import_times(modules, startup_env)
+    times = import_times(modules, startup_env)
+
+    imported = {name.split(".")[0] for name in times}
+    assert not imported & FORBIDDEN_MODULES[subcommand]
+
+    total_ms = sum(
+        cumulative for cumulative, indent in times.values() if indent == 1
+    ) / 1000
+    assert total_ms < STARTUP_BUDGET_MS[subcommand], (
+        f"`codebase {subcommand}` imports took {total_ms:.0f} ms"
+    )
+
+
+def test_config_cache_is_invalidated_on_change(startup_env, tmp_path, monkeypatch):
+    """测试配置缓存以 mtime 为键，文件修改后重新解析"""
+    from codebase.config import load_jsonc
+
+    monkeypatch.setenv("XDG_CACHE_HOME", startup_env["XDG_CACHE_HOME"])
+    config_path = tmp_path / "config" / "codebase" / "config.jsonc"
+
+    assert load_jsonc(config_path) == {"pgvector": {"dbname": "codebase_test"}}
+    assert (tmp_path / "cache" / "codebase" / "config-cache.json").exists()
+
+    config_path.write_text('{"pgvector": {"dbname": "other_db"}} // changed\n')
+    os.utime(config_path, ns=(0, 10**18))
+    assert load_jsonc(config_path) == {"pgvector": {"dbname": "other_db"}}
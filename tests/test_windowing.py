@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from unittest.mock import Mock
+
+from codebase.windowing import TokenCounter, Windower, pool_windows
+
+
+def test_short_input_is_not_split():
+    """Inputs within max_tokens are sent unchanged"""
+    windower = Windower(TokenCounter(), max_tokens=100, overlap=10)
+
+    assert windower.split("short text") == [("short text", 10)]
+    assert windower.stats.split == 0
+
+
+def test_long_input_is_split_into_overlapping_windows():
+    """Without a tokenizer every 4 characters are one token"""
+    windower = Windower(TokenCounter(), max_tokens=4, overlap=1)
+    text = "abcdefghijklmnopqrstuvwxyz"  # 7 tokens
+
+    windows = windower.split(text)
+
+    assert windows == [("abcdefghijklmnop", 4), ("mnopqrstuvwxyz", 4)]
+    assert windower.stats.split == 1
+    assert windower.stats.windows == 2
+    assert windower.stats.truncated == 0
+
+
+def test_max_windows_truncates():
+    """Windows beyond max_windows are dropped and counted as truncated"""
+    windower = Windower(TokenCounter(), max_tokens=2, overlap=0, max_windows=2)
+
+    windows = windower.split("a" * 40)  # 10 tokens
+
+    assert [text for text, _ in windows] == ["a" * 8, "a" * 8]
+    assert windower.stats.truncated == 1
+
+
+def test_tokenizer_offsets(tmp_path):
+    """Windows follow the tokenizer's token boundaries"""
+    pytest.importorskip("tokenizers")
+    from tokenizers import Tokenizer, models, pre_tokenizers
+
+    tokenizer = Tokenizer(models.WordLevel({"[UNK]": 0}, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.save(str(tmp_path / "tokenizer.json"))
+    windower = Windower(
+        TokenCounter.for_model(str(tmp_path)), max_tokens=2, overlap=0
+    )
+
+    windows = windower.split("alpha beta gamma")
+
+    assert windows == [("alpha beta", 2), ("gamma", 1)]
+
+
+def test_encode_batch_pools_windows_in_one_call():
+    """All windows go out in one encode_batch call and are pooled per input"""
+    model = Mock()
+    model.encode_batch.return_value = np.array(
+        [[1.0, 0.0], [1.0, 0.0], [0.0, 1.0]], dtype=np.float32
+    )
+    windower = Windower(TokenCounter(), max_tokens=4, overlap=0)
+
+    embeddings = windower.encode_batch(model, ["short", "a" * 32])
+
+    assert len(model.encode_batch.call_args.args[0]) == 3
+    np.testing.assert_allclose(embeddings[0], [1.0, 0.0])
+    np.testing.assert_allclose(embeddings[1], [np.sqrt(0.5), np.sqrt(0.5)], rtol=1e-6)
+
+
+def test_pool_windows_weights_by_tokens():
+    """Longer windows weigh more in the pooled vector"""
+    embeddings = np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32)
+
+    pooled = pool_windows(embeddings, np.array([3.0, 1.0]))
+
+    np.testing.assert_allclose(pooled, np.array([3.0, 1.0]) / np.sqrt(10), rtol=1e-6)